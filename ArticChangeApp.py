@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
 import pandas as pd
 import numpy as np
 from datetime import datetime as dt
@@ -8,32 +15,104 @@ from dateutil.relativedelta import relativedelta
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from plotly.utils import PlotlyJSONEncoder
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+
+from others.scr.aggregates import point_stats
+from others.scr.datastore import TIME_COLUMN, open_store
+from others.scr.downsample import downsample
+from others.scr.export import FORMATS, export_chunks
+from others.scr.figcache import FigureCache
+from others.scr.httpcache import init_http
+from others.scr.metrics import in_callback, init_app, instrument, set_outcome, timed
+from others.scr.payload import b64array, compact_figure, date_array
+from others.scr.pyramid import build_pyramid, select_level, window, window_bounds
+from others.scr.raster import VIEWPORT, bin_points, cell_centers, colorize, corners_extent, image_layer, inverse_mercator, view_extent
+from others.scr.refresh import Dataset, Refresher
+from others.scr.spatial import points_in_polygon
 # --------------------
 # Read data
-data = pd.read_csv('others/AllData.csv', parse_dates=[1], index_col=[0])
-data = data.set_index('Datetime')
-data = data.resample('360T').mean()
-#data = data['30-05-2021':]
-data = data.reset_index()
-#data['CH4d_ppm'] = data['CH4d_ppm']
-data['Date'] = data['Datetime'].dt.strftime('%d-%m-%y %H:%M')
-data['CH4'] = data['CH4d_ppm'].round(2).astype(str)
-data['Temperature'] = data['Temp °C'].round(2).astype(str)
-data['Salinity'] = data['Sal psu'].round(2).astype(str)
-data['CO2'] = data['CO2d_ppm'].round(1).astype(str)
-data['Oxygen'] = data['ODO % sat'].round(1).astype(str)
-data['Turbidity'] = data['Turbidity FNU'].round(1).astype(str)
-data['Specific Conductivity \U0001D725\u2082\u2085'] = data['SpCond µS/cm'].round(1).astype(str)
+# Binary store written by others/scr/read_data.py (or converted with
+# others/scr/datastore.py), the csv is only used when there is no store.
+DATASTORE = os.environ.get('ARTIC_DATASTORE', 'others/AllData.store')
+# Maximum number of points sent per figure, sets the resolution of the plots
+POINT_BUDGET = int(os.environ.get('ARTIC_POINT_BUDGET', 5000))
+# Send only the changed properties (selection, colour range, time range) when
+# a selection changes, the full figures stay in the browser (map-base, ts-base)
+PARTIAL_UPDATES = os.environ.get('ARTIC_PARTIAL_UPDATES', '1') == '1'
+# 'client': selections are handled in the browser, 'server': by update_figures
+SELECTION_MODE = os.environ.get('ARTIC_SELECTION', 'client')
+# 'binary': numeric arrays and dates as base64 typed arrays, 'json': as lists
+PAYLOAD = os.environ.get('ARTIC_PAYLOAD', 'binary')
+# The time series reads at most TS_SCAN rows of the zoomed range (finest level
+# that fits) and plots TS_POINTS of them chosen by TS_DOWNSAMPLE ('minmax'
+# keeps every peak, 'lttb' the shape of the line)
+TS_POINTS = int(os.environ.get('ARTIC_TS_POINTS', 4000))
+TS_SCAN = int(os.environ.get('ARTIC_TS_SCAN', 200000))
+TS_DOWNSAMPLE = os.environ.get('ARTIC_TS_DOWNSAMPLE', 'minmax')
+# Below the map zoom RASTER_ZOOM the points are drawn as an image of cells of
+# RASTER_CELL screen pixels (others/scr/raster.py) made from at most
+# RASTER_SCAN rows, 0 always draws the markers
+RASTER_ZOOM = float(os.environ.get('ARTIC_RASTER_ZOOM', 4))
+RASTER_CELL = int(os.environ.get('ARTIC_RASTER_CELL', 4))
+RASTER_SCAN = int(os.environ.get('ARTIC_RASTER_SCAN', 1000000))
+# Save the pyramid in the store folder and memory-map it, the gunicorn
+# workers (and the next starts) share one copy of it (see gunicorn.conf.py)
+SHARED_PYRAMID = os.environ.get('ARTIC_SHARED_PYRAMID', '1') == '1'
+# Callback requests longer than ARTIC_SLOW_CALLBACK seconds are logged with
+# their inputs (not set: no log), metrics of all the callbacks on /metrics
+SLOW_CALLBACK = float(os.environ['ARTIC_SLOW_CALLBACK']) if os.environ.get('ARTIC_SLOW_CALLBACK') else None
+# Seconds between two checks of the data store for new rows (0: never)
+REFRESH = float(os.environ.get('ARTIC_REFRESH', 60))
+# Responses larger than ARTIC_COMPRESS_MIN_SIZE bytes are sent compressed
+# (brotli or gzip), see others/scr/httpcache.py
+COMPRESS = os.environ.get('ARTIC_COMPRESS', '1') == '1'
+COMPRESS_MIN_SIZE = int(os.environ.get('ARTIC_COMPRESS_MIN_SIZE', 500))
+# Downloads of /export streamed at the same time by a worker, more are refused
+EXPORT_SLOTS = int(os.environ.get('ARTIC_EXPORT_SLOTS', 2))
+# Threads building the map while the request thread builds the time series
+# when a callback updates both (0: one after the other)
+FIGURE_THREADS = int(os.environ.get('ARTIC_FIGURE_THREADS', 4))
+# 1-min, 10-min, hourly, 6-hourly and daily means as read-only arrays,
+# callbacks only take views of them (see others/scr/pyramid.py). Callbacks
+# use the dataset of refresher.dataset, replaced when the store changes.
+if os.path.exists(DATASTORE):
+    dataset = Dataset.from_store(DATASTORE, budget=POINT_BUDGET, shared=SHARED_PYRAMID)
+    refresher = Refresher(DATASTORE, dataset, interval=REFRESH, budget=POINT_BUDGET, shared=SHARED_PYRAMID)
+else:
+    data = pd.read_csv('others/AllData.csv', parse_dates=[1], index_col=[0])
+    dataset = Dataset(build_pyramid(data), budget=POINT_BUDGET)
+    refresher = None
+
+def add_labels(dff):
+    # date labels of the plotted rows only (json payloads)
+    dff['Date'] = pd.DatetimeIndex(dff['Datetime']).strftime('%d-%m-%y %H:%M').values
+    return dff
+
+def decimals(option_slctd):
+    if option_slctd in ('CH4d_ppm', 'Temp °C', 'Sal psu'):
+        return 2
+    return 1
+
+def current_dataset():
+    return dataset if refresher is None else refresher.dataset
+
+def last_reported(ds):
+    lat, lon, time = ds.last_position()
+    lastloc = '%.2f°N, %.2f°E'  % (lat, lon)
+    lastime = pd.Timestamp(time).strftime('%d-%m-%y %H:%M')
+    return 'Last location reported: ' + lastloc, 'Last date reported: ' + lastime
 
 mapbox_access_token = open(".mapbox_token").read()
-lastloc = '%.2f°N, %.2f°E'  % (data['Latitude'].iloc[-1], data['Longitude'].iloc[-1])
-lastime = data['Date'].iloc[-1]
+lastloc, lastime = last_reported(dataset)
+mindate_data = pd.Timestamp(dataset.data['Datetime'][0])
+maxdate_data = pd.Timestamp(dataset.data['Datetime'][-1])
 
 epoch = dt.utcfromtimestamp(0)
 
@@ -53,8 +132,43 @@ def get_marks_from_start_end(start, end):
     return {int(unix_time_millis(result[i])):{'label': result[i].strftime('%d.%m.%Y'), 'style': {'color':'white'}} for i in index}
 #------------------------------------------------------------------
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SUPERHERO])
+# compression is set up by init_http (threshold, brotli) instead of Dash
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SUPERHERO], compress=False)
 server = app.server
+init_http(server, compress=COMPRESS, min_size=COMPRESS_MIN_SIZE, assets_path=app.get_asset_url(''))
+init_app(server, slow=SLOW_CALLBACK)
+
+def asset_url(path):
+    # URL of an asset with its modification time, cached as immutable
+    mtime = int(os.path.getmtime(os.path.join(app.config.assets_folder, path)))
+    return '%s?m=%i' % (app.get_asset_url(path), mtime)
+
+# Figures already built for a (variable, dates, selection), set ARTIC_CACHE_DB
+# to a sqlite file to share them between the gunicorn workers
+figcache = FigureCache(
+        maxsize=int(os.environ.get('ARTIC_CACHE_SIZE', 128)),
+        path=os.environ.get('ARTIC_CACHE_DB'),
+        dumps=lambda value: json.dumps(value, cls=PlotlyJSONEncoder),
+        )
+
+# threads are started on the first submit, in the gunicorn workers
+figure_pool = ThreadPoolExecutor(FIGURE_THREADS, thread_name_prefix='figures') if FIGURE_THREADS > 0 else None
+
+def invalidate_figures(old, new, since):
+    # figures showing data from since onwards (or the whole record)
+    if since is None:
+        figcache.clear()
+        return
+    day = str(pd.Timestamp(since).date())
+    figcache.discard(lambda key: key[2] is None or key[2] >= day)
+
+if refresher is not None and REFRESH > 0:
+    refresher.on_swap = invalidate_figures
+
+    @server.before_request
+    def start_refresher():
+        # started in the worker (after the fork of gunicorn), not at import
+        refresher.start()
 
 #------------------------------------------------------------------
 # Cards
@@ -103,16 +217,34 @@ server = app.server
 #         outline=False,
 #         )}}}
 
+variable_options = [
+        {"label":"Carbon Dioxide", "value":'CO2d_ppm'},
+        {"label":"Methane", "value":"CH4d_ppm"},
+        {"label":"Temperature", "value":"Temp °C"},
+        {"label":"Salinity", "value":'Sal psu'},
+        {"label":"Oxygen saturation", "value":'ODO % sat'},
+        {"label":"Turbidity", "value":'Turbidity FNU'},
+        {"label":"Specific Conductivity", "value":'SpCond µS/cm'},
+        ]
+# titles of the time series and the map of every variable (set below)
+titles_store = dcc.Store(id='titles')
+
 graph_card = dbc.Card(# {{{
         [
             dbc.CardHeader(id='map_title'),#, className='card-title', style={'margin-left':5, 'margin-top':5}),
-            dcc.Graph(id='map', figure={}, responsive='auto')#, style={'height': '80vh'}),
+            dcc.Graph(id='map', figure={}, responsive='auto'),#, style={'height': '80vh'}),
+            dcc.Store(id='map-base'),
+            dcc.Store(id='map-view'),
+            dcc.Store(id='selection-prev'),
         ]
     )
 time_plots = dbc.Card(
         [
             dbc.CardHeader(id='time_series_title'),#, className='card-title', style={'margin-left':5, 'margin-top':5}),
-            dcc.Graph(id='time-series', figure={}, responsive='auto')#, style={'height':'25vh'}),
+            dcc.Graph(id='time-series', figure={}, responsive='auto'),#, style={'height':'25vh'}),
+            dcc.Store(id='ts-base'),
+            dcc.Store(id='fig-patch'),
+            titles_store,
         ],
         color='secondary', inverse=False,
     )# }}}
@@ -130,8 +262,9 @@ app.layout = dbc.Container(
                         ),
                     dbc.Col(
                         [
-                            html.H6('Last location reported: ' + lastloc, style={'text-align':'right'}),
-                            html.H6('Last date reported: ' + lastime, style={'text-align':'right'}),
+                            html.H6(lastloc, id='last_location', style={'text-align':'right'}),
+                            html.H6(lastime, id='last_date', style={'text-align':'right'}),
+                            dcc.Interval(id='refresh', interval=max(REFRESH, 1)*1000, disabled=refresher is None or REFRESH <= 0),
                             ],
                         width={'size':5, 'offset':1}, xl={'size':4, 'offset':1}, #style={'height':'100%', 'background-color':'green'}
                         ),
@@ -147,15 +280,7 @@ app.layout = dbc.Container(
                             html.H6('Select variable:'),
                             dcc.Dropdown(
                                 id='slct_var',# {{{
-                                options=[
-                                    {"label":"Carbon Dioxide", "value":'CO2d_ppm'},
-                                    {"label":"Methane", "value":"CH4d_ppm"},
-                                    {"label":"Temperature", "value":"Temp °C"},
-                                    {"label":"Salinity", "value":'Sal psu'},
-                                    {"label":"Oxygen saturation", "value":'ODO % sat'},
-                                    {"label":"Turbidity", "value":'Turbidity FNU'},
-                                    {"label":"Specific Conductivity", "value":'SpCond µS/cm'},
-                                    ],
+                                options=variable_options,
                                 multi=False,
                                 optionHeight=35,
                                 value='CO2d_ppm',
@@ -183,9 +308,9 @@ app.layout = dbc.Container(
                                              html.H6('Select dates:'),
                                              dcc.DatePickerRange(# {{{
                                                  id='date_range',
-                                                 min_date_allowed=data.Datetime.min(),
-                                                 max_date_allowed=data.Datetime.max(),
-                                                 initial_visible_month=data.Datetime.mean(),
+                                                 min_date_allowed=mindate_data,
+                                                 max_date_allowed=maxdate_data,
+                                                 initial_visible_month=mindate_data + (maxdate_data - mindate_data)/2,
                                                  clearable=False,
                                                  display_format='D.M.YYYY',
                                                  ),# }}}
@@ -195,7 +320,11 @@ app.layout = dbc.Container(
                                          #style={'backgroundColor':'red'}
                                          ),
                                      dbc.Col(
-                                         dbc.Button('Clear selection', id='button-clear', n_clicks=0, color='success', style={'padding-left':2, 'padding-right':2}),
+                                         [
+                                             dbc.Button('Clear selection', id='button-clear', n_clicks=0, color='success', style={'padding-left':2, 'padding-right':2}),
+                                             # rows of the variable and dates (/export)
+                                             html.A('Export CSV', id='export-link', href='export', download='', className='btn btn-secondary', style={'padding-left':2, 'padding-right':2, 'margin-top':4}),
+                                             ],
                                          width={'size':4, 'offset':0},
                                          lg={'size':3, 'offset':0},
                                          #style={'backgroundColor':'blue'}
@@ -234,7 +363,7 @@ app.layout = dbc.Container(
             dbc.Row(
                     [
                         dbc.Col(
-                            dbc.CardImg(src='/assets/AQUATIC_PHYSICS-Narrow-rgb_whiteletters.png', style={'width':'100%'}),
+                            dbc.CardImg(src=asset_url('AQUATIC_PHYSICS-Narrow-rgb_whiteletters.png'), style={'width':'100%'}),
                             width={'offset':4, 'size':4},
                             lg={'offset':5, 'size':2}
                             )
@@ -251,104 +380,491 @@ app.layout = dbc.Container(
 
 #------------------------------------------------------------------
 # Connect Plotly with Dash Components
-selectedTS_prev = None
-selectedMap_prev = None
-@app.callback(
-         [
-             Output(component_id='map', component_property='figure'),# {{{
-             Output(component_id='time-series', component_property='figure'),
-             Output(component_id='average_value', component_property='children'),
-             Output(component_id='time_series_title', component_property='children'),
-             Output(component_id='map_title', component_property='children'),# }}}
-             ],
-         [
-             Input(component_id='slct_var', component_property='value'),# {{{
-             #Input(component_id='date-slider', component_property='value'),
-             Input(component_id='date_range', component_property='start_date'),
-             Input(component_id='date_range', component_property='end_date'),
-             Input(component_id='map', component_property='selectedData'),
-             Input('time-series', 'selectedData')# }}}
-             ],
-             )
-
-def update_figures(option_slctd, start_date, end_date, selectedMap, selectedTS):
-    global data
-    global selectedTS_prev
-    global selectedMap_prev
-
-    dff = data.copy()
-    selectedpoints = dff.index.values
+def update_figures(option_slctd, start_date, end_date, selectedMap=None, selectedTS=None, relayoutTS=None, mapView=None, selectionPrev=None):
+    # last selections applied in this browser session (selection-prev store,
+    # digests of selectedData), any worker can serve the next request
+    selectionPrev = selectionPrev or {}
+    selectedMap_prev = selectionPrev.get('map')
+    selectedTS_prev = selectionPrev.get('ts')
     # Change in slider
     #mindate = dt.utcfromtimestamp(slider_value[0]*24*60)
     #maxdate = dt.utcfromtimestamp(slider_value[1]*24*60)
-    if start_date is not None and end_date is not None:
-        mindate = dt.strptime(start_date, '%Y-%m-%d')
-        maxdate = dt.strptime(end_date, '%Y-%m-%d')
-    else:
-        mindate = dff.Datetime.min()
-        maxdate = dff.Datetime.max()
-    minindex = dff.loc[dff['Datetime'] >= mindate, :].index.values[0]
-    maxindex = dff.loc[dff['Datetime'] <= maxdate, :].index.values[-1]
-    if selectedMap is not None and selectedMap_prev != selectedMap:
-        selectedpoints = get_indexpoint(selectedMap)
+    mindate, maxdate = picker_dates(start_date, end_date)
+    triggered = triggered_props()
+    zoom = None
+    if 'time-series.relayoutData' in triggered:
+        zoom = relayout_zoom(relayoutTS)
+    # the same dataset for the whole callback, even if a new one is swapped in
+    ds = current_dataset()
+    # finest resolution with less than POINT_BUDGET points in the date range
+    rule, level, i0, i1 = select_level(ds.pyramid, mindate, maxdate, POINT_BUDGET)
+    times = level['Datetime'][i0:i1]
+    # extent of the map image, None when the points are drawn as markers
+    extent = raster_extent(level['Latitude'][i0:i1], level['Longitude'][i0:i1], mapView)
+    selectedpoints = np.arange(i1 - i0)
+    minindex = 0
+    maxindex = i1 - i0 - 1
+    if selectedMap is not None and selectedMap_prev != digest(selectedMap):
+        selectedpoints = map_selection(ds, selectedMap, rule, i0, i1)
         if selectedpoints:
-            minindex = dff.loc[selectedpoints].Datetime.index.values[0]
-            maxindex = dff.loc[selectedpoints].Datetime.index.values[-1]
-            selectedMap_prev = selectedMap
-    elif selectedTS is not None and selectedTS_prev != selectedTS:
-        selectedpoints = get_indexpoint(selectedTS)
+            minindex = min(selectedpoints)
+            maxindex = max(selectedpoints)
+            selectedMap_prev = digest(selectedMap)
+    elif selectedTS is not None and selectedTS_prev != digest(selectedTS):
+        selectedpoints = ts_selection(ds, selectedTS, option_slctd, times)
         if selectedpoints:
-            minindex = dff.loc[selectedpoints].Datetime.index.values[0]
-            maxindex = dff.loc[selectedpoints].Datetime.index.values[-1]
-            selectedTS_prev = selectedTS
+            minindex = min(selectedpoints)
+            maxindex = max(selectedpoints)
+            selectedTS_prev = digest(selectedTS)
     else:
         selectedpoints = selectedpoints[minindex:maxindex+1]
+    prev = {'map': selectedMap_prev, 'ts': selectedTS_prev}
+    if prev == {'map': selectionPrev.get('map'), 'ts': selectionPrev.get('ts')}:
+        # sent back only when a new selection was applied
+        prev = dash.no_update
+    if PARTIAL_UPDATES and triggered and all(t.endswith('.selectedData') for t in triggered):
+        # selection only, the figures in map-base and ts-base are unchanged
+        vstats = selection_stats(ds, rule, level, option_slctd, i0, selectedpoints)
+        if len(selectedpoints) == i1 - i0:
+            selection = None
+        else:
+            selection = np.asarray(selectedpoints)
+        patch = {
+            'map': {'data': {-1: dict(selectedpoints=selection, **colorrange(vstats, option_slctd, 'marker.'))}},
+            'ts': {'layout': {'xaxis.range': [pd.Timestamp(times[minindex]), pd.Timestamp(times[maxindex])]}},
+            }
+        if extent is not None:
+            # the image is not redrawn for a selection, the map is unchanged
+            patch['map'] = {}
+        average_str = 'Average value: %.2f %s' % (vstats['mean'], units(option_slctd))
+        set_outcome('patch')
+        return dash.no_update, dash.no_update, patch, average_str, prev
+    if PARTIAL_UPDATES and triggered == ['time-series.relayoutData']:
+        # zoom on the time series, only its points are read again
+        figtime, _ = time_series_output(ds, option_slctd, start_date, end_date, zoom)
+        set_outcome('ts_zoom')
+        return dash.no_update, figtime, dash.no_update, dash.no_update, prev
+    vstats = selection_stats(ds, rule, level, option_slctd, i0, selectedpoints)
+    plotted = rule, level, i0, i1
+    if triggered == ['map-view.data']:
+        # zoom on the map across RASTER_ZOOM or inside the image mode
+        figmap, _ = map_output(ds, option_slctd, start_date, end_date, plotted, selectedpoints, vstats, extent)
+        set_outcome('map_view')
+        return figmap, dash.no_update, dash.no_update, dash.no_update, prev
+    xrange = [times[minindex], times[maxindex]] if len(times) else None
+    (figmap, map_hit), (figtime, ts_hit) = concurrently(
+            lambda: map_output(ds, option_slctd, start_date, end_date, plotted, selectedpoints, vstats, extent),
+            lambda: time_series_output(ds, option_slctd, start_date, end_date, zoom, xrange),
+            )
+    if map_hit and ts_hit:
+        set_outcome('cache_hit')
+    average_str = 'Average value: %.2f %s' % (vstats['mean'], units(option_slctd))
+    return figmap, figtime, {}, average_str, prev
+
+def concurrently(first, second):
+    # results of first() (run in figure_pool) and second() (this thread)
+    if figure_pool is None:
+        return first(), second()
+    future = figure_pool.submit(in_callback(first))
+    result = second()
+    return future.result(), result
+
+def relayout_zoom(relayoutTS):
+    # time range of a relayout of the time series (None when reset)
+    zoom = zoom_range(relayoutTS)
+    if zoom is None and not (relayoutTS or {}).get('xaxis.autorange'):
+        # no change of the time axis (autosize, y zoom, drag mode)
+        raise PreventUpdate
+    return zoom
+
+def map_output(ds, option_slctd, start_date, end_date, plotted, selectedpoints, vstats, extent=None):
+    # map of the plotted window (rule, level, i0, i1) from figcache or built,
+    # with True when it was cached
+    rule, level, i0, i1 = plotted
+    mindate, maxdate = picker_dates(start_date, end_date)
+    key = (option_slctd, start_date, end_date, 'map', fingerprint(selectedpoints), str(extent))
+    figmap = figcache.get(key)
+    if figmap is not None:
+        if mindate is not None:
+            # the grey track may have grown since the figure was cached
+            figmap = with_track(figmap, ds.track)
+        return figmap, True
+    figmap = map_figure(ds, option_slctd, mindate, maxdate, rule, level, i0, i1, selectedpoints, vstats, extent)
+    figcache.set(key, figmap)
+    return figmap, False
+
+def time_series_output(ds, option_slctd, start_date, end_date, zoom=None, xrange=None):
+    # time series from figcache or built, with True when it was cached
+    key = (option_slctd, start_date, end_date, 'ts', str(zoom), str(xrange))
+    figtime = figcache.get(key)
+    if figtime is not None:
+        return figtime, True
+    mindate, maxdate = picker_dates(start_date, end_date)
+    figtime = time_series(ds, option_slctd, mindate, maxdate, zoom, xrange)
+    figcache.set(key, figtime)
+    return figtime, False
+
+@timed('map')
+def map_figure(ds, option_slctd, mindate, maxdate, rule, level, i0, i1, selectedpoints, vstats, extent=None):
+    if mindate is not None:
+        # coarse view of the whole track around the selected dates
+        track = ds.track
+    else:
+        track = None
     colorscale, rev = colorscalesmap(option_slctd)
-    figmap = create_map(dff, option_slctd, selectedpoints, colorscale, rev)
-    figtime = create_time_series(dff, option_slctd, selectedpoints, minindex, maxindex)
-    sc = dff.iloc[selectedpoints][option_slctd]
-    average = sc.mean()
-    average_str = 'Average value: %.2f %s' % (average, units(option_slctd))
-    title_TS = title_timeseries(option_slctd)
-    title_Map = title_timeseries(option_slctd, 'map')
-    return figmap, figtime, average_str, title_TS, title_Map
+    if extent is not None:
+        figmap = raster_map(ds, option_slctd, mindate, maxdate, extent, colorscale, rev, vstats, track)
+    else:
+        # dff holds views of the level, nothing is copied
+        dff = window(level, i0, i1)
+        if PAYLOAD == 'json':
+            dff = add_labels(dff)
+        figmap = create_map(dff, option_slctd, selectedpoints, colorscale, rev, vstats, track)
+        if PAYLOAD == 'binary':
+            figmap = compact_map(figmap, dff, option_slctd, track)
+        else:
+            figmap = compact_figure(figmap, {})
+        # dates of the map points, the time series is linked to the map by time
+        figmap['times'] = date_array(level['Datetime'][i0:i1])
+    # zoom where the browser asks for another map (assets/articplots.js)
+    figmap['raster'] = {'zoom': RASTER_ZOOM, 'active': extent is not None}
+    return figmap
+
+if SELECTION_MODE == 'server':
+    app.callback(
+             [
+                 Output(component_id='map-base', component_property='data'),# {{{
+                 Output(component_id='ts-base', component_property='data'),
+                 Output(component_id='fig-patch', component_property='data'),
+                 Output(component_id='average_value', component_property='children'),
+                 Output('selection-prev', 'data'),# }}}
+                 ],
+             [
+                 Input(component_id='slct_var', component_property='value'),# {{{
+                 #Input(component_id='date-slider', component_property='value'),
+                 Input(component_id='date_range', component_property='start_date'),
+                 Input(component_id='date_range', component_property='end_date'),
+                 Input(component_id='map', component_property='selectedData'),
+                 Input('time-series', 'selectedData'),
+                 Input('time-series', 'relayoutData'),
+                 Input('map-view', 'data')# }}}
+                 ],
+             [State('selection-prev', 'data')],
+                 )(instrument('update_figures')(update_figures))
+    # Figures shown = base figures + patch, applied in the browser
+    # (assets/articplots.js)
+    app.clientside_callback(
+            ClientsideFunction(namespace='articplots', function_name='apply_patch'),
+            [Output('map', 'figure'), Output('time-series', 'figure')],
+            [Input('map-base', 'data'), Input('ts-base', 'data'), Input('fig-patch', 'data')],
+            )
+else:
+    # The map and the time series are separate callbacks: the browser sends
+    # both requests at once for a new variable or new dates, a zoom on one of
+    # them only rebuilds it
+    @app.callback(
+             Output(component_id='map-base', component_property='data'),
+             [
+                 Input(component_id='slct_var', component_property='value'),# {{{
+                 Input(component_id='date_range', component_property='start_date'),
+                 Input(component_id='date_range', component_property='end_date'),
+                 Input('map-view', 'data'),# }}}
+                 ],
+                 )
+    @instrument('update_map')
+    def update_map(option_slctd, start_date, end_date, mapView):
+        ds = current_dataset()
+        mindate, maxdate = picker_dates(start_date, end_date)
+        rule, level, i0, i1 = select_level(ds.pyramid, mindate, maxdate, POINT_BUDGET)
+        extent = raster_extent(level['Latitude'][i0:i1], level['Longitude'][i0:i1], mapView)
+        selectedpoints = np.arange(i1 - i0)
+        vstats = selection_stats(ds, rule, level, option_slctd, i0, selectedpoints)
+        figmap, hit = map_output(ds, option_slctd, start_date, end_date, (rule, level, i0, i1), selectedpoints, vstats, extent)
+        if hit:
+            set_outcome('cache_hit')
+        return figmap
+
+    @app.callback(
+             Output(component_id='ts-base', component_property='data'),
+             [
+                 Input(component_id='slct_var', component_property='value'),# {{{
+                 Input(component_id='date_range', component_property='start_date'),
+                 Input(component_id='date_range', component_property='end_date'),
+                 Input('time-series', 'relayoutData'),# }}}
+                 ],
+                 )
+    @instrument('update_time_series')
+    def update_time_series(option_slctd, start_date, end_date, relayoutTS):
+        zoom = None
+        if 'time-series.relayoutData' in triggered_props():
+            zoom = relayout_zoom(relayoutTS)
+        ds = current_dataset()
+        xrange = None
+        if zoom is None:
+            # time range of the map
+            mindate, maxdate = picker_dates(start_date, end_date)
+            _, level, i0, i1 = select_level(ds.pyramid, mindate, maxdate, POINT_BUDGET)
+            if i1 > i0:
+                xrange = [level['Datetime'][i0], level['Datetime'][i1 - 1]]
+        figtime, hit = time_series_output(ds, option_slctd, start_date, end_date, zoom, xrange)
+        if hit:
+            set_outcome('cache_hit')
+        return figtime
+
+    # Selections are highlighted and averaged in the browser from the data of
+    # the figures, no request is sent to the server (assets/articplots.js)
+    app.clientside_callback(
+            ClientsideFunction(namespace='articplots', function_name='select'),
+            [
+                Output('map', 'figure'),
+                Output('time-series', 'figure'),
+                Output('average_value', 'children'),
+                Output('average_value', 'title'),
+                ],
+            [
+                Input('map-base', 'data'),
+                Input('ts-base', 'data'),
+                Input('map', 'selectedData'),
+                Input('time-series', 'selectedData'),
+                ],
+            )
+
+# Export link of the variable and dates shown
+app.clientside_callback(
+        ClientsideFunction(namespace='articplots', function_name='export_link'),
+        Output('export-link', 'href'),
+        [Input('slct_var', 'value'), Input('date_range', 'start_date'), Input('date_range', 'end_date')],
+        )
+
+# Map zooms are sent to the server only when the map changes between markers
+# and image or when the image has to be drawn again
+app.clientside_callback(
+        ClientsideFunction(namespace='articplots', function_name='map_view'),
+        Output('map-view', 'data'),
+        [Input('map', 'relayoutData')],
+        [State('map-base', 'data')],
+        )
+
+@timed('stats')
+def selection_stats(ds, rule, level, option_slctd, i0, selectedpoints):
+    # statistics of the selected rows, O(1) when they are contiguous
+    points = np.asarray(selectedpoints, dtype='int64')
+    if len(points) and points.max() - points.min() + 1 == len(points):
+        return ds.levelstats[rule].stats(option_slctd, i0 + points.min(), i0 + points.max() + 1)
+    return point_stats(level[option_slctd][i0 + points])
+
+def triggered_props():
+    # inputs that fired the callback, none when called outside a request
+    if not flask.has_request_context():
+        return []
+    return [p['prop_id'] for p in dash.callback_context.triggered]
+
+def digest(selectedData):
+    # short, order independent id of a selectedData (stored in the browser)
+    return hashlib.sha1(json.dumps(selectedData, sort_keys=True).encode('utf-8')).hexdigest()
+
+def fingerprint(selectedpoints):
+    points = np.asarray(selectedpoints, dtype='int64')
+    return hashlib.sha1(points.tobytes()).hexdigest()
+
+@server.route('/cache-stats')
+def cache_stats():
+    return flask.jsonify(figcache.stats())
+
+def picker_dates(start_date, end_date):
+    # datetimes of the date picker, None when the range is not set
+    if start_date is not None and end_date is not None:
+        return dt.strptime(start_date, '%Y-%m-%d'), dt.strptime(end_date, '%Y-%m-%d')
+    return None, None
+
+export_slots = threading.BoundedSemaphore(EXPORT_SLOTS)
+
+@server.route('/export')
+def export():
+    # rows of some variables between the dates of the picker, streamed block
+    # by block (others/scr/export.py):
+    # /export?variables=CO2d_ppm,CH4d_ppm&start=2020-06-20&end=2020-06-22&resolution=display&format=csv
+    # resolution: display (level plotted for the dates), raw (1-minute rows
+    # of the data store) or a level of the pyramid (10T, 60T, ...)
+    args = flask.request.args
+    ds = current_dataset()
+    fmt = args.get('format', 'csv')
+    resolution = args.get('resolution', 'display')
+    try:
+        mindate, maxdate = picker_dates(args.get('start') or None, args.get('end') or None)
+    except ValueError:
+        flask.abort(400, 'Dates must be YYYY-MM-DD')
+    levels = dict(ds.pyramid)
+    if resolution == 'raw' and os.path.exists(DATASTORE):
+        # store mapped again: the rows written until now, never copied
+        columns = open_store(DATASTORE)
+        columns[TIME_COLUMN] = columns[TIME_COLUMN].view('datetime64[ns]')
+    elif resolution == 'raw':
+        columns = ds.data
+    elif resolution == 'display':
+        columns = select_level(ds.pyramid, mindate, maxdate, POINT_BUDGET)[1]
+    elif resolution in levels:
+        columns = levels[resolution]
+    else:
+        flask.abort(400, 'Unknown resolution %s' % resolution)
+    positions = ['Datetime', 'Latitude', 'Longitude']
+    variables = [v for v in args.get('variables', '').split(',') if v] or [c for c in columns if c not in positions]
+    unknown = [v for v in variables if v not in columns]
+    if unknown or fmt not in FORMATS:
+        flask.abort(400, 'Unknown variables %s or format %s' % (', '.join(unknown), fmt))
+    names = positions + [v for v in variables if v not in positions]
+    i0, i1 = window_bounds(columns, mindate, maxdate)
+    if not export_slots.acquire(blocking=False):
+        return flask.Response('Too many exports running, try again later\n', status=429, headers={'Retry-After': '30'})
+    filename = 'articplots_%s_%s.%s' % (args.get('start') or 'all', args.get('end') or 'all', fmt)
+    response = flask.Response(export_chunks(columns, names, i0, i1, fmt), mimetype=FORMATS[fmt],
+                              headers={'Content-Disposition': 'attachment; filename="%s"' % filename})
+    # also when the download is interrupted
+    response.call_on_close(export_slots.release)
+    return response
 
 def calc_zoom(min_lat, max_lat, min_lng, max_lng):
 
-    width_y = max_lat - min_lat
-    width_x = max_lng - min_lng
+    # a single point is shown as a box of MIN_SPAN degrees
+    width_y = max(max_lat - min_lat, MIN_SPAN)
+    width_x = max(max_lng - min_lng, MIN_SPAN)
     zoom_y = -1.446*np.log(width_y) + 7.2753
     zoom_x = -1.415*np.log(width_x) + 8.7068
     return min(round(zoom_y, 2), round(zoom_x, 2))
 
-def create_map(dff, option_slctd, selectedpoints, cscale, rev):# {{{
+# view of the map without points (empty date range or no position), the
+# area of the cruise, and smallest box in degrees of the zoom on points
+MAP_CENTER = dict(lat=69., lon=8.)
+MAP_ZOOM = 2.4
+MIN_SPAN = 0.01
+
+def map_center(lat, lon):
+    # initial center and zoom of the map showing the points
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    valid = ~np.isnan(lat) & ~np.isnan(lon)
+    if not valid.any():
+        return dict(MAP_CENTER), MAP_ZOOM
+    minlat, maxlat = lat[valid].min(), lat[valid].max()
+    minlon, maxlon = lon[valid].min(), lon[valid].max()
+    midlat = (1.15*maxlat+minlat)/2.
+    midlon = (maxlon+minlon)/2.
+    return dict(lat=midlat, lon=midlon), calc_zoom(minlat, maxlat, minlon, maxlon)
+
+def raster_extent(lat, lon, mapView):
+    # extent of the map image for the zoom of the map, None for markers
+    if RASTER_ZOOM <= 0 or len(lat) == 0 or np.isnan(lat).all():
+        return None
+    if mapView:
+        center, zoom = mapView['center'], mapView['zoom']
+    else:
+        center, zoom = map_center(lat, lon)
+    if zoom >= RASTER_ZOOM:
+        return None
+    if mapView and mapView.get('coordinates'):
+        extent = corners_extent(mapView['coordinates'])
+    else:
+        extent = view_extent(center, zoom)
+    # part of the key of the cached maps
+    return tuple(round(float(v), 4) for v in extent)
+
+@timed('raster')
+def raster_map(ds, option_slctd, mindate, maxdate, extent, cscale, rev, vstats, track=None):
+    # map with the points binned into an image of the extent, the hover and
+    # the selections use an invisible marker at the center of every cell
+    rule, level, i0, i1 = select_level(ds.pyramid, mindate, maxdate, RASTER_SCAN)
+    shape = (VIEWPORT[1]//RASTER_CELL, VIEWPORT[0]//RASTER_CELL)
+    grid = bin_points(level['Latitude'][i0:i1], level['Longitude'][i0:i1], level[option_slctd][i0:i1], extent, shape)
+    cells = np.flatnonzero(grid['count'].ravel())
+    if vstats['count']:
+        crange = colorrange(vstats, option_slctd)
+        if 'cmid' in crange:
+            # same limits as the markers centred on the mean
+            half = max(abs(vstats['min'] - vstats['mean']), abs(vstats['max'] - vstats['mean']))
+            vmin, vmax = vstats['mean'] - half, vstats['mean'] + half
+        else:
+            vmin, vmax = vstats['min'], vstats['max']
+    elif len(cells):
+        vmin, vmax = np.nanmin(grid['min']), np.nanmax(grid['max'])
+    else:
+        vmin, vmax = 0., 1.
+    lat, lon = cell_centers(extent, shape)
+    dcells = {
+        'Latitude': lat.ravel()[cells],
+        'Longitude': lon.ravel()[cells],
+        option_slctd: grid['mean'].ravel()[cells],
+        }
+    with np.errstate(divide='ignore'):
+        fig = create_map(dcells, option_slctd, np.arange(len(cells)), cscale, rev, vstats, track)
+    # view of the image (create_map centres on the cells)
+    lon0, lon1, y0, y1 = extent
+    fig.update_layout(
+            mapbox_center=dict(lat=float(inverse_mercator((y0 + y1)/2)), lon=(lon0 + lon1)/2),
+            mapbox_zoom=np.log2(VIEWPORT[0]*360/(512*(lon1 - lon0))),
+            )
+    ndec = str(decimals(option_slctd))
+    # mean, min, max and count of every cell for the hover and the selections
+    cellstats = np.column_stack([grid[name].ravel()[cells] for name in ('mean', 'min', 'max', 'count')])
+    fig.data[-1].update(
+            customdata=cellstats,
+            hovertemplate=# {{{
+                '<b>Latitude</b>: %{lat:.2f}°N</br>' +
+                '<b>Longitude</b>: %{lon:.2f}°E' +
+                '<br><b>Mean</b>: %{customdata[0]:.' + ndec + 'f} %{meta}</br>' +
+                '<b>Min</b>: %{customdata[1]:.' + ndec + 'f}, <b>max</b>: %{customdata[2]:.' + ndec + 'f}' +
+                '<br><b>Points</b>: %{customdata[3]}</br>',# }}}
+            unselected=dict(marker=dict(opacity=0)),
+            )
+    fig.data[-1].marker.update(opacity=0, cmin=vmin, cmax=vmax, cmid=None)
+    fig.update_layout(mapbox_layers=[image_layer(colorize(grid['mean'], cscale, vmin, vmax, rev), extent)])
+    arrays = {}
+    if PAYLOAD == 'binary':
+        arrays[-1] = {
+            'lat': b64array(dcells['Latitude'], 'f4'),
+            'lon': b64array(dcells['Longitude'], 'f4'),
+            'marker.color': b64array(dcells[option_slctd], 'f8'),
+            'customdata': b64array(cellstats, 'f4'),
+            }
+        if track is not None:
+            arrays[0] = {
+                'lat': b64array(track['Latitude'], 'f4'),
+                'lon': b64array(track['Longitude'], 'f4'),
+                }
+    return compact_figure(fig, arrays)
+
+@timed('plotly')
+def create_map(dff, option_slctd, selectedpoints, cscale, rev, vstats, track=None):# {{{
     unit = units(option_slctd)
     sc = dff[option_slctd]
-    vmean = sc.iloc[selectedpoints].mean()
-    if option_slctd == 'Turbidity FNU' or option_slctd == 'CO2d_ppm' or option_slctd == 'CH4d_ppm':
-        markers = dict(size=15, opacity=0.7, color=sc, showscale=True, colorscale=cscale, reversescale=rev, colorbar=dict(title=unit, len=1), cmin=sc.iloc[selectedpoints].min(), cmax=sc.iloc[selectedpoints].max())
-    else:
-        markers = dict(size=15, opacity=0.7, color=sc, showscale=True, colorscale=cscale, reversescale=rev, colorbar=dict(title=unit, len=1), cmid=vmean)
+    markers = dict(size=15, opacity=0.7, color=sc, showscale=True, colorscale=cscale, reversescale=rev, colorbar=dict(title=unit, len=1), **colorrange(vstats, option_slctd))
     nameev = namevar(option_slctd)
-    midlat = (1.15*dff.Latitude.max()+dff.Latitude.min())/2.
-    midlon = (dff.Longitude.max()+dff.Longitude.min())/2.
-    zoom = calc_zoom(dff.Latitude.min(), dff.Latitude.max(), dff.Longitude.min(), dff.Longitude.max())
+    center, zoom = map_center(dff['Latitude'], dff['Longitude'])
     fig = go.Figure()
+    if track is not None:
+        trackplot = go.Scattermapbox(
+                lat=track['Latitude'],
+                lon=track['Longitude'],
+                showlegend=False,
+                hoverinfo='skip',
+                marker=dict(opacity=0.3, size=5, color='rgb(150,150,150)'),
+                )
+        fig.add_trace(trackplot)
     mapplot = go.Scattermapbox(# {{{
-            lat=dff.Latitude,
-            lon=dff.Longitude,
+            lat=dff['Latitude'],
+            lon=dff['Longitude'],
             visible=True,
             showlegend=False,
-            text=dff.Date,
+            text=dff.get('Date'),
             name=nameev,
-            customdata=dff[nameev],
+            customdata=sc,
             meta=unit,
             hovertemplate=# {{{
                 '<b>Date</b>: %{text}' +
                 '<br><b>Latitude</b>: %{lat:.2f}°N</br>' +
                 '<b>Longitude</b>: %{lon:.2f}°E'
-                '<br><b>Value</b>: %{customdata} %{meta}</br>',# }}}
-            selectedpoints=selectedpoints,
+                '<br><b>Value</b>: %{customdata:.' + str(decimals(option_slctd)) + 'f} %{meta}</br>',# }}}
+            # all the points selected: no need to send the indices
+            selectedpoints=None if len(selectedpoints) == len(sc) else selectedpoints,
             marker=markers,
             unselected=dict(marker=dict(opacity=0.3, size=5, color='rgb(150,150,150)')),
               )# }}}
@@ -357,7 +873,7 @@ def create_map(dff, option_slctd, selectedpoints, cscale, rev):# {{{
         accesstoken=mapbox_access_token,
         bearing=0,
         # where we want the map to be centered
-        center=dict(lat=midlat, lon=midlon),
+        center=center,
         # we want the map to be "parallel" to our screen, with no angle
         pitch=0,
         # default level of zoom
@@ -509,6 +1025,14 @@ def create_map2(dff, option_slctd, selectedpoints, cscale, rev):# {{{
             margin={"r":20,"t":30,"l":30,"b":20},
             )# }}}
     return fig# }}}
+def colorrange(vstats, option_slctd, prefix=''):# {{{
+    # colour limits of the map markers from the selected values (None: auto)
+    if option_slctd == 'Turbidity FNU' or option_slctd == 'CO2d_ppm' or option_slctd == 'CH4d_ppm':
+        crange = {prefix + 'cmin': vstats['min'], prefix + 'cmax': vstats['max']}
+    else:
+        crange = {prefix + 'cmid': vstats['mean']}
+    return {key: None if vstats['count'] == 0 else value for key, value in crange.items()}# }}}
+
 def colorscalesmap(option_slctd):# {{{
     if option_slctd == 'CH4d_ppm':
         colorscale = px.colors.diverging.Geyser
@@ -559,46 +1083,182 @@ def title_timeseries(option_slctd, kind=None):# {{{
             ],
         )# }}}
 
+@instrument('clear_selection')
 def update(reset):# {{{
-    global data
-    dff = data.copy()
-    t0 = unix_time_millis(dff.Datetime.min())
-    tf = unix_time_millis(dff.Datetime.max())
     #return [t0, tf], None, None# }}}
     return None, None, None, None# }}}
 
+@app.callback(
+        [
+            Output('last_location', 'children'),
+            Output('last_date', 'children'),
+            Output('date_range', 'max_date_allowed'),
+            ],
+        [Input('refresh', 'n_intervals')],
+        )
+@instrument('update_last_reported')
+def update_last_reported(n_intervals):
+    # headers of the dataset currently served (new rows of the store)
+    ds = current_dataset()
+    lastloc, lastime = last_reported(ds)
+    return lastloc, lastime, pd.Timestamp(ds.data['Datetime'][-1])
+
+@timed('selection')
+def map_selection(ds, selectedMap, rule, i0, i1):# {{{
+    # rows of the plotted window inside the box or lasso, found with the
+    # spatial index instead of walking selectedData['points']
+    selrange = selectedMap.get('range') or {}
+    lasso = selectedMap.get('lassoPoints') or {}
+    if 'mapbox' in selrange:
+        (lon0, lat0), (lon1, lat1) = selrange['mapbox']
+        rows = ds.gridindex[rule].query_box(lat0, lat1, lon0, lon1, (i0, i1))
+    elif 'mapbox' in lasso:
+        rows = ds.gridindex[rule].query_polygon(lasso['mapbox'], (i0, i1))
+    else:
+        return get_indexpoint(selectedMap)
+    return (rows - i0).tolist()# }}}
+
+@timed('selection')
+def ts_selection(ds, selectedTS, option_slctd, times):# {{{
+    # rows of the map window (times) holding the points of the time series
+    # inside the box or lasso, tested on the finest level of the selection
+    selrange = selectedTS.get('range') or {}
+    lasso = selectedTS.get('lassoPoints') or {}
+    if 'x' in selrange:
+        t0, t1 = sorted(to_datetime64(t) for t in selrange['x'])
+        y0, y1 = sorted(selrange['y'])
+        _, level, j0, j1 = select_level(ds.pyramid, t0, t1, TS_SCAN)
+        values = level[option_slctd][j0:j1]
+        inside = (values >= y0) & (values <= y1)
+        selected = level['Datetime'][j0:j1][inside]
+    elif 'x' in lasso:
+        tx = np.array([to_datetime64(t) for t in lasso['x']], dtype='datetime64[ns]')
+        _, level, j0, j1 = select_level(ds.pyramid, tx.min(), tx.max(), TS_SCAN)
+        polygon = np.column_stack([tx.astype('int64'), lasso['y']]).astype(float)
+        ltimes = level['Datetime'][j0:j1]
+        inside = points_in_polygon(ltimes.astype('int64').astype(float), level[option_slctd][j0:j1], polygon)
+        selected = ltimes[inside]
+    else:
+        selected = np.array([to_datetime64(p['x']) for p in selectedTS['points']], dtype='datetime64[ns]')
+    return time_bins(times, selected)# }}}
+
+def time_bins(times, selected):
+    # positions of the bins of times (labelled by their start) holding the
+    # selected datetimes
+    rows = np.searchsorted(times, selected, side='right') - 1
+    return np.unique(rows[rows >= 0]).tolist()
+
+def zoom_range(relayoutTS):
+    # time range of a zoom on the time series (None when reset or no zoom)
+    if not relayoutTS or relayoutTS.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayoutTS:
+        xrange = [relayoutTS['xaxis.range[0]'], relayoutTS['xaxis.range[1]']]
+    elif 'xaxis.range' in relayoutTS:
+        xrange = relayoutTS['xaxis.range']
+    else:
+        return None
+    return sorted(to_datetime64(t) for t in xrange)
+
+def to_datetime64(value):
+    # date of a time axis ('2020-06-20 10:00:00.5' or epoch milliseconds)
+    if isinstance(value, (int, float)):
+        return np.datetime64(int(value), 'ms').astype('datetime64[ns]')
+    return np.datetime64(pd.Timestamp(value).to_datetime64(), 'ns')
+
 def get_indexpoint(selectedMap):# {{{
     selectedpoint = []
     for point in selectedMap['points']:
-        selectedpoint.append(point['pointIndex'])
+        # points of the grey track have no customdata
+        if 'customdata' in point:
+            selectedpoint.append(point['pointIndex'])
     return selectedpoint# }}}
 
 
 
-def create_time_series(dff, option_slctd, selectedpoints, minindex, maxindex):
+@timed('time_series')
+def time_series(ds, option_slctd, mindate, maxdate, zoom=None, xrange=None):
+    # time series of the zoomed range (the whole date range when zoom is
+    # None), finest level under TS_SCAN rows reduced to TS_POINTS points
+    tmin, tmax = zoom if zoom is not None else (mindate, maxdate)
+    rule, level, i0, i1 = select_level(ds.pyramid, tmin, tmax, TS_SCAN)
+    dts = window(level, i0, i1)
+    keep = downsample(dts['Datetime'], dts[option_slctd], TS_POINTS, TS_DOWNSAMPLE)
+    dts = {'Datetime': dts['Datetime'][keep], option_slctd: dts[option_slctd][keep]}
+    if PAYLOAD == 'json':
+        dts = add_labels(dts)
+    fig = create_time_series(dts, option_slctd, zoom or xrange)
+    if PAYLOAD == 'binary':
+        fig = compact_time_series(fig, dts, option_slctd)
+    return fig
+
+@timed('plotly')
+def create_time_series(dts, option_slctd, xrange=None):
     nameev = namevar(option_slctd)
     unit = units(option_slctd)
-    sc = dff[option_slctd]
-    mindate = dff.loc[selectedpoints].Datetime.min()
-    maxdate = dff.loc[selectedpoints].Datetime.max()
+    sc = dts[option_slctd]
     fig = go.Figure()
-    TimeSeries = go.Scatter(x=dff.Datetime, y=sc, mode='markers',# {{{
-            showlegend=False, visible=True, name=nameev, text=dff.Date, meta=unit,
-            customdata=dff[nameev], hovertemplate=
+    TimeSeries = go.Scatter(x=dts['Datetime'], y=sc, mode='markers',# {{{
+            showlegend=False, visible=True, name=nameev, text=dts.get('Date'), meta=unit,
+            customdata=sc, hovertemplate=
             '<b>Date</b>: %{text}'+
-            '<br><b>Value</b>: %{customdata} %{meta}</br>')# }}}
+            '<br><b>Value</b>: %{customdata:.' + str(decimals(option_slctd)) + 'f} %{meta}</br>')# }}}
+    if xrange is not None:
+        xrange = [pd.Timestamp(t) for t in xrange]
     layout = dict(
             template='seaborn',
             height=300,
             yaxis_title=' '.join([nameev, unit]),
             margin=dict(t=30, b=15, r=20, l=25),
             autosize=True,
-            xaxis=dict(range=[mindate, maxdate]),
+            xaxis=dict(range=xrange, type='date'),
             )
     fig.update_layout(layout)
     fig.add_trace(TimeSeries)
     return fig
 
+@timed('compact')
+def compact_map(fig, dff, option_slctd, track=None):
+    # typed arrays decoded in the browser (assets/articplots.js)
+    arrays = {-1: {
+        'lat': b64array(dff['Latitude'], 'f4'),
+        'lon': b64array(dff['Longitude'], 'f4'),
+        'marker.color': b64array(dff[option_slctd], 'f8'),
+        'customdata': {'ref': 'marker.color'},
+        'text': date_array(dff['Datetime'], labels=True),
+        }}
+    if track is not None:
+        arrays[0] = {
+            'lat': b64array(track['Latitude'], 'f4'),
+            'lon': b64array(track['Longitude'], 'f4'),
+            }
+    return compact_figure(fig, arrays)
+
+@timed('compact')
+def with_track(figmap, track):
+    # copy of a map figure with the grey track (first trace) replaced
+    figmap = dict(figmap)
+    figmap['data'] = list(figmap['data'])
+    trace = dict(figmap['data'][0])
+    if PAYLOAD == 'binary':
+        trace['lat'] = b64array(track['Latitude'], 'f4')
+        trace['lon'] = b64array(track['Longitude'], 'f4')
+    else:
+        trace['lat'] = track['Latitude']
+        trace['lon'] = track['Longitude']
+    figmap['data'][0] = trace
+    return figmap
+
+@timed('compact')
+def compact_time_series(fig, dff, option_slctd):
+    arrays = {0: {
+        'x': date_array(dff['Datetime']),
+        'y': b64array(dff[option_slctd], 'f8'),
+        'customdata': {'ref': 'y'},
+        'text': {'ref': 'x', 'format': 'date'},
+        }}
+    return compact_figure(fig, arrays)
+
 def namevar(option_slctd):# {{{
     if 'CO2' in option_slctd or 'CH4' in option_slctd:
         nameev = option_slctd[:3]
@@ -630,6 +1290,15 @@ def units(option_slctd):# {{{
         units = '(µS/cm)'
     return units# }}}
 
+# Titles of the variable chosen, taken from the titles store
+titles_store.data = {o['value']: [title_timeseries(o['value']), title_timeseries(o['value'], 'map')] for o in variable_options}
+app.clientside_callback(
+        ClientsideFunction(namespace='articplots', function_name='titles'),
+        [Output('time_series_title', 'children'), Output('map_title', 'children')],
+        [Input('slct_var', 'value')],
+        [State('titles', 'data')],
+        )
+
 def update_graph(option_slctd, mindate, maxdate, selectedMap, selectedTS, btnclear):# {{{
     global data
     global mindatepicker
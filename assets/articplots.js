@@ -0,0 +1,354 @@
+// Clientside callbacks of ArticChangeApp.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    articplots: {
+        // View of the map sent to the server (map-view) when the map has to
+        // be drawn again: the zoom crosses mapBase.raster.zoom (markers <->
+        // image) or the map is an image of the previous extent.
+        map_view: function(relayout, mapBase) {
+            const nu = window.dash_clientside.no_update;
+            if (!relayout || !mapBase || !mapBase.raster || !mapBase.raster.zoom ||
+                    relayout['mapbox.zoom'] === undefined) {
+                return nu;
+            }
+            const zoom = relayout['mapbox.zoom'];
+            if (!mapBase.raster.active && zoom >= mapBase.raster.zoom) {
+                return nu;
+            }
+            const derived = relayout['mapbox._derived'];
+            return {
+                zoom: zoom,
+                center: relayout['mapbox.center'],
+                coordinates: derived ? derived.coordinates : null,
+            };
+        },
+
+        // titles of the time series and the map of a variable
+        titles: function(variable, titles) {
+            const nu = window.dash_clientside.no_update;
+            if (!titles || !titles[variable]) {
+                return [nu, nu];
+            }
+            return titles[variable];
+        },
+
+        // URL of /export for the variable and dates shown (rows at the
+        // resolution of the plots, csv)
+        export_link: function(variable, start, end) {
+            const params = new URLSearchParams({variables: variable || '', resolution: 'display', format: 'csv'});
+            if (start && end) {
+                params.set('start', start);
+                params.set('end', end);
+            }
+            return 'export?' + params.toString();
+        },
+
+        // Figures shown = figure sent by the server (kept in a dcc.Store) +
+        // the small patch sent when only the selection changes.
+        // patch = {map: {data: {traceindex: {'marker.cmin': 1}}, layout: {'xaxis.range': [..]}}, ts: {...}}
+        apply_patch: function(mapBase, tsBase, patch) {
+            const nu = window.dash_clientside.no_update;
+            if (!mapBase || !tsBase) {
+                return [nu, nu];
+            }
+            patch = patch || {};
+            mapBase = decodeFigure(mapBase);
+            tsBase = decodeFigure(tsBase);
+            if (onlyTriggered('ts-base.data')) {
+                // new points of a zoom on the time series, its range is kept
+                return [nu, tsBase];
+            }
+            return [
+                patchFigure(mapBase, patch.map),
+                patchFigure(tsBase, patch.ts),
+            ];
+        },
+
+        // Selection on the map or the time series: highlight the points and
+        // compute the statistics of the selected values (mean, min, max, count)
+        // from the data already in the figures.
+        select: function(mapBase, tsBase, selectedMap, selectedTS) {
+            const nu = window.dash_clientside.no_update;
+            if (!mapBase || !tsBase) {
+                return [nu, nu, nu, nu];
+            }
+            mapBase = decodeFigure(mapBase);
+            tsBase = decodeFigure(tsBase);
+            if (onlyTriggered('ts-base.data')) {
+                // new points of a zoom on the time series, its range is kept
+                return [nu, tsBase, nu, nu];
+            }
+            const triggered = triggeredProps();
+            // the data is the last trace of the map (the grey track is the first)
+            const trace = mapBase.data[mapBase.data.length - 1];
+            let points = null;
+            if (triggered.indexOf('map.selectedData') >= 0 && selectedMap && selectedMap.points) {
+                // points of the grey track have no customdata
+                points = selectedMap.points.filter(function(p) {
+                    return p.customdata !== undefined;
+                }).map(function(p) { return p.pointIndex; }).sort(function(a, b) { return a - b; });
+            } else if (triggered.indexOf('time-series.selectedData') >= 0 && selectedTS && selectedTS.points) {
+                if (!mapBase.times) {
+                    // map drawn as an image: statistics of the time series
+                    const tsPoints = selectedTS.points.map(function(p) { return p.pointIndex; });
+                    const tsText = statsText(selectionStats(tsBase.data[0].y, tsPoints), trace.meta);
+                    return [nu, nu, tsText[0], tsText[1]];
+                }
+                // the time series has its own points, the map points are the
+                // ones whose time bin holds a selected point
+                points = timeBins(mapBase.times, selectedTS.points.map(function(p) {
+                    return toMillis(p.x);
+                }));
+            }
+            // cells of a map image: [mean, min, max, count] in customdata
+            const stats = mapBase.times ? selectionStats(trace.marker.color, points) : cellStats(trace.customdata, points);
+            const mapPatch = {data: {'-1': {selectedpoints: points}}};
+            if (!mapBase.times) {
+                // map drawn as an image, its colours do not follow the selection
+            } else if (trace.marker.cmid !== undefined) {
+                mapPatch.data['-1']['marker.cmid'] = stats.count ? stats.mean : null;
+            } else {
+                mapPatch.data['-1']['marker.cmin'] = stats.count ? stats.min : null;
+                mapPatch.data['-1']['marker.cmax'] = stats.count ? stats.max : null;
+            }
+            let tsPatch = null;
+            if (points && points.length && mapBase.times) {
+                const times = mapBase.times;
+                tsPatch = {layout: {'xaxis.range': [times[points[0]], times[points[points.length - 1]]]}};
+            }
+            const text = statsText(stats, trace.meta);
+            return [patchFigure(mapBase, mapPatch), patchFigure(tsBase, tsPatch), text[0], text[1]];
+        },
+    },
+});
+
+function triggeredProps() {
+    const ctx = window.dash_clientside.callback_context;
+    return ctx && ctx.triggered ? ctx.triggered.map(function(t) { return t.prop_id; }) : [];
+}
+
+function onlyTriggered(prop) {
+    const triggered = triggeredProps();
+    return triggered.length === 1 && triggered[0] === prop;
+}
+
+// epoch milliseconds of a date of the time axis (number or
+// '2020-06-20 10:00:00.123456' in UTC)
+function toMillis(value) {
+    if (typeof value === 'number') {
+        return value;
+    }
+    return Date.parse(value.slice(0, 23).replace(' ', 'T') + 'Z');
+}
+
+// sorted positions of the bins of times (epoch milliseconds, sorted, labelled
+// by their start) holding the given times
+function timeBins(times, millis) {
+    const bins = new Set();
+    millis.forEach(function(t) {
+        let lo = 0, hi = times.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (times[mid] <= t) { lo = mid + 1; } else { hi = mid; }
+        }
+        if (lo > 0) {
+            bins.add(lo - 1);
+        }
+    });
+    return Array.from(bins).sort(function(a, b) { return a - b; });
+}
+
+// texts of average_value (children and title)
+function statsText(stats, unit) {
+    return [
+        'Average value: ' + formatValue(stats.mean) + ' ' + unit,
+        'Min: ' + formatValue(stats.min) + ', max: ' + formatValue(stats.max) + ', points: ' + stats.count,
+    ];
+}
+
+function formatValue(value) {
+    return value === null ? 'nan' : value.toFixed(2);
+}
+
+// Statistics of values[points] (all the values if points is null), missing
+// values are skipped.
+function selectionStats(values, points) {
+    const n = points ? points.length : values.length;
+    let sum = 0, count = 0, min = Infinity, max = -Infinity;
+    for (let i = 0; i < n; i++) {
+        const v = values[points ? points[i] : i];
+        if (v === null || v === undefined || isNaN(v)) {
+            continue;
+        }
+        sum += v;
+        count += 1;
+        if (v < min) { min = v; }
+        if (v > max) { max = v; }
+    }
+    return {
+        mean: count ? sum/count : null,
+        min: count ? min : null,
+        max: count ? max : null,
+        count: count,
+    };
+}
+
+// Same statistics for the cells of a map image, each cell holds the mean,
+// min, max and count of its points.
+function cellStats(cells, points) {
+    const n = points ? points.length : cells.length;
+    let sum = 0, count = 0, min = Infinity, max = -Infinity;
+    for (let i = 0; i < n; i++) {
+        const cell = cells[points ? points[i] : i];
+        sum += cell[0]*cell[3];
+        count += cell[3];
+        if (cell[1] < min) { min = cell[1]; }
+        if (cell[2] > max) { max = cell[2]; }
+    }
+    return {
+        mean: count ? sum/count : null,
+        min: count ? min : null,
+        max: count ? max : null,
+        count: count,
+    };
+}
+
+// Figures with base64 typed arrays ({dtype: 'f8', bdata: '...'}, see
+// others/scr/payload.py) are decoded once, the decoded figure is kept for the
+// following selections. A 2-d array (shape: 'rows, columns') becomes a list
+// of rows, as a nested list in JSON would.
+const decoded = new WeakMap();
+const DTYPES = {
+    f4: Float32Array, f8: Float64Array, i1: Int8Array, u1: Uint8Array,
+    i2: Int16Array, u2: Uint16Array, i4: Int32Array, u4: Uint32Array,
+    i8: BigInt64Array,
+};
+
+function decodeArray(value) {
+    const raw = atob(value.bdata);
+    const bytes = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) {
+        bytes[i] = raw.charCodeAt(i);
+    }
+    let array = new DTYPES[value.dtype](bytes.buffer);
+    if (value.dtype === 'i8') {
+        // int64 (epoch milliseconds) to numbers
+        const numbers = new Float64Array(array.length);
+        for (let i = 0; i < array.length; i++) {
+            numbers[i] = Number(array[i]);
+        }
+        array = numbers;
+    }
+    if (typeof value.shape !== 'string') {
+        return array;
+    }
+    const ncols = Number(value.shape.split(',')[1]);
+    const rows = new Array(array.length/ncols);
+    for (let i = 0; i < rows.length; i++) {
+        rows[i] = Array.from(array.subarray(i*ncols, (i + 1)*ncols));
+    }
+    return rows;
+}
+
+function pad(n) {
+    return n < 10 ? '0' + n : '' + n;
+}
+
+// epoch milliseconds to 'dd-mm-yy HH:MM' labels (UTC)
+function dateLabels(millis) {
+    const labels = new Array(millis.length);
+    for (let i = 0; i < millis.length; i++) {
+        const d = new Date(millis[i]);
+        labels[i] = pad(d.getUTCDate()) + '-' + pad(d.getUTCMonth() + 1) + '-' +
+            pad(d.getUTCFullYear() % 100) + ' ' + pad(d.getUTCHours()) + ':' + pad(d.getUTCMinutes());
+    }
+    return labels;
+}
+
+function decodeObject(obj, refs) {
+    const out = Array.isArray(obj) ? obj.slice() : Object.assign({}, obj);
+    Object.keys(out).forEach(function(key) {
+        const value = out[key];
+        if (value && typeof value === 'object' && !ArrayBuffer.isView(value)) {
+            if (typeof value.bdata === 'string') {
+                out[key] = decodeArray(value);
+                if (value.format === 'date') {
+                    out[key] = dateLabels(out[key]);
+                }
+            } else if (typeof value.ref === 'string') {
+                refs.push([out, key, value]);
+            } else if (!Array.isArray(value)) {
+                out[key] = decodeObject(value, refs);
+            }
+        }
+    });
+    return out;
+}
+
+function getPath(obj, path) {
+    return path.split('.').reduce(function(node, key) { return node && node[key]; }, obj);
+}
+
+function decodeFigure(fig) {
+    if (decoded.has(fig)) {
+        return decoded.get(fig);
+    }
+    const out = Object.assign({}, fig);
+    // dates of the map points (linking with the time series)
+    if (fig.times && typeof fig.times.bdata === 'string') {
+        out.times = decodeArray(fig.times);
+    }
+    out.data = (fig.data || []).map(function(trace) {
+        const refs = [];
+        const decodedTrace = decodeObject(trace, refs);
+        // {ref: 'marker.color'}: same array as another property of the trace
+        refs.forEach(function(ref) {
+            let value = getPath(decodedTrace, ref[2].ref);
+            if (ref[2].format === 'date') {
+                value = dateLabels(value);
+            }
+            ref[0][ref[1]] = value;
+        });
+        return decodedTrace;
+    });
+    decoded.set(fig, out);
+    return out;
+}
+
+// Set a dotted property ('marker.cmin') on a copy of obj, the arrays of the
+// base figure are shared, not copied.
+function setPath(obj, path, value) {
+    const keys = path.split('.');
+    const root = Object.assign({}, obj);
+    let node = root;
+    for (let i = 0; i < keys.length - 1; i++) {
+        node[keys[i]] = Object.assign({}, node[keys[i]]);
+        node = node[keys[i]];
+    }
+    node[keys[keys.length - 1]] = value;
+    return root;
+}
+
+function patchFigure(base, patch) {
+    if (!patch) {
+        return base;
+    }
+    const fig = Object.assign({}, base);
+    if (patch.data) {
+        fig.data = base.data.slice();
+        Object.keys(patch.data).forEach(function(key) {
+            let i = parseInt(key, 10);
+            if (i < 0) {
+                i += fig.data.length;
+            }
+            Object.keys(patch.data[key]).forEach(function(path) {
+                fig.data[i] = setPath(fig.data[i], path, patch.data[key][path]);
+            });
+        });
+    }
+    if (patch.layout) {
+        Object.keys(patch.layout).forEach(function(path) {
+            fig.layout = setPath(fig.layout, path, patch.layout[path]);
+        });
+    }
+    return fig;
+}
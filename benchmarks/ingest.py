@@ -0,0 +1,235 @@
+###########################################################
+# Incremental ingest
+###########################################################
+"""Time of read_data with a manifest against reading every raw file.
+
+An unzip tree of --days days of synthetic raw files (benchmarks/rawdata.py,
+LGR at 1 Hz and GPS every 10 s, kept in --data) is read by read_data:
+
+- full: without a manifest, all the days
+- first: with an empty manifest, all the days but the last one
+- update: the last day added, only its files are parsed
+- unchanged: nothing new, no file parsed and no output written
+- changed: the LGR file of a day in the middle written again with other
+  values, its minutes are read again
+
+After update and changed, the data store and the 10-minute csv must be the
+same as the ones of a full read of the same files.
+
+The first run with a manifest is then timed for each number of files of
+--scaling (synthetic days of 1440 rows, one a minute): the script fails if
+the time per file for the most files is more than --tolerance times the one
+for the fewest, as when every file was added to the totals of all the
+files before it.
+
+The update of one day is also timed after the synthetic totals of each
+number of years of --years (write_history, outputs written first): the
+script fails if the time for the most years is more than --tolerance times
+the one for the fewest, as when the whole history was read and written
+again. The store and csv appended must be the ones written from the whole
+manifest.
+
+    python benchmarks/ingest.py --days 6 --scaling 50,400 --years 1,4
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from rawdata import write_day, write_lgr  # noqa: E402
+from run import run_meta  # noqa: E402
+from others.scr.datastore import read_store  # noqa: E402
+from others.scr.ingest import MANIFEST_FILE, MANIFEST_VERSION, save_totals, split_blocks  # noqa: E402
+from others.scr.read_data import read_data  # noqa: E402
+
+START = pd.Timestamp('2020-06-09')
+# sources of the synthetic totals: columns (as parsed), mean and rows a minute
+HISTORY = {'lgr': (['H20_ppm', 'CH4d_ppm', 'CO2d_ppm', 'GasP_torr', 'GasT_C', 'RD0_us', 'RD1_us'],
+                   [8000., 2.02, 419., 140., 35., 10., 12.], 60),
+           'gps': (['Latitude', 'Longitude'], [56., -160.], 6)}
+
+
+def conffile(work, unzip, manifest, zipdata=None):
+    # configuration of read_data for the folders of work
+    for folder in ('zip', 'exo'):
+        os.makedirs(os.path.join(work, folder), exist_ok=True)
+    return {'paths': {'zip': zipdata or os.path.join(work, 'zip'), 'unzip': unzip,
+                      'exopath': os.path.join(work, 'exo'), 'filepath': work},
+            'readprofile': False, 'readzip': False, 'stream': True,
+            'files': {'datafile': os.path.join(work, 'Data.csv'), 'datastore': os.path.join(work, 'AllData.store'),
+                      'manifest': os.path.join(work, 'ingest') if manifest else None}}
+
+
+def timed_read(conf):
+    start = time.perf_counter()
+    read_data(conf)
+    return time.perf_counter() - start
+
+
+def outputs(conf):
+    # data store and csv written by read_data
+    return read_store(conf['files']['datastore']), pd.read_csv(conf['files']['datafile'], index_col=0)
+
+
+def same_outputs(conf, reference):
+    for new, old in zip(outputs(conf), outputs(reference)):
+        pd.testing.assert_frame_equal(new, old, check_exact=False, rtol=1e-9)
+
+
+def write_history(folder, start, end, seed=0):
+    """Manifest of 1-minute totals of every minute from start to before end.
+
+    The totals are written as by ingest.update_source, without the raw files
+    they come from (the manifest has no files), so that the next files read
+    are added to a history of any length.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    minutes = pd.date_range(start, end, freq='T', inclusive='left', name='Datetime')
+    sources = {'exo': {'blocks': {}, 'files': {}}}
+    for name, (columns, means, rows) in HISTORY.items():
+        blocks = {}
+        for key, block in split_blocks(minutes):
+            index = minutes[block]
+            counts = pd.DataFrame(float(rows), index=index, columns=columns)
+            sums = counts*(np.array(means)*(1 + 1e-3*rng.standard_normal((len(index), len(columns)))))
+            filename = '%s-%s-%06d.npz' % (name, key, 0)
+            save_totals((sums, counts), folder, filename)
+            blocks[key] = {'file': filename, 'start': str(index[0]), 'end': str(index[-1]), 'columns': columns}
+        sources[name] = {'blocks': blocks, 'files': {}}
+    with open(os.path.join(folder, MANIFEST_FILE), 'w') as file:
+        json.dump({'version': MANIFEST_VERSION, 'generation': 0, 'sources': sources}, file)
+
+
+def history_conf(work, cache, day, years):
+    # configuration of read_data with years of totals before day, the outputs
+    # written and the files of day added (the next read is the update)
+    conf = conffile(work, os.path.join(work, 'unzip'), manifest=True)
+    os.makedirs(conf['paths']['unzip'])
+    write_history(conf['files']['manifest'], day - pd.Timedelta(days=round(365.25*years)), day)
+    read_data(conf)
+    name = day.strftime('%Y%m%d')
+    os.symlink(os.path.join(os.path.abspath(cache), name), os.path.join(conf['paths']['unzip'], name))
+    return conf
+
+
+def rewritten(conf):
+    # configuration writing the outputs of the manifest of conf in new files
+    # (nothing changed in the raw files and no outputs: all of them written)
+    files = dict(conf['files'], datafile=conf['files']['datafile'] + '.rewritten.csv',
+                 datastore=conf['files']['datastore'] + '.rewritten')
+    return dict(conf, files=files)
+
+
+def first_run(data, nfiles):
+    # seconds of the first read with a manifest of nfiles days of one LGR row
+    # a minute (every minute of the day in the totals, little to parse)
+    cache = os.path.join(data, 'ingest-minutes')
+    days = [START + pd.Timedelta(days=i) for i in range(nfiles)]
+    for i, day in enumerate(days):
+        if not os.path.exists(os.path.join(cache, day.strftime('%Y%m%d'))):
+            write_day(cache, day, 1440, seed=i, every=60)
+    work = tempfile.mkdtemp(prefix='ingest-')
+    try:
+        unzip = os.path.join(work, 'unzip')
+        os.makedirs(unzip)
+        for day in days:
+            name = day.strftime('%Y%m%d')
+            os.symlink(os.path.join(os.path.abspath(cache), name), os.path.join(unzip, name))
+        return timed_read(conffile(os.path.join(work, 'incremental'), unzip, manifest=True))
+    finally:
+        shutil.rmtree(work)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--days', type=int, default=6, help='days of raw files (6)')
+    parser.add_argument('--rows', type=int, default=86400, help='LGR rows per day (86400, 1 Hz)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic files')
+    parser.add_argument('--scaling', default='50,200', help='numbers of files of the first runs timed (50,200)')
+    parser.add_argument('--years', default='1,4', help='years of totals before the daily updates timed (1,4)')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='largest ratio of the times per file, most to fewest files, and of the updates, '
+                             'most to fewest years (1.5)')
+    parser.add_argument('--output', help='result file (benchmarks/results/ingest-<date>.json)')
+    args = parser.parse_args()
+    args.years = sorted(float(years) for years in args.years.split(','))
+    logging.basicConfig(level=logging.WARNING)
+    days = [START + pd.Timedelta(days=i) for i in range(args.days)]
+    cache = os.path.join(args.data, 'ingest-%i' % args.rows)
+    for i, day in enumerate(days):
+        if not os.path.exists(os.path.join(cache, day.strftime('%Y%m%d'))):
+            write_day(cache, day, args.rows, seed=i)
+    work = tempfile.mkdtemp(prefix='ingest-')
+    seconds = {}
+    try:
+        unzip = os.path.join(work, 'unzip')
+        os.makedirs(unzip)
+        for day in days[:-1]:
+            shutil.copytree(os.path.join(cache, day.strftime('%Y%m%d')), os.path.join(unzip, day.strftime('%Y%m%d')))
+        conf = conffile(os.path.join(work, 'incremental'), unzip, manifest=True)
+        reference = conffile(os.path.join(work, 'full'), unzip, manifest=False)
+        seconds['first'] = timed_read(conf)
+        name = days[-1].strftime('%Y%m%d')
+        shutil.copytree(os.path.join(cache, name), os.path.join(unzip, name))
+        seconds['update'] = timed_read(conf)
+        seconds['full'] = timed_read(reference)
+        same_outputs(conf, reference)
+        seconds['unchanged'] = timed_read(conf)
+        middle = days[len(days)//2]
+        write_lgr(os.path.join(unzip, middle.strftime('%Y%m%d'), 'YB', middle.strftime('%Y-%m-%d'),
+                               'gga_%s_f0000.zip' % middle.date()), middle, args.rows, seed=100)
+        seconds['changed'] = timed_read(conf)
+        timed_read(reference)
+        same_outputs(conf, reference)
+        history = {}
+        for years in args.years:
+            conf = history_conf(os.path.join(work, 'history-%g' % years), cache, days[0], years)
+            history[years] = timed_read(conf)
+            if years == args.years[0]:
+                timed_read(rewritten(conf))
+                same_outputs(conf, rewritten(conf))
+    finally:
+        shutil.rmtree(work)
+    for step, value in seconds.items():
+        print('%-10s %8.3f s' % (step, value), file=sys.stderr)
+    print('update %.1fx faster than full, same outputs' % (seconds['full']/seconds['update']), file=sys.stderr)
+    for years, value in history.items():
+        print('update after %g years: %8.3f s' % (years, value), file=sys.stderr)
+    history_ratio = history[args.years[-1]]/history[args.years[0]]
+    print('update time, %g years / %g years: %.2f' % (args.years[-1], args.years[0], history_ratio), file=sys.stderr)
+    scaling = {}
+    for nfiles in sorted(int(n) for n in args.scaling.split(',')):
+        scaling[nfiles] = first_run(args.data, nfiles)
+        print('first run, %4i days: %8.3f s, %6.1f ms per day' % (nfiles, scaling[nfiles], 1e3*scaling[nfiles]/nfiles),
+              file=sys.stderr)
+    counts = sorted(scaling)
+    ratio = (scaling[counts[-1]]/counts[-1])/(scaling[counts[0]]/counts[0])
+    print('time per day, %i days / %i days: %.2f' % (counts[-1], counts[0], ratio), file=sys.stderr)
+    results = {'meta': run_meta(days=args.days, rows=args.rows, years=args.years), 'seconds': seconds,
+               'scaling': {'seconds': scaling, 'ratio': ratio},
+               'history': {'seconds': {'%g' % years: value for years, value in history.items()},
+                           'ratio': history_ratio}}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('ingest-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+    assert ratio <= args.tolerance, 'time per file grows with the files read (%.2f > %.2f)' % (ratio, args.tolerance)
+    assert history_ratio <= args.tolerance, 'update time grows with the history (%.2f > %.2f)' % (
+        history_ratio, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+###########################################################
+# LGR reader throughput
+###########################################################
+"""Rows per second of the LGR reader of read_data against the previous one.
+
+Synthetic zipped LGR files (benchmarks/rawdata.py, one day of 1 Hz rows per
+file, kept in --data) are read by:
+
+- two_pass: the previous reader, the file decompressed once to find the
+  footer, then read by the python parser of pandas with skipfooter and a
+  datetime.strptime per row
+- single_pass: read_data.parse_lgr, one decompression, the footer found in
+  the bytes, the C parser and the timestamps converted at once
+
+Both readers must give the same frame. The best of --repeats runs is
+reported.
+
+    python benchmarks/lgr.py --files 3 --rows 86400
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import warnings
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from rawdata import write_lgr  # noqa: E402
+from run import run_meta  # noqa: E402
+from others.scr.read_data import parse_lgr  # noqa: E402
+
+
+def footer_pos(LGRfile):
+    # lines of the footer (previous reader)
+    zipf = zipfile.ZipFile(LGRfile)
+    content = io.BytesIO(zipf.read(zipf.namelist()[0]))
+    i = 0
+    ib = None
+    for line in content.readlines():
+        if line.startswith(b'-----B'):
+            ib = i
+        i += 1
+    return i - ib if ib is not None else 0
+
+
+def two_pass(readfile):
+    """Previous reader of read_data (squeeze=True dropped, no effect on 8 columns)."""
+    custom_parser = lambda x: datetime.strptime(x, "%m/%d/%Y %H:%M:%S.%f")  # noqa: E731
+    ifoot = footer_pos(readfile)
+    with warnings.catch_warnings():
+        # date_parser is deprecated by pandas 2
+        warnings.simplefilter('ignore', FutureWarning)
+        return pd.read_csv(readfile, sep=',', header=1, skipfooter=ifoot, skipinitialspace=True, parse_dates=[0],
+                           index_col=[0], usecols=[0, 3, 7, 9, 11, 13, 17, 19], engine='python',
+                           date_parser=custom_parser,
+                           names=['Datetime', 'H20_ppm', 'CH4d_ppm', 'CO2d_ppm', 'GasP_torr', 'GasT_C', 'RD0_us',
+                                  'RD1_us'])
+
+
+def measure(reader, files, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        frames = [reader(f) for f in files]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    rows = sum(len(frame) for frame in frames)
+    return frames, {'seconds': best, 'rows': rows, 'rows_per_s': rows/best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=3, help='files read (3)')
+    parser.add_argument('--rows', type=int, default=86400, help='rows per file (86400, one day at 1 Hz)')
+    parser.add_argument('--repeats', type=int, default=3, help='runs of every reader, the best is kept (3)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic files')
+    parser.add_argument('--output', help='result file (benchmarks/results/lgr-<date>.json)')
+    args = parser.parse_args()
+    folder = os.path.join(args.data, 'lgr-%i' % args.rows)
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    for i in range(args.files):
+        start = pd.Timestamp('2020-06-09') + pd.Timedelta(days=i)
+        path = os.path.join(folder, 'gga_%s_f0000.zip' % start.date())
+        if not os.path.exists(path):
+            write_lgr(path, start, args.rows, seed=i)
+        files.append(path)
+    size = sum(os.path.getsize(f) for f in files)
+    results = {'meta': run_meta(files=args.files, rows=args.rows, zip_bytes=size), 'readers': {}}
+    frames = {}
+    for name, reader in (('two_pass', two_pass), ('single_pass', parse_lgr)):
+        frames[name], results['readers'][name] = measure(reader, files, args.repeats)
+        r = results['readers'][name]
+        print('%-12s %9i rows in %7.3f s: %10.0f rows/s' % (name, r['rows'], r['seconds'], r['rows_per_s']),
+              file=sys.stderr)
+    for old, new in zip(frames['two_pass'], frames['single_pass']):
+        pd.testing.assert_frame_equal(old, new)
+    results['speedup'] = results['readers']['single_pass']['rows_per_s']/results['readers']['two_pass']['rows_per_s']
+    print('speedup %.1fx, same frames' % results['speedup'], file=sys.stderr)
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('lgr-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,571 @@
+###########################################################
+# Load test of the dashboard callbacks
+###########################################################
+"""Concurrent replay of browser sessions against the dashboard under gunicorn.
+
+Every session first sends the initial callbacks of the page, then a random
+sequence of user actions (variable switches, date-range picks, map and
+time-series selections, map and time-series zooms, clear-button presses) as
+the ``/_dash-update-component`` requests the browser would send: the
+callbacks and initial values are read from ``/_dash-dependencies`` and
+``/_dash-layout``, the callbacks triggered together are sent at once and the
+outputs of their responses trigger the callbacks taking them as inputs (e.g.
+the clear button resets the dates and selections, then the figures are
+requested). Boxes and ranges are taken from windows of the
+rows of the data store, so selections hold points. Actions handled in the
+browser (selections with ARTIC_SELECTION=client) send no request and are
+counted as skipped. Requests recorded in a HAR file of the browser
+developer tools can be replayed instead (--har).
+
+gunicorn is started with the given workers and threads (or --url is used),
+the sessions are run by --concurrency users and throughput, p50/p95/p99
+latency and errors are reported overall, per callback and per action, and
+the latency of the interactions (first request to last response of an
+action) per action.
+With --check the same sessions are first replayed one after the other on a
+new server; responses of the concurrent run that differ from this
+reference show callbacks depending on state shared between requests (e.g.
+module globals). A stateless app gives no mismatch: the script exits with an
+error when any response differs (or none could be compared) and when any
+request of either replay fails (status other than 2xx or no response), as
+an error in both replays gives the same response.
+
+    python benchmarks/loadtest.py --workers 2 --threads 4 --concurrency 8 --selection server --check
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from run import VARIABLES, run_meta  # noqa: E402
+from others.scr.datastore import TIME_COLUMN, open_store  # noqa: E402
+
+ENDPOINT = '/_dash-update-component'
+# relative frequency of the actions of a synthetic session
+ACTIONS = {'variable': 3, 'dates': 2, 'map_selection': 2, 'ts_selection': 2, 'map_zoom': 1, 'ts_zoom': 1,
+           'clear': 1}
+# rows of the windows used for selections and zooms
+WINDOW = (30, 3000)
+PERCENTILES = (50, 95, 99)
+
+
+class Server:
+    """gunicorn serving the app on a free local port (context manager)."""
+
+    def __init__(self, workers, threads, env, log):
+        self.workers = workers
+        self.threads = threads
+        self.env = env
+        self.log = log
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.url = 'http://127.0.0.1:%i' % port
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:%i' % port,
+                   '--workers', str(self.workers), '--threads', str(self.threads), '--timeout', '300',
+                   'ArticChangeApp:server']
+        self.process = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ, **self.env),
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        # the first start may build the pyramid of the store
+        deadline = time.time() + 600
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn stopped, see %s' % self.log.name)
+            try:
+                urllib.request.urlopen(self.url + '/_dash-dependencies', timeout=5).read()
+                return self
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.5)
+        self.__exit__()
+        raise RuntimeError('gunicorn not ready after 600 s, see %s' % self.log.name)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def get_json(url):
+    return json.loads(urllib.request.urlopen(url, timeout=60).read())
+
+
+def split_output(output):
+    # '..a.b...c.d..' or 'a.b' -> ['a.b', 'c.d']
+    if output.startswith('..'):
+        return output[2:-2].split('...')
+    return [output]
+
+
+def prop(item):
+    return '%s.%s' % (item['id'], item['property'])
+
+
+def server_callbacks(url):
+    """Callbacks run by the server, with their outputs as 'id.property'."""
+    callbacks = []
+    for dep in get_json(url + '/_dash-dependencies'):
+        if dep.get('clientside_function'):
+            continue
+        outputs = split_output(dep['output'])
+        callbacks.append({
+            'name': outputs[0] if len(outputs) == 1 else '%s (+%i)' % (outputs[0], len(outputs) - 1),
+            'output': dep['output'],
+            'outputs': outputs,
+            'multi': dep['output'].startswith('..'),
+            'inputs': [prop(i) for i in dep['inputs']],
+            'state': [prop(s) for s in dep.get('state', [])],
+            'prevent_initial_call': dep.get('prevent_initial_call', False),
+        })
+    return callbacks
+
+
+def layout_values(url):
+    """Initial value of every property set in the layout ('id.property')."""
+    values = {}
+    stack = [get_json(url + '/_dash-layout')]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            props = node.get('props', {})
+            for key, value in props.items():
+                if 'id' in props and isinstance(props['id'], str):
+                    values['%s.%s' % (props['id'], key)] = value
+                stack.append(value)
+    return values
+
+
+def update_body(callback, values, changed):
+    """Request of a callback with the current values of its inputs."""
+    def item(name):
+        id_, property = name.rsplit('.', 1)
+        return {'id': id_, 'property': property, 'value': values.get(name)}
+
+    outputs = [dict(zip(('id', 'property'), name.rsplit('.', 1))) for name in callback['outputs']]
+    return {
+        'output': callback['output'],
+        'outputs': outputs if callback['multi'] else outputs[0],
+        'inputs': [item(name) for name in callback['inputs']],
+        'changedPropIds': [name for name in changed if name in callback['inputs']],
+        'state': [item(name) for name in callback['state']],
+    }
+
+
+class Windows:
+    """Date ranges, map boxes and time-series boxes from the data store."""
+
+    def __init__(self, path):
+        self.columns = open_store(path)
+        self.times = self.columns[TIME_COLUMN].view('datetime64[ns]')
+        self.days = np.arange(self.times[0].astype('datetime64[D]'), self.times[-1].astype('datetime64[D]') + 1)
+
+    def rows(self, rng):
+        n = int(rng.integers(*WINDOW))
+        i0 = int(rng.integers(0, max(len(self.times) - n, 1)))
+        return i0, min(i0 + n, len(self.times))
+
+    def dates(self, rng):
+        i = int(rng.integers(0, len(self.days)))
+        j = min(i + int(rng.integers(1, 15)), len(self.days) - 1)
+        return str(self.days[i]), str(self.days[j])
+
+    def map_box(self, rng):
+        i0, i1 = self.rows(rng)
+        lat = self.columns['Latitude'][i0:i1]
+        lon = self.columns['Longitude'][i0:i1]
+        if np.isnan(lat).all():
+            return None
+        box = [[float(np.nanmin(lon)), float(np.nanmax(lat))], [float(np.nanmax(lon)), float(np.nanmin(lat))]]
+        return {'points': [], 'range': {'mapbox': box}}
+
+    def map_view(self, rng):
+        # view sent by the browser for a zoom out to the image mode of the map
+        i0, i1 = self.rows(rng)
+        lat = self.columns['Latitude'][i0:i1]
+        if np.isnan(lat).all():
+            return None
+        center = {'lon': float(np.nanmean(self.columns['Longitude'][i0:i1])), 'lat': float(np.nanmean(lat))}
+        return {'zoom': float(rng.uniform(1, 4)), 'center': center, 'coordinates': None}
+
+    def ts_box(self, rng, variable):
+        i0, i1 = self.rows(rng)
+        values = self.columns[variable][i0:i1]
+        if np.isnan(values).all():
+            return None
+        return {'points': [], 'range': {'x': self.time_range(i0, i1),
+                                        'y': [float(np.nanmin(values)), float(np.nanmax(values))]}}
+
+    def time_range(self, i0, i1):
+        return [str(self.times[i0]).replace('T', ' ')[:23], str(self.times[i1 - 1]).replace('T', ' ')[:23]]
+
+
+class Session:
+    """One browser tab: initial callbacks then a sequence of actions.# {{{
+
+    Parameters
+    ----------
+    callbacks, values : output of server_callbacks and layout_values
+    windows : Windows of the data store
+    actions : number of actions after the page load
+    seed : seed of the choice of the actions
+
+    """# }}}
+
+    def __init__(self, callbacks, values, windows, actions, seed, think=0.):
+        self.callbacks = callbacks
+        self.initial = values
+        self.windows = windows
+        self.nactions = actions
+        self.seed = seed
+        self.think = think
+
+    def run(self, post):
+        rng = np.random.default_rng(self.seed)
+        self.values = dict(self.initial)
+        self.step = 0
+        self.interaction = 0
+        # initial call: callbacks whose inputs are not outputs of others
+        outputs = {name for cb in self.callbacks for name in cb['outputs']}
+        roots = [cb for cb in self.callbacks
+                 if not cb['prevent_initial_call'] and not outputs.intersection(cb['inputs'])]
+        self.fire(set(), 'load', post, roots)
+        names = list(ACTIONS)
+        weights = np.array([ACTIONS[name] for name in names], dtype=float)
+        for _ in range(self.nactions):
+            if self.think:
+                time.sleep(rng.exponential(self.think))
+            action = names[rng.choice(len(names), p=weights/weights.sum())]
+            changed = self.act(action, rng)
+            self.interaction += 1
+            if not self.fire(changed, action, post):
+                post(None, action, None, self.next_step(), self.interaction)
+
+    def act(self, action, rng):
+        # new values of the properties changed by an action
+        new = {}
+        if action == 'variable':
+            new['slct_var.value'] = VARIABLES[int(rng.integers(len(VARIABLES)))]
+        elif action == 'dates':
+            new['date_range.start_date'], new['date_range.end_date'] = self.windows.dates(rng)
+        elif action == 'map_selection':
+            new['map.selectedData'] = self.windows.map_box(rng)
+        elif action == 'ts_selection':
+            new['time-series.selectedData'] = self.windows.ts_box(rng, self.values.get('slct_var.value') or VARIABLES[0])
+        elif action == 'map_zoom':
+            new['map-view.data'] = self.windows.map_view(rng)
+        elif action == 'ts_zoom':
+            x0, x1 = self.windows.time_range(*self.windows.rows(rng))
+            new['time-series.relayoutData'] = {'xaxis.range[0]': x0, 'xaxis.range[1]': x1}
+        elif action == 'clear':
+            new['button-clear.n_clicks'] = (self.values.get('button-clear.n_clicks') or 0) + 1
+        self.values.update(new)
+        return set(new)
+
+    def next_step(self):
+        self.step += 1
+        return self.step - 1
+
+    def fire(self, changed, action, post, triggered=None):
+        """Send the callbacks triggered by changed properties (and their outputs).
+
+        The callbacks of one round are sent at once, as the browser does;
+        their requests are built and numbered in order, so a replay is
+        always the same.
+        """
+        sent = False
+        while triggered or changed:
+            if triggered is None:
+                triggered = [cb for cb in self.callbacks if changed.intersection(cb['inputs'])]
+            if not triggered:
+                break
+            calls = [(cb['name'], update_body(cb, self.values, changed), self.next_step()) for cb in triggered]
+            with ThreadPoolExecutor(len(calls)) as pool:
+                responses = list(pool.map(lambda call: post(call[1], action, call[0], call[2], self.interaction),
+                                          calls))
+            sent = True
+            changed = set()
+            for response in responses:
+                changed |= self.apply(response)
+            triggered = None
+        return sent
+
+    def apply(self, response):
+        # properties set by a response, the browser fires their callbacks
+        new = set()
+        for id_, props in (response or {}).get('response', {}).items():
+            for key, value in props.items():
+                self.values['%s.%s' % (id_, key)] = value
+                new.add('%s.%s' % (id_, key))
+        return new
+
+
+class Recording:
+    """Requests of a HAR file replayed as they were recorded."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+    @classmethod
+    def from_har(cls, filename):
+        with open(filename) as file:
+            entries = json.load(file)['log']['entries']
+        bodies = [json.loads(e['request']['postData']['text']) for e in entries
+                  if e['request']['url'].endswith(ENDPOINT) and e['request'].get('postData')]
+        return cls(bodies)
+
+    def run(self, post):
+        for step, body in enumerate(self.bodies):
+            name = body['output'] if not body['output'].startswith('..') else split_output(body['output'])[0]
+            post(body, 'recorded', name, step, step)
+
+
+def replay(url, sessions, concurrency, timeout=120):
+    """Run the sessions by concurrency users, records of every request.# {{{
+
+    Returns
+    -------
+    records: list of dictionaries session, step, interaction, action,
+        callback, status, start (seconds after the first request), seconds,
+        bytes, digest (sha1 of the response) and error
+    wall: seconds from the first to the last request
+
+    """# }}}
+    todo = queue.Queue()
+    for i, session in enumerate(sessions):
+        todo.put((i, session))
+    records = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def user():
+        while True:
+            try:
+                i, session = todo.get_nowait()
+            except queue.Empty:
+                return
+
+            def post(body, action, callback, step, interaction):
+                record = {'session': i, 'step': step, 'interaction': interaction, 'action': action,
+                          'callback': callback, 'status': None, 'start': None, 'seconds': None, 'bytes': 0,
+                          'digest': None, 'error': None}
+                response = None
+                if body is None:
+                    record['status'] = 'skipped'
+                else:
+                    data = json.dumps(body).encode('utf-8')
+                    request = urllib.request.Request(url + ENDPOINT, data=data,
+                                                     headers={'Content-Type': 'application/json'})
+                    begin = time.perf_counter()
+                    record['start'] = begin - start
+                    try:
+                        with urllib.request.urlopen(request, timeout=timeout) as reply:
+                            content = reply.read()
+                            record['status'] = reply.status
+                    except urllib.error.HTTPError as error:
+                        content = error.read()
+                        record['status'] = error.code
+                        record['error'] = 'HTTP %i' % error.code
+                    except (urllib.error.URLError, OSError) as error:
+                        content = b''
+                        record['error'] = str(getattr(error, 'reason', error))
+                    record['seconds'] = time.perf_counter() - begin
+                    record['bytes'] = len(content)
+                    record['digest'] = hashlib.sha1(content).hexdigest()
+                    if record['status'] == 200:
+                        response = json.loads(content)
+                with lock:
+                    records.append(record)
+                return response
+
+            session.run(post)
+
+    users = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    return records, time.perf_counter() - start
+
+
+def latency(records):
+    seconds = np.array([r['seconds'] for r in records if r['seconds'] is not None])
+    stats = {'requests': len(seconds), 'errors': sum(r['error'] is not None for r in records)}
+    stats['error_rate'] = stats['errors']/len(seconds) if len(seconds) else 0.
+    stats['prevented'] = sum(r['status'] == 204 for r in records)
+    if len(seconds):
+        for p, value in zip(PERCENTILES, np.percentile(seconds, PERCENTILES)):
+            stats['p%i_ms' % p] = value*1e3
+        stats['mean_ms'] = seconds.mean()*1e3
+        stats['max_ms'] = seconds.max()*1e3
+        stats['mean_bytes'] = float(np.mean([r['bytes'] for r in records if r['seconds'] is not None]))
+    return stats
+
+
+def interactions(records):
+    """Seconds from the first request to the last response of every action."""
+    spans = {}
+    for r in records:
+        if r['seconds'] is None or r['action'] == 'load':
+            continue
+        key = (r['session'], r['interaction'])
+        first, last, action = spans.get(key, (r['start'], r['start'] + r['seconds'], r['action']))
+        spans[key] = (min(first, r['start']), max(last, r['start'] + r['seconds']), action)
+    by_action = {}
+    for first, last, action in spans.values():
+        by_action.setdefault(action, []).append({'seconds': last - first, 'error': None, 'status': 200, 'bytes': 0})
+    return {action: latency(spans) for action, spans in sorted(by_action.items())}
+
+
+def summarize(records, wall):
+    sent = [r for r in records if r['status'] != 'skipped']
+    summary = latency(sent)
+    summary['seconds'] = wall
+    summary['throughput_rps'] = len(sent)/wall if wall else 0.
+    summary['skipped_actions'] = len(records) - len(sent)
+    groups = {}
+    for key in ('callback', 'action'):
+        names = sorted({r[key] for r in sent})
+        groups[key] = {name: latency([r for r in sent if r[key] == name]) for name in names}
+    groups['interaction'] = interactions(sent)
+    return summary, groups
+
+
+def check(reference, records):
+    """Responses of records differing from the reference replay, and the failed requests of both."""
+    expected = {(r['session'], r['step']): r for r in reference}
+    compared = 0
+    mismatches = []
+    for record in records:
+        ref = expected.get((record['session'], record['step']))
+        if ref is None or record['status'] == 'skipped':
+            continue
+        compared += 1
+        if (ref['status'], ref['digest']) != (record['status'], record['digest']):
+            mismatches.append(record)
+    failed = [record for record in reference + records if record['error'] is not None]
+    return {
+        'compared': compared,
+        'mismatches': len(mismatches),
+        'mismatch_rate': len(mismatches)/compared if compared else 0.,
+        'by_callback': count_by_callback(mismatches),
+        'errors': len(failed),
+        'errors_by_callback': count_by_callback(failed),
+    }
+
+
+def count_by_callback(records):
+    # number of records per callback and action
+    counts = {}
+    for record in records:
+        name = '%s / %s' % (record['callback'], record['action'])
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def print_report(summary, groups, checked=None):
+    out = sys.stderr
+    print('%i requests in %.1f s: %.1f req/s, %i errors (%.1f%%), %i prevented, %i skipped actions'
+          % (summary['requests'], summary['seconds'], summary['throughput_rps'], summary['errors'],
+             100*summary['error_rate'], summary['prevented'], summary['skipped_actions']), file=out)
+    for key, stats in groups.items():
+        print('\n%-45s %6s %6s %8s %8s %8s' % (key, 'n', 'err', 'p50 ms', 'p95 ms', 'p99 ms'), file=out)
+        for name, s in stats.items():
+            print('%-45s %6i %6i %8.1f %8.1f %8.1f' % (name[:45], s['requests'], s['errors'], s.get('p50_ms', 0),
+                                                       s.get('p95_ms', 0), s.get('p99_ms', 0)), file=out)
+    if checked is not None:
+        print('\n%i of %i responses differ from the sequential replay (%.1f%%)'
+              % (checked['mismatches'], checked['compared'], 100*checked['mismatch_rate']), file=out)
+        for name, n in sorted(checked['by_callback'].items(), key=lambda item: -item[1]):
+            print('  %-60s %i' % (name, n), file=out)
+        print('%i failed requests in the two replays' % checked['errors'], file=out)
+        for name, n in sorted(checked['errors_by_callback'].items(), key=lambda item: -item[1]):
+            print('  %-60s %i' % (name, n), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='running server (default: start gunicorn)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (2)')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker (1)')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous users (4)')
+    parser.add_argument('--sessions', type=int, default=20, help='browser sessions replayed (20)')
+    parser.add_argument('--actions', type=int, default=15, help='actions per session after the page load (15)')
+    parser.add_argument('--think', type=float, default=0., help='mean seconds between two actions of a user (0)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sessions (0)')
+    parser.add_argument('--store', default=os.environ.get('ARTIC_DATASTORE', 'others/AllData.store'),
+                        help='data store served and used for the selections')
+    parser.add_argument('--selection', choices=['client', 'server'], help='ARTIC_SELECTION of the server')
+    parser.add_argument('--har', help='replay the callback requests of a HAR file instead')
+    parser.add_argument('--check', action='store_true', help='compare with a sequential replay on a new server')
+    parser.add_argument('--output', help='result file (benchmarks/results/loadtest-<date>.json)')
+    args = parser.parse_args()
+    store = os.path.join(ROOT, args.store)
+    env = {'ARTIC_DATASTORE': store, 'ARTIC_REFRESH': '0'}
+    if args.selection:
+        env['ARTIC_SELECTION'] = args.selection
+    log = tempfile.NamedTemporaryFile('w', prefix='loadtest-', suffix='.log', delete=False)
+
+    def sessions(url):
+        if args.har:
+            recording = Recording.from_har(args.har)
+            return [recording for _ in range(args.sessions)]
+        callbacks = server_callbacks(url)
+        values = layout_values(url)
+        windows = Windows(store)
+        return [Session(callbacks, values, windows, args.actions, (args.seed, i), args.think)
+                for i in range(args.sessions)]
+
+    def run(concurrency):
+        if args.url:
+            return replay(args.url, sessions(args.url), concurrency)
+        with Server(args.workers, args.threads, env, log) as server:
+            return replay(server.url, sessions(server.url), concurrency)
+
+    checked = None
+    if args.check:
+        print('Sequential replay', file=sys.stderr)
+        reference, _ = run(1)
+    print('Replay by %i users' % args.concurrency, file=sys.stderr)
+    records, wall = run(args.concurrency)
+    summary, groups = summarize(records, wall)
+    if args.check:
+        checked = check(reference, records)
+    print_report(summary, groups, checked)
+    settings = dict(vars(args), **env)
+    results = {'meta': run_meta(**settings), 'summary': summary, 'groups': groups, 'check': checked}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('loadtest-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s (server log %s)' % (output, log.name), file=sys.stderr)
+    if checked is not None and (checked['mismatches'] or checked['errors'] or not checked['compared']):
+        sys.exit('%i of %i responses differ from the sequential replay, %i failed requests'
+                 % (checked['mismatches'], checked['compared'], checked['errors']))
+
+
+if __name__ == '__main__':
+    main()
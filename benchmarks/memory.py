@@ -0,0 +1,136 @@
+###########################################################
+# Callback memory
+###########################################################
+"""Peak memory allocated by the callbacks, for two store sizes.
+
+The app is imported in a new process for the synthetic stores
+(benchmarks/synthetic.py, kept in --data) at --small and --large times the
+rows of AllData.csv, and every callback is called under tracemalloc with an
+empty figure cache, after one warm-up call:
+
+- update_map and update_time_series (the callbacks of the default
+  ARTIC_SELECTION=client): every variable of --variables and date range of
+  benchmarks/run.py
+- update_figures (ARTIC_SELECTION=server): the same, without a selection
+  and with a box on the map
+- update: the reset button
+- update_last_reported: the headers of the last row
+
+The callbacks read the shared arrays of the store and of the pyramid and
+copy only the rows they plot, so what they allocate must not grow with the
+store: the script fails if the largest peak of a callback for --large is
+more than --tolerance times the one for --small.
+
+    python benchmarks/memory.py --small 1 --large 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from run import RANGES, ROOT, VARIABLES, date_range, run_meta  # noqa: E402
+
+# box (lon, lat corners) selected on the map
+BOX = {'range': {'mapbox': [[0., 75.], [20., 60.]]}}
+
+
+def peak(call):
+    # MB allocated at most during call
+    call()
+    tracemalloc.start()
+    call()
+    result = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result/1e6
+
+
+def worker(args):
+    """Peaks of the callbacks in this process, printed as JSON on the last line."""
+    import ArticChangeApp as app
+
+    def cleared(call):
+        def wrapper():
+            app.figcache.clear()
+            call()
+        return wrapper
+
+    first = app.current_dataset().data['Datetime'][0]
+    peaks = {'update_map': {}, 'update_time_series': {}, 'update_figures': {}}
+    for variable in args.variables:
+        for name, days in RANGES:
+            start, end = date_range(first, days)
+            key = '%s/%s' % (variable, name)
+            peaks['update_map'][key] = peak(cleared(lambda: app.update_map(variable, start, end, None)))
+            peaks['update_time_series'][key] = peak(cleared(lambda: app.update_time_series(variable, start, end, None)))
+            for selection, selected in (('none', None), ('box', BOX)):
+                peaks['update_figures']['%s/%s/%s' % (variable, name, selection)] = peak(
+                    cleared(lambda: app.update_figures(variable, start, end, selected)))
+    peaks['update'] = peak(lambda: app.update(1))
+    peaks['update_last_reported'] = peak(lambda: app.update_last_reported(1))
+    print(json.dumps({'rows': app.current_dataset().nrows, 'peaks': peaks}))
+
+
+def run_worker(store, args):
+    # update_map and update_time_series are defined in client mode only
+    env = dict(os.environ, ARTIC_DATASTORE=store, ARTIC_REFRESH='0', ARTIC_SELECTION='client')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--variables', ','.join(args.variables)]
+    output = subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def largest(peaks):
+    # largest peak of every callback
+    return {name: max(value.values()) if isinstance(value, dict) else value for name, value in peaks.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--small', type=float, default=1, help='scale of the small store (1)')
+    parser.add_argument('--large', type=float, default=10, help='scale of the large store (10)')
+    parser.add_argument('--variables', default=','.join(VARIABLES[:2]),
+                        help='variables of update_figures (%s)' % ','.join(VARIABLES[:2]))
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data (0)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic stores')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='largest ratio of the peaks of a callback, large to small (1.5)')
+    parser.add_argument('--output', help='result file (benchmarks/results/memory-<date>.json)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.variables = args.variables.split(',')
+    if args.worker:
+        return worker(args)
+    from synthetic import generate
+    os.makedirs(args.data, exist_ok=True)
+    results = {}
+    for scale in (args.small, args.large):
+        scale = int(scale) if scale == int(scale) else scale
+        store = os.path.join(args.data, 'synthetic-x%s-s%i.store' % (scale, args.seed))
+        generate(store, scale, args.seed)
+        results['x%g' % scale] = run_worker(store, args)
+    small, large = (largest(results['x%g' % scale]['peaks']) for scale in (args.small, args.large))
+    ratios = {name: large[name]/small[name] if small[name] else 1. for name in small}
+    for name in small:
+        print('%-22s peak %8.3f MB (x%g) %8.3f MB (x%g) ratio %.2f' % (name, small[name], args.small, large[name],
+                                                                        args.large, ratios[name]), file=sys.stderr)
+    results = {'meta': run_meta(small=args.small, large=args.large, seed=args.seed, variables=args.variables),
+               'scales': results, 'ratios': ratios}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('memory-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+    for name, ratio in ratios.items():
+        assert ratio <= args.tolerance, '%s allocates more for a larger store (%.2f > %.2f)' % (
+            name, ratio, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
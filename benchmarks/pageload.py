@@ -0,0 +1,171 @@
+###########################################################
+# Bytes on the wire of a page load
+###########################################################
+"""Bytes sent by the dashboard for the default page load.
+
+The page is loaded from a gunicorn started as in loadtest.py: the index, the
+scripts and stylesheets it links from the server, the layout, the callback
+dependencies, the logo and the initial callbacks. Three loads are measured:
+
+- identity: no Accept-Encoding, the size of the content itself
+- first: a new browser accepting brotli and gzip
+- repeat: the same browser again, immutable URLs (assets with ?m=, component
+  suites) are taken from its cache and the other GET requests are
+  revalidated with If-None-Match
+
+External resources (bootstrap theme of the CDN, mapbox tiles) are not
+counted.
+
+    python benchmarks/pageload.py --output benchmarks/results/pageload.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from loadtest import ENDPOINT, ROOT, Server, Session, Windows, layout_values, server_callbacks  # noqa: E402
+from run import run_meta  # noqa: E402
+
+LINKS = re.compile(r'<(?:script|link)[^>]*?(?:src|href)="([^"]+)"')
+IMAGES = re.compile(r'"src":\s*"(/assets/[^"]+)"')
+
+
+def decode(content, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(content)
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(content)
+    return content
+
+
+class Browser:
+    """Requests of one browser, with its cache of ETags and immutable URLs."""
+
+    def __init__(self, url, encodings):
+        self.url = url
+        self.encodings = encodings
+        self.etags = {}
+        self.immutable = {}
+        self.requests = []
+
+    def fetch(self, path, body=None):
+        """Content of a GET (or POST of body), the request is recorded."""
+        key = (path, json.dumps(body, sort_keys=True) if body is not None else None)
+        record = {'path': path.split('?')[0], 'method': 'GET' if body is None else 'POST'}
+        if key in self.immutable:
+            record.update(status='cache', bytes=0)
+            self.requests.append(record)
+            return self.immutable[key]
+        headers = {}
+        if self.encodings:
+            headers['Accept-Encoding'] = self.encodings
+        if key in self.etags and body is None:
+            # browsers do not revalidate POST requests
+            headers['If-None-Match'] = self.etags[key][0]
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(urllib.parse.urljoin(self.url, path), data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=120) as reply:
+                status, content, info = reply.status, reply.read(), reply.headers
+        except urllib.error.HTTPError as error:
+            status, content, info = error.code, error.read(), error.headers
+        record.update(status=status, bytes=len(content), encoding=info.get('Content-Encoding'))
+        self.requests.append(record)
+        if status == 304:
+            return self.etags[key][1]
+        content = decode(content, info.get('Content-Encoding'))
+        if 'immutable' in (info.get('Cache-Control') or ''):
+            self.immutable[key] = content
+        elif info.get('ETag'):
+            self.etags[key] = (info['ETag'], content)
+        return content
+
+    def load(self, store):
+        """Requests of the default page load."""
+        self.requests = []
+        index = self.fetch('/').decode('utf-8')
+        for link in LINKS.findall(index):
+            if not urllib.parse.urlparse(link).netloc:
+                self.fetch(link)
+        layout = self.fetch('/_dash-layout').decode('utf-8')
+        for image in IMAGES.findall(layout):
+            self.fetch(image)
+        self.fetch('/_dash-dependencies')
+        callbacks = server_callbacks(self.url)
+        values = layout_values(self.url)
+
+        def post(body, action, callback, step=None, interaction=None):
+            if body is None:
+                return None
+            content = self.fetch(ENDPOINT, body)
+            return json.loads(content) if content else None
+
+        Session(callbacks, values, Windows(store), 0, 0).run(post)
+        return list(self.requests)
+
+
+def totals(requests):
+    result = {'requests': len(requests), 'bytes': sum(r['bytes'] for r in requests)}
+    for kind, match in (('callbacks', lambda r: r['path'].endswith(ENDPOINT)),
+                        ('scripts', lambda r: r['path'].endswith('.js')),
+                        ('other', lambda r: not r['path'].endswith(ENDPOINT) and not r['path'].endswith('.js'))):
+        result['%s_bytes' % kind] = sum(r['bytes'] for r in requests if match(r))
+    result['not_modified'] = sum(r['status'] == 304 for r in requests)
+    result['from_cache'] = sum(r['status'] == 'cache' for r in requests)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='running server (default: start gunicorn)')
+    parser.add_argument('--store', default=os.environ.get('ARTIC_DATASTORE', 'others/AllData.store'),
+                        help='data store served')
+    parser.add_argument('--output', help='result file (benchmarks/results/pageload-<date>.json)')
+    args = parser.parse_args()
+    store = os.path.join(ROOT, args.store)
+    env = {'ARTIC_DATASTORE': store, 'ARTIC_REFRESH': '0'}
+    log = tempfile.NamedTemporaryFile('w', prefix='pageload-', suffix='.log', delete=False)
+
+    def measure(url):
+        loads = {'identity': Browser(url, None).load(store)}
+        browser = Browser(url, 'br, gzip')
+        loads['first'] = browser.load(store)
+        loads['repeat'] = browser.load(store)
+        return loads
+
+    if args.url:
+        loads = measure(args.url)
+    else:
+        with Server(1, 1, env, log) as server:
+            loads = measure(server.url)
+    results = {'meta': run_meta(**env), 'loads': {}}
+    for name, requests in loads.items():
+        results['loads'][name] = {'totals': totals(requests), 'requests': requests}
+        t = results['loads'][name]['totals']
+        print('%-9s %3i requests %9i bytes (callbacks %i, scripts %i, other %i), %i not modified, %i from cache'
+              % (name, t['requests'], t['bytes'], t['callbacks_bytes'], t['scripts_bytes'], t['other_bytes'],
+                 t['not_modified'], t['from_cache']), file=sys.stderr)
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('pageload-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+###########################################################
+# Synthetic raw instrument files
+###########################################################
+"""Raw files shaped like the ones of the instruments, for the ingest benchmarks.
+
+- LGR: a zip of one text file per day, a version line, the header of the 24
+  columns of the greenhouse gas analyser, one row per second
+  ('  06/09/2020 20:20:01.123,  2.031780e+00, ...') and a PGP signature
+  block at the end, as read by read_data.read_lgr
+- GPS: a gpx track of one point every `step` seconds along a slow drift, as
+  read by read_data.read_gps
+- unzip tree: the folders of one date of the expedition as read_data finds
+  them after unzipping ('<date>/GPS/*.gpx', '<date>/YB/<date>/*.zip')
+- batch: the zip archive of those folders, as copied to paths: zip
+
+The same start, rows and seed always give the same file.
+"""
+
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# columns of the LGR files: name, mean and noise
+LGR_COLUMNS = [
+    ('[CH4]_ppm', 2.0, 0.01), ('[CH4]_ppm_se', 8e-4, 1e-4),
+    ('[H2O]_ppm', 8000., 50.), ('[H2O]_ppm_se', 5., 1.),
+    ('[CO2]_ppm', 415., 1.), ('[CO2]_ppm_se', 0.1, 0.01),
+    ('[CH4]d_ppm', 2.02, 0.01), ('[CH4]d_ppm_se', 8e-4, 1e-4),
+    ('[CO2]d_ppm', 419., 1.), ('[CO2]d_ppm_se', 0.1, 0.01),
+    ('GasP_torr', 140., 0.1), ('GasP_torr_se', 0.01, 1e-3),
+    ('GasT_C', 35., 0.05), ('GasT_C_se', 1e-3, 1e-4),
+    ('AmbT_C', 25., 0.5), ('AmbT_C_se', 1e-3, 1e-4),
+    ('RD0_us', 10., 0.05), ('RD0_us_se', 1e-3, 1e-4),
+    ('RD1_us', 12., 0.05), ('RD1_us_se', 1e-3, 1e-4),
+    ]
+LGR_FOOTER = (
+    '-----BEGIN PGP MESSAGE-----\n'
+    'Version: GnuPG v1.4.11 (GNU/Linux)\n'
+    '\n'
+    'hQEMA5sN8gJkNzTdAQf/Xq2VY0cXb3KkWJ3Y3pX5l8RZt2QfW1jz5cE6TqfGq1dM\n'
+    'a0ZQ9W8nC7o4Kp2LwVYt3rHh5u6JbN1sA0xEgR4yPz9fTmUcDi7lOqBvS2kXeWnI\n'
+    '=Qx3v\n'
+    '-----END PGP MESSAGE-----\n'
+    )
+
+
+def lgr_text(start, rows, seed=0, every=1):
+    """Text of an LGR file of rows rows, one every `every` seconds from start."""
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(rows)*every, 's') + \
+        pd.to_timedelta(rng.integers(0, 1000, rows), 'ms')
+    stamps = times.strftime('%m/%d/%Y %H:%M:%S.%f').str[:-3]
+    values = np.column_stack([mean + noise*rng.standard_normal(rows) for _, mean, noise in LGR_COLUMNS])
+    out = io.StringIO()
+    out.write('VC:f96 BD:Apr 25 2013 SN:14-0112\n')
+    out.write(','.join(['%25s' % 'Time'] + ['%14s' % name for name, _, _ in LGR_COLUMNS] +
+                       ['%10s' % 'Fit_Flag', '%10s' % 'MIU_VALVE', '%12s' % 'MIU_DESC']) + '\n')
+    body = pd.DataFrame(values).applymap('%14.6e'.__mod__)
+    body.insert(0, 'Time', ['%25s' % stamp for stamp in stamps])
+    body['Fit_Flag'] = '%10i' % 3
+    body['MIU_VALVE'] = '%10i' % 0
+    body['MIU_DESC'] = '%12s' % 'Atmosphere'
+    body.to_csv(out, header=False, index=False)
+    out.write(LGR_FOOTER)
+    return out.getvalue()
+
+
+def lgr_zip(name, start, rows, seed=0, every=1):
+    """Bytes of a zipped LGR file (one text member name) of rows seconds from start."""
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name, lgr_text(start, rows, seed, every))
+    return content.getvalue()
+
+
+def write_lgr(path, start, rows, seed=0):
+    """Zipped LGR file (one text member) of rows seconds from start."""
+    name = os.path.splitext(os.path.basename(path))[0] + '.txt'
+    with open(path, 'wb') as file:
+        file.write(lgr_zip(name, start, rows, seed))
+    return path
+
+
+def gpx_text(start, rows, step=10, seed=0):
+    """Text of a gpx track of rows points, one every step seconds from start."""
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(rows)*step, 's')
+    lat = 56. + np.cumsum(1e-5*rng.standard_normal(rows))
+    lon = -160. + np.cumsum(1e-5*rng.standard_normal(rows))
+    points = ''.join('<trkpt lat="%.6f" lon="%.6f"><time>%sZ</time></trkpt>\n' % (y, x, t.isoformat())
+                     for y, x, t in zip(lat, lon, times))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="benchmarks" xmlns="http://www.topografix.com/GPX/1/1">\n'
+            '<trk><trkseg>\n' + points + '</trkseg></trk>\n</gpx>\n')
+
+
+def day_files(day, rows=86400, seed=0, every=1):
+    """Raw files of one day (LGR every `every` s, GPS ten times less): relative path -> bytes."""
+    day = pd.Timestamp(day)
+    name = day.strftime('%Y%m%d')
+    lgr = 'gga_%s_f0000' % day.date()
+    return {'%s/GPS/%s.gpx' % (name, name): gpx_text(day, rows//10, 10*every, seed).encode('utf-8'),
+            '%s/YB/%s/%s.zip' % (name, day.strftime('%Y-%m-%d'), lgr): lgr_zip(lgr + '.txt', day, rows, seed, every)}
+
+
+def write_day(folder, day, rows=86400, seed=0, every=1):
+    """Raw files of one day in an unzip folder."""
+    for name, content in day_files(day, rows, seed, every).items():
+        path = os.path.join(folder, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+    return folder
+
+
+def write_batch(path, day, rows=86400, seed=0):
+    """Zip archive of the raw files of one day, as copied to paths: zip."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in day_files(day, rows, seed).items():
+            archive.writestr(name, content)
+    return path
@@ -0,0 +1,87 @@
+###########################################################
+# Raw files read from the archives
+###########################################################
+"""read_data on the zip archives: unzipped first, or read in the archives.
+
+--days zip archives of one day of synthetic raw files each
+(benchmarks/rawdata.py, kept in --data) are read by read_data:
+
+- unzip: the archives extracted to paths: unzip, then the files read
+- readzip: the files read in the archives (readzip: True)
+- manifest: readzip with a manifest, run twice (first and nothing new)
+
+It reports the time and the bytes written to paths: unzip for each, and the
+data store and csv of readzip must be the same as the ones of unzip.
+
+    python benchmarks/rawzip.py --days 6
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from ingest import START, conffile, same_outputs, timed_read  # noqa: E402
+from rawdata import write_batch  # noqa: E402
+from run import run_meta  # noqa: E402
+
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--days', type=int, default=6, help='days of raw files, one archive per day (6)')
+    parser.add_argument('--rows', type=int, default=86400, help='LGR rows per day (86400, 1 Hz)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic files')
+    parser.add_argument('--output', help='result file (benchmarks/results/rawzip-<date>.json)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    zipdata = os.path.join(args.data, 'rawzip-%i' % args.rows)
+    os.makedirs(zipdata, exist_ok=True)
+    for i in range(args.days):
+        day = START + pd.Timedelta(days=i)
+        path = os.path.join(zipdata, day.strftime('%Y%m%d') + '.zip')
+        if not os.path.exists(path):
+            write_batch(path, day, args.rows, seed=i)
+    work = tempfile.mkdtemp(prefix='rawzip-')
+    results = {}
+    try:
+        for name, readzip, manifest in (('unzip', False, False), ('readzip', True, False), ('manifest', True, True)):
+            unzip = os.path.join(work, name, 'unzip')
+            os.makedirs(unzip)
+            conf = conffile(os.path.join(work, name), unzip, manifest, zipdata)
+            conf['readzip'] = readzip
+            results[name] = {'seconds': timed_read(conf), 'unzip_bytes': folder_bytes(unzip)}
+            if manifest:
+                results[name]['unchanged_seconds'] = timed_read(conf)
+            if name != 'unzip':
+                same_outputs(conf, reference)
+            else:
+                reference = conf
+    finally:
+        shutil.rmtree(work)
+    for name, result in results.items():
+        print('%-9s %8.3f s, %12i bytes unzipped' % (name, result['seconds'], result['unzip_bytes']), file=sys.stderr)
+    print('nothing new with the manifest: %.3f s, same outputs' % results['manifest']['unchanged_seconds'],
+          file=sys.stderr)
+    results = {'meta': run_meta(days=args.days, rows=args.rows, zip_bytes=folder_bytes(zipdata)), 'readers': results}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('rawzip-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
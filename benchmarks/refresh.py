@@ -0,0 +1,138 @@
+###########################################################
+# Live refresh cost
+###########################################################
+"""Time of a dashboard refresh after rows are appended, for two store sizes.
+
+A store of the first rows of the synthetic data (benchmarks/synthetic.py) at
+--small and --large times the rows of AllData.csv gets --appends appends of
+--rows rows (datastore.append_store). After each append the Refresher of the
+dashboard swaps in the new rows (Refresher.check), with the pyramid in
+memory and shared in the store folder (ARTIC_SHARED_PYRAMID). The levels and
+the spatial indexes are then compared with a Dataset built from the whole
+store.
+
+A refresh resamples and indexes only the appended rows, and copies the
+levels to new arrays so the levels of the dataset served before are left as
+they were (checked after every refresh). The copy is the only work that
+grows with the store, a few ms per million rows: the script fails if the
+median time for --large is more than --tolerance times the one for --small.
+
+    python benchmarks/refresh.py --small 1 --large 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from run import run_meta  # noqa: E402
+from synthetic import ROWS, chunks  # noqa: E402
+from others.scr.datastore import append_store, read_store, write_store  # noqa: E402
+from others.scr.pyramid import build_pyramid  # noqa: E402
+from others.scr.refresh import Dataset, Refresher  # noqa: E402
+
+# boxes (lat0, lat1, lon0, lon1) of the spatial index checks
+BOXES = [(48., 82., -10., 30.), (60., 70., 0., 10.), (75., 76., 15., 20.), (50., 50.3, -5., -4.)]
+
+
+def same_dataset(dataset, path):
+    # levels and spatial indexes of dataset are the ones of the whole store
+    reference = Dataset(build_pyramid(read_store(path)))
+    for (rule, level), (_, expected) in zip(dataset.pyramid, reference.pyramid):
+        assert set(level) == set(expected), rule
+        for col, values in expected.items():
+            if col == 'Datetime':
+                np.testing.assert_array_equal(level[col], values, err_msg=rule)
+            else:
+                np.testing.assert_allclose(level[col], values, rtol=1e-9, err_msg='%s %s' % (rule, col))
+        for box in BOXES:
+            np.testing.assert_array_equal(dataset.gridindex[rule].query_box(*box),
+                                          reference.gridindex[rule].query_box(*box), err_msg='%s %s' % (rule, box))
+
+
+def last_rows(dataset):
+    # copies of the last two rows of every column of the levels
+    return {(rule, col): np.array(values[-2:]) for rule, level in dataset.pyramid for col, values in level.items()}
+
+
+def unchanged(dataset, rows):
+    # levels of dataset still have the rows of last_rows
+    for (rule, col), values in rows.items():
+        np.testing.assert_array_equal(dict(dataset.pyramid)[rule][col][-2:], values,
+                                      err_msg='%s %s of the old dataset written' % (rule, col))
+
+
+def refresh_times(work, scale, args, shared):
+    # seconds of every Refresher.check after an append to a store of scale
+    data = pd.concat(chunks((ROWS*scale + args.appends*args.rows)/ROWS, seed=args.seed), ignore_index=True)
+    nrows = len(data) - args.appends*args.rows
+    path = os.path.join(work, 'x%g-%s.store' % (scale, 'shared' if shared else 'memory'))
+    write_store(data[:nrows], path)
+    refresher = Refresher(path, Dataset.from_store(path, shared=shared), shared=shared)
+    seconds = []
+    for first in range(nrows, len(data), args.rows):
+        append_store(data[first:first + args.rows], path)
+        old = refresher.dataset
+        rows = last_rows(old)
+        start = time.perf_counter()
+        assert refresher.check()
+        seconds.append(time.perf_counter() - start)
+        unchanged(old, rows)
+    same_dataset(refresher.dataset, path)
+    shutil.rmtree(path)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--small', type=float, default=1, help='scale of the small store (1)')
+    parser.add_argument('--large', type=float, default=10, help='scale of the large store (10)')
+    parser.add_argument('--appends', type=int, default=10, help='appends to each store (10)')
+    parser.add_argument('--rows', type=int, default=60, help='rows of an append (60, an hour)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data (0)')
+    parser.add_argument('--tolerance', type=float, default=3.,
+                        help='largest ratio of the median refresh times, large to small (3)')
+    parser.add_argument('--output', help='result file (benchmarks/results/refresh-<date>.json)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    work = tempfile.mkdtemp(prefix='refresh-')
+    results = {}
+    try:
+        for shared in (False, True):
+            for scale in (args.small, args.large):
+                seconds = refresh_times(work, scale, args, shared)
+                results['%s_x%g' % ('shared' if shared else 'memory', scale)] = {
+                    'seconds': seconds, 'median_ms': 1e3*float(np.median(seconds))}
+    finally:
+        shutil.rmtree(work)
+    for name, result in results.items():
+        print('%-16s refresh %8.1f ms (median)' % (name, result['median_ms']), file=sys.stderr)
+    ratios = {}
+    for mode in ('memory', 'shared'):
+        large, small = (results['%s_x%g' % (mode, scale)]['median_ms'] for scale in (args.large, args.small))
+        ratios[mode] = large/small
+        print('%s refresh x%g / x%g: %.2f' % (mode, args.large, args.small, ratios[mode]), file=sys.stderr)
+    print('same levels and spatial indexes as a full build, old levels unchanged', file=sys.stderr)
+    results = {'meta': run_meta(small=args.small, large=args.large, appends=args.appends, rows=args.rows),
+               'refresh': results, 'ratios': ratios}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('refresh-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+    for mode, ratio in ratios.items():
+        assert ratio <= args.tolerance, '%s refresh grows with the store (%.2f > %.2f)' % (mode, ratio, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
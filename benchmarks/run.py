@@ -0,0 +1,285 @@
+###########################################################
+# Dashboard benchmarks
+###########################################################
+"""Startup, callback latency, payload size and memory of the dashboard.
+
+For every scale a synthetic store is written (benchmarks/synthetic.py, kept
+in --data for the next runs) and the app is imported in new processes with
+``ARTIC_DATASTORE`` pointing at it:
+
+- startup: time to import the libraries and ArticChangeApp, without the
+  shared pyramid in the store folder (cold, built and saved) and with it
+  (warm, mapped), and the peak RSS of the process
+- callbacks: ``update_figures`` of every variable and date range with an
+  empty figure cache (median and minimum of --repeats calls after one
+  warm-up call, the map and the time series are built at the same time), the
+  median time of the map and of the time series built alone (the callbacks
+  of the browser when the variable or the dates change), the size of the
+  map (create_map) and time series (create_time_series) figures as sent to
+  the browser, and the peak of the memory allocated during the call
+  (tracemalloc, separate call)
+
+The date ranges start one day after the first row, so the same scale and
+seed always measure the same rows. Results are written as JSON with the
+commit, library versions and ARTIC_* settings of the run; --baseline prints
+the ratio of every number to a previous result file.
+
+    python benchmarks/run.py --scales 1,10,100 --baseline benchmarks/results/old.json
+
+The 1000x store has 62 million rows (5 GB): building its pyramid needs a few
+times that much memory.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+VARIABLES = ['CO2d_ppm', 'CH4d_ppm', 'Temp °C', 'Sal psu', 'ODO % sat', 'Turbidity FNU', 'SpCond µS/cm']
+# name and length in days of the date ranges (None: whole record)
+RANGES = [('all', None), ('2 days', 2), ('2 weeks', 14), ('2 months', 61)]
+LIBRARIES = ['numpy', 'pandas', 'plotly', 'dash', 'flask']
+
+
+def peak_rss():
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def json_size(value):
+    from plotly.utils import PlotlyJSONEncoder
+    return len(json.dumps(value, cls=PlotlyJSONEncoder).encode('utf-8'))
+
+
+def measure_startup():
+    # libraries first, so the app import is the time of the app itself
+    start = time.perf_counter()
+    import dash_bootstrap_components  # noqa: F401
+    import dash_core_components  # noqa: F401
+    import plotly.express  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    import pandas  # noqa: F401
+    libraries = time.perf_counter() - start
+    start = time.perf_counter()
+    import ArticChangeApp
+    app = time.perf_counter() - start
+    return ArticChangeApp, {
+        'libraries_s': libraries,
+        'app_s': app,
+        'rows': ArticChangeApp.current_dataset().nrows,
+        'rss_mb': peak_rss(),
+    }
+
+
+def date_range(first, days):
+    # picker dates of a range starting the day after the first row
+    import pandas as pd
+    if days is None:
+        return None, None
+    start = pd.Timestamp(first).normalize() + pd.Timedelta(days=1)
+    return str(start.date()), str((start + pd.Timedelta(days=days)).date())
+
+
+def build_times(app, variable, start, end, repeats):
+    # seconds of the map and of the time series built alone, empty cache
+    import numpy as np
+    from others.scr.pyramid import select_level
+    ds = app.current_dataset()
+    mindate, maxdate = app.picker_dates(start, end)
+    rule, level, i0, i1 = select_level(ds.pyramid, mindate, maxdate, app.POINT_BUDGET)
+    selected = np.arange(i1 - i0)
+    vstats = app.selection_stats(ds, rule, level, variable, i0, selected)
+    extent = app.raster_extent(level['Latitude'][i0:i1], level['Longitude'][i0:i1], None)
+    xrange = [level['Datetime'][i0], level['Datetime'][i1 - 1]] if i1 > i0 else None
+    builds = {
+        'map_s': lambda: app.map_output(ds, variable, start, end, (rule, level, i0, i1), selected, vstats, extent),
+        'ts_s': lambda: app.time_series_output(ds, variable, start, end, None, xrange),
+    }
+    result = {}
+    for name, build in builds.items():
+        seconds = []
+        for _ in range(repeats):
+            app.figcache.clear()
+            begin = time.perf_counter()
+            build()
+            seconds.append(time.perf_counter() - begin)
+        result[name] = statistics.median(seconds)
+    return result
+
+
+def measure_callback(app, variable, start, end, repeats):
+    app.figcache.clear()
+    begin = time.perf_counter()
+    output = app.update_figures(variable, start, end)
+    first = time.perf_counter() - begin
+    seconds = []
+    for _ in range(repeats):
+        app.figcache.clear()
+        begin = time.perf_counter()
+        app.update_figures(variable, start, end)
+        seconds.append(time.perf_counter() - begin)
+    app.figcache.clear()
+    tracemalloc.start()
+    app.update_figures(variable, start, end)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    figmap, figtime = output[:2]
+    return {
+        'first_s': first,
+        'median_s': statistics.median(seconds),
+        'min_s': min(seconds),
+        'map_bytes': json_size(figmap),
+        'ts_bytes': json_size(figtime),
+        'map_mode': 'raster' if figmap.get('raster', {}).get('active') else 'markers',
+        'peak_alloc_mb': peak/1e6,
+        **build_times(app, variable, start, end, repeats),
+    }
+
+
+def worker(args):
+    """Measurements of one process, printed as JSON on the last line."""
+    app, result = measure_startup()
+    if not args.startup_only:
+        first = app.current_dataset().data['Datetime'][0]
+        result['callbacks'] = []
+        for variable in args.variables:
+            for name, days in RANGES:
+                start, end = date_range(first, days)
+                entry = {'variable': variable, 'range': name, 'start': start, 'end': end}
+                entry.update(measure_callback(app, variable, start, end, args.repeats))
+                result['callbacks'].append(entry)
+        result['rss_mb'] = peak_rss()
+    print(json.dumps(result))
+
+
+def run_worker(store, args, startup_only=False):
+    env = dict(os.environ, ARTIC_DATASTORE=store, ARTIC_REFRESH='0')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--repeats', str(args.repeats),
+               '--variables', ','.join(args.variables)]
+    if startup_only:
+        command.append('--startup-only')
+    output = subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_scale(scale, args):
+    from synthetic import generate
+    store = os.path.join(args.data, 'synthetic-x%s-s%i.store' % (scale, args.seed))
+    os.makedirs(args.data, exist_ok=True)
+    start = time.perf_counter()
+    nrows = generate(store, scale, args.seed)
+    generated = time.perf_counter() - start
+    # no saved pyramid: the first start builds it
+    shutil.rmtree(os.path.join(store, 'pyramid'), ignore_errors=True)
+    cold = run_worker(store, args, startup_only=True)
+    warm = run_worker(store, args)
+    callbacks = warm.pop('callbacks')
+    return {
+        'scale': scale,
+        'rows': nrows,
+        'generate_s': generated,
+        'startup_cold': cold,
+        'startup_warm': warm,
+        'callbacks': callbacks,
+    }
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git'] + list(args), cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_meta(**settings):
+    """Commit, versions and machine of a run, with its settings."""
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'versions': versions,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'settings': dict(settings, **{key: value for key, value in os.environ.items() if key.startswith('ARTIC_')}),
+    }
+
+
+def flatten(results):
+    """Numbers of a result file by name ('x10/CO2d_ppm/2 days/median_s')."""
+    numbers = {}
+    for scale in results['scales']:
+        prefix = 'x%s' % scale['scale']
+        for stage in ('startup_cold', 'startup_warm'):
+            for key, value in scale[stage].items():
+                numbers['%s/%s/%s' % (prefix, stage, key)] = value
+        for entry in scale['callbacks']:
+            for key, value in entry.items():
+                if isinstance(value, (int, float)):
+                    numbers['%s/%s/%s/%s' % (prefix, entry['variable'], entry['range'], key)] = value
+    return numbers
+
+
+def compare(baseline, results):
+    """Print the ratio of every number of results to the baseline."""
+    old = flatten(baseline)
+    new = flatten(results)
+    print('%-60s %12s %12s %7s' % ('', 'baseline', 'new', 'ratio'))
+    for name, value in new.items():
+        if name not in old:
+            continue
+        ratio = value/old[name] if old[name] else float('nan')
+        print('%-60s %12.4g %12.4g %7.2f' % (name, old[name], value, ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='1,10,100', help='multiples of the rows of AllData.csv (1,10,100)')
+    parser.add_argument('--variables', default=','.join(VARIABLES), help='variables of update_figures (all)')
+    parser.add_argument('--repeats', type=int, default=5, help='timed calls per variable and date range (5)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data (0)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic stores')
+    parser.add_argument('--output', help='result file (benchmarks/results/<date>.json)')
+    parser.add_argument('--baseline', help='previous result file to compare with')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--startup-only', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.variables = args.variables.split(',')
+    if args.worker:
+        return worker(args)
+    results = {'meta': run_meta(seed=args.seed, repeats=args.repeats), 'scales': []}
+    for scale in args.scales.split(','):
+        scale = float(scale) if '.' in scale else int(scale)
+        print('Scale %sx' % scale, file=sys.stderr)
+        results['scales'].append(measure_scale(scale, args))
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
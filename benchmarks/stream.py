@@ -0,0 +1,124 @@
+###########################################################
+# Streaming ingest memory
+###########################################################
+"""Peak memory of read_data streaming the raw files against reading them in memory.
+
+Unzip trees of --small and --days days of synthetic raw files
+(benchmarks/rawdata.py, kept in --data) are read by read_data without a
+manifest, streamed (stream: True) and in memory (stream: False), and with
+a manifest (first run, files: manifest as in others/config.yml). The peak
+of the memory allocated during each read is measured with tracemalloc.
+
+The streamed peaks must not grow with the days read: the script fails if
+the peak for --days is more than --tolerance times the peak for --small,
+without and with a manifest. The store and csv of the three reads must be
+the same.
+
+The manifest keeps the 1-minute totals of the whole history, so the peak of
+a daily update is also measured after the synthetic totals of each number
+of years of --years (benchmarks/ingest.py history_conf, outputs written
+first): the script fails if the peak for the most years is more than
+--tolerance times the one for the fewest, as when the totals of the whole
+history were loaded.
+
+    python benchmarks/stream.py --small 2 --days 6 --years 1,4
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from ingest import START, conffile, history_conf, same_outputs  # noqa: E402
+from rawdata import write_day  # noqa: E402
+from run import run_meta  # noqa: E402
+from others.scr.read_data import read_data  # noqa: E402
+
+
+def measure(conf):
+    # seconds and peak of the memory allocated by read_data (MB)
+    tracemalloc.start()
+    start = time.perf_counter()
+    read_data(conf)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak_mb': peak/2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--small', type=int, default=2, help='days of the small read (2)')
+    parser.add_argument('--days', type=int, default=6, help='days of the large read (6)')
+    parser.add_argument('--rows', type=int, default=86400, help='LGR rows per day (86400, 1 Hz)')
+    parser.add_argument('--years', default='1,4', help='years of totals before the daily update (1,4)')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='largest ratio of the streamed peaks, large to small (1.25)')
+    parser.add_argument('--data', default=os.path.join(BENCHMARKS, 'data'), help='folder of the synthetic files')
+    parser.add_argument('--output', help='result file (benchmarks/results/stream-<date>.json)')
+    args = parser.parse_args()
+    args.years = [float(years) for years in args.years.split(',')]
+    logging.basicConfig(level=logging.WARNING)
+    cache = os.path.join(args.data, 'ingest-%i' % args.rows)
+    days = [START + pd.Timedelta(days=i) for i in range(args.days)]
+    for i, day in enumerate(days):
+        if not os.path.exists(os.path.join(cache, day.strftime('%Y%m%d'))):
+            write_day(cache, day, args.rows, seed=i)
+    work = tempfile.mkdtemp(prefix='stream-')
+    results = {}
+    try:
+        for ndays in (args.small, args.days):
+            unzip = os.path.join(work, '%i' % ndays, 'unzip')
+            os.makedirs(unzip)
+            for day in days[:ndays]:
+                name = day.strftime('%Y%m%d')
+                os.symlink(os.path.join(os.path.abspath(cache), name), os.path.join(unzip, name))
+            confs = {}
+            for name, stream, manifest in (('stream', True, False), ('memory', False, False),
+                                           ('manifest', True, True)):
+                confs[name] = conffile(os.path.join(work, '%i' % ndays, name), unzip, manifest)
+                confs[name]['stream'] = stream
+                results['%s_%i' % (name, ndays)] = measure(confs[name])
+            same_outputs(confs['stream'], confs['memory'])
+            same_outputs(confs['manifest'], confs['memory'])
+        for years in args.years:
+            results['history_%g' % years] = measure(history_conf(os.path.join(work, 'history-%g' % years), cache,
+                                                                 days[0], years))
+    finally:
+        shutil.rmtree(work)
+    for name, result in results.items():
+        print('%-10s %8.3f s, peak %8.1f MB' % (name, result['seconds'], result['peak_mb']), file=sys.stderr)
+    ratios = {}
+    for name in ('stream', 'manifest'):
+        ratios[name] = results['%s_%i' % (name, args.days)]['peak_mb']/results['%s_%i' % (name, args.small)]['peak_mb']
+        print('%s peak %i days / %i days: %.2f' % (name, args.days, args.small, ratios[name]), file=sys.stderr)
+    ratios['history'] = (results['history_%g' % max(args.years)]['peak_mb']
+                         / results['history_%g' % min(args.years)]['peak_mb'])
+    print('update peak %g years / %g years: %.2f' % (max(args.years), min(args.years), ratios['history']),
+          file=sys.stderr)
+    print('same outputs', file=sys.stderr)
+    results = {'meta': run_meta(small=args.small, days=args.days, rows=args.rows, years=args.years),
+               'reads': results, 'stream_ratio': ratios['stream'], 'manifest_ratio': ratios['manifest'],
+               'history_ratio': ratios['history']}
+    output = args.output or os.path.join(BENCHMARKS, 'results', time.strftime('stream-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=1)
+    print('Results written: %s' % output, file=sys.stderr)
+    for name, ratio in ratios.items():
+        assert ratio <= args.tolerance, '%s peak grows with the %s read (%.2f > %.2f)' % (
+            name, 'history' if name == 'history' else 'days', ratio, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+###########################################################
+# Synthetic expedition data
+###########################################################
+"""Data stores shaped like AllData.csv at a multiple of its size.
+
+One row per minute from the first date of the expedition, with the columns
+of AllData.csv: a ship track wandering between the North Atlantic and
+Svalbard, and measurements around the means of the real data with a daily
+cycle, slow drifts, noise and gaps in CH4d_ppm/CO2d_ppm. Scale 1 has the
+rows of AllData.csv (62549); the rows are written in chunks with
+datastore.append_store so a 1000x store never sits in memory. The same scale
+and seed always give the same store.
+
+    python benchmarks/synthetic.py 10 benchmarks/data/synthetic-x10.store
+"""
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from others.scr.datastore import META_FILE, append_store, read_meta  # noqa: E402
+
+ROWS = 62549
+START = '2020-06-09 20:20'
+CHUNK = 1000000
+# mean, amplitude of the daily cycle, range of the slow drift and noise of
+# every variable, close to the statistics of AllData.csv
+VARIABLES = {
+    'CH4d_ppm': (1.12, 0.02, 0.05, 0.01),
+    'CO2d_ppm': (419., 3., 15., 1.),
+    'Temp °C': (5., 0.5, 2., 0.05),
+    'Sal psu': (33., 0.2, 1.5, 0.05),
+    'ODO % sat': (95., 1., 2., 0.2),
+    'Turbidity FNU': (0.8, 0.2, 0.5, 0.1),
+    'SpCond µS/cm': (50000., 50., 150., 10.),
+}
+# minutes to drift across the whole range
+DRIFT = 10000
+# latitude and longitude limits of the track and maximum speed (degrees per
+# minute), the speed changes slowly so the ship keeps a heading for a while
+TRACK = {'Latitude': (48., 82., 0.004), 'Longitude': (-10., 30., 0.01)}
+TURN = 30.
+# fraction of the rows of the gas analyser gaps and length of a gap (minutes)
+GAPS = 0.023
+GAP_LENGTH = 120
+
+
+def fold(x, low, high):
+    """Values of x reflected back and forth between low and high."""
+    width = high - low
+    x = np.mod(x - low, 2*width)
+    return low + np.where(x > width, 2*width - x, x)
+
+
+def chunks(scale, seed=0, chunk=CHUNK):
+    """Dataframes of at most chunk rows making up the synthetic data.# {{{
+
+    Parameters
+    ----------
+    scale : number of times the rows of AllData.csv
+    seed : seed of the random numbers
+    chunk : maximum number of rows per dataframe
+
+    """# }}}
+    rng = np.random.default_rng(seed)
+    nrows = int(round(ROWS*scale))
+    start = np.datetime64(pd.Timestamp(START).to_datetime64(), 'ns')
+    minute = np.timedelta64(60, 's').astype('timedelta64[ns]')
+    # random walks carried from one chunk to the next
+    walks = {name: 0. for name in list(TRACK) + list(VARIABLES)}
+    speeds = {name: 0. for name in TRACK}
+    for first in range(0, nrows, chunk):
+        n = min(chunk, nrows - first)
+        rows = np.arange(first, first + n)
+        data = {'Datetime': start + rows*minute}
+        for name, (low, high, vmax) in TRACK.items():
+            speed = speeds[name] + np.cumsum(rng.normal(0, vmax/TURN, n))
+            speeds[name] = speed[-1]
+            walk = walks[name] + np.cumsum(fold(speed, -vmax, vmax))
+            walks[name] = walk[-1]
+            data[name] = fold((low + high)/2 + walk, low, high)
+        day = np.sin(2*np.pi*rows/1440.)
+        for name, (mean, cycle, drift, noise) in VARIABLES.items():
+            walk = walks[name] + np.cumsum(rng.normal(0, drift/np.sqrt(DRIFT), n))
+            walks[name] = walk[-1]
+            data[name] = mean + cycle*day + fold(walk, -drift/2, drift/2) + rng.normal(0, noise, n)
+        # the gas analyser stops for a while now and then
+        gaps = np.zeros(n, dtype=bool)
+        for gap in rng.integers(0, n, rng.poisson(n*GAPS/GAP_LENGTH)):
+            gaps[gap:gap + GAP_LENGTH] = True
+        for name in ('CH4d_ppm', 'CO2d_ppm'):
+            data[name][gaps] = np.nan
+        yield pd.DataFrame(data)
+
+
+def generate(path, scale, seed=0, chunk=CHUNK):
+    """Write the synthetic data of a scale in a store (kept if already there).# {{{
+
+    Parameters
+    ----------
+    path : folder of the store
+    scale : number of times the rows of AllData.csv
+    seed : seed of the random numbers
+    chunk : rows written at once
+
+    Returns
+    -------
+    nrows: number of rows of the store
+
+    """# }}}
+    nrows = int(round(ROWS*scale))
+    if os.path.exists(path):
+        meta = read_meta(path)
+        if meta['nrows'] == nrows and meta.get('synthetic') == {'scale': scale, 'seed': seed}:
+            return nrows
+        raise ValueError('%s is not the synthetic data of scale %s, seed %s' % (path, scale, seed))
+    tmppath = path + '.partial'
+    if os.path.exists(tmppath):
+        shutil.rmtree(tmppath)
+    for data in chunks(scale, seed, chunk):
+        meta = append_store(data, tmppath)
+    # scale and seed in meta.json, so a finished store is recognised
+    meta['synthetic'] = {'scale': scale, 'seed': seed}
+    with open(os.path.join(tmppath, META_FILE), 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.rename(tmppath, path)
+    return nrows
+
+
+if __name__ == '__main__':
+    generate(sys.argv[2], float(sys.argv[1]))
@@ -0,0 +1,25 @@
+# Gunicorn settings of the dashboard (Procfile: gunicorn -c gunicorn.conf.py)
+import gc
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threads per worker: a long download of /export streams in one thread while
+# the others keep serving the callbacks
+threads = int(os.environ.get('ARTIC_THREADS', 4))
+# Import ArticChangeApp once in the master: the dataset and its indexes are
+# built before the workers are forked and shared with them (copy on write),
+# the pyramid itself is memory-mapped from the store.
+preload_app = os.environ.get('ARTIC_PRELOAD', '1') == '1'
+
+
+def pre_fork(server, worker):
+    # objects of the master are never collected again, so the garbage
+    # collector of the workers does not write in (and copy) their pages
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # metrics of the dead worker are dropped from /metrics (multiprocess mode)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -6,6 +6,7 @@
 ###########################################################
 
 
+import argparse
 import logging
 
 import scr.config_logging as conflog
@@ -18,10 +19,16 @@ from scr.plot_data import plot_data
 
 def main():
     """Execute main routines."""
+    parser = argparse.ArgumentParser(description='Read and plot the data of the expedition (config.yml)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='processes parsing the raw files (1: one after the other, 0: one per CPU)')
+    parser.add_argument('--full', action='store_true',
+                        help='parse all the raw files again, not only the ones missing from the manifest')
+    args = parser.parse_args()
     conflog.logging_config()
     conffile = conflog.read_config()
     logging.info('STEP 1: READING DATA')
-    Data = read_data(conffile)
+    Data = read_data(conffile, jobs=args.jobs, full=args.full)
     logging.info('STEP 2: Plotting data')
     #plot_data(Data)
     # plot_map(Data)
@@ -0,0 +1,134 @@
+###########################################################
+# Range aggregates
+###########################################################
+"""Constant-time statistics over any contiguous range of rows.
+
+For a column sorted by time, ``RangeStats`` keeps NaN-aware prefix sums and
+counts (mean of rows i0..i1 in O(1)) and a segment tree over blocks of rows
+for the minimum and maximum (O(log n) plus one block scan at each end).
+The memory used is about 12 bytes per row for the sums plus 1 byte per row
+for the tree.
+"""
+
+import threading
+
+import numpy as np
+
+
+class RangeStats:
+    """Mean, min, max and count of values[i0:i1] without scanning them.# {{{
+
+    Parameters
+    ----------
+    values : 1d float array (NaN for missing values), not copied
+    block : rows per leaf of the min/max tree
+
+    """# }}}
+
+    def __init__(self, values, block=64):
+        values = np.asarray(values, dtype=float)
+        self.values = values
+        self.block = block
+        valid = ~np.isnan(values)
+        # sums relative to the mean keep the prefix sums small (precision)
+        self.offset = values[valid].mean() if valid.any() else 0.
+        self._sum = np.zeros(len(values) + 1)
+        np.cumsum(np.where(valid, values - self.offset, 0.), out=self._sum[1:])
+        self._count = np.zeros(len(values) + 1, dtype='int64')
+        np.cumsum(valid, out=self._count[1:])
+        # segment trees (min and max) over the blocks, leaves at [size, 2*size)
+        nblocks = -(-len(values)//block)
+        self._size = 1
+        while self._size < max(nblocks, 1):
+            self._size *= 2
+        padded = np.full(self._size*block, np.nan)
+        padded[:len(values)] = values
+        padded = padded.reshape(self._size, block)
+        self._min = np.full(2*self._size, np.inf)
+        self._max = np.full(2*self._size, -np.inf)
+        self._min[self._size:] = np.where(np.isnan(padded), np.inf, padded).min(axis=1)
+        self._max[self._size:] = np.where(np.isnan(padded), -np.inf, padded).max(axis=1)
+        lo = self._size
+        while lo > 1:
+            lo //= 2
+            self._min[lo:2*lo] = np.minimum(self._min[2*lo:4*lo:2], self._min[2*lo+1:4*lo:2])
+            self._max[lo:2*lo] = np.maximum(self._max[2*lo:4*lo:2], self._max[2*lo+1:4*lo:2])
+
+    def __len__(self):
+        return len(self.values)
+
+    def count(self, i0, i1):
+        """Number of values (not NaN) in [i0, i1)."""
+        return int(self._count[i1] - self._count[i0])
+
+    def mean(self, i0, i1):
+        count = self.count(i0, i1)
+        if count == 0:
+            return np.nan
+        return self.offset + (self._sum[i1] - self._sum[i0])/count
+
+    def _tree(self, tree, reduce, b0, b1):
+        # reduce the blocks [b0, b1) of a segment tree
+        result = tree[0]
+        b0 += self._size
+        b1 += self._size
+        while b0 < b1:
+            if b0 & 1:
+                result = reduce(result, tree[b0])
+                b0 += 1
+            if b1 & 1:
+                b1 -= 1
+                result = reduce(result, tree[b1])
+            b0 //= 2
+            b1 //= 2
+        return result
+
+    def minmax(self, i0, i1):
+        """Minimum and maximum of values[i0:i1] (NaN when there is no value)."""
+        if i1 <= i0 or self.count(i0, i1) == 0:
+            return np.nan, np.nan
+        b0 = -(-i0//self.block)
+        b1 = i1//self.block
+        if b0 >= b1:
+            part = self.values[i0:i1]
+            return np.nanmin(part), np.nanmax(part)
+        vmin = self._tree(self._min, min, b0, b1)
+        vmax = self._tree(self._max, max, b0, b1)
+        # partial blocks at both ends
+        for part in (self.values[i0:b0*self.block], self.values[b1*self.block:i1]):
+            if len(part) and not np.isnan(part).all():
+                vmin = min(vmin, np.nanmin(part))
+                vmax = max(vmax, np.nanmax(part))
+        return vmin, vmax
+
+    def stats(self, i0, i1):
+        """Dictionary with mean, min, max and count of values[i0:i1]."""
+        vmin, vmax = self.minmax(i0, i1)
+        return {'mean': self.mean(i0, i1), 'min': vmin, 'max': vmax, 'count': self.count(i0, i1)}
+
+
+class LevelStats:
+    """RangeStats of every column of a pyramid level, built when first used."""
+
+    def __init__(self, level):
+        self.level = level
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, column):
+        with self._lock:
+            if column not in self._stats:
+                self._stats[column] = RangeStats(self.level[column])
+            return self._stats[column]
+
+    def stats(self, column, i0, i1):
+        return self[column].stats(i0, i1)
+
+
+def point_stats(values):
+    """Same dictionary as RangeStats.stats for any set of values (O(n))."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'mean': np.nan, 'min': np.nan, 'max': np.nan, 'count': 0}
+    return {'mean': values.mean(), 'min': values.min(), 'max': values.max(), 'count': len(values)}
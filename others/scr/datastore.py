@@ -0,0 +1,358 @@
+###########################################################
+# Columnar dataset store
+###########################################################
+"""Binary, memory-mappable store for the merged expedition data.
+
+A store is a folder with one raw little-endian file per column and a
+``meta.json`` describing them::
+
+    AllData.store/
+        meta.json
+        c000.bin   <- Datetime, int64 nanoseconds since epoch
+        c001.bin   <- Latitude, float64
+        ...
+
+Columns are read back with ``numpy.memmap`` so loading does not parse any
+text and pages are shared by every process that opens the same store.
+New rows are appended at the end of the column files before ``nrows`` is
+updated in ``meta.json``, so readers never see a partial row.
+``StoreWriter`` writes a store chunk by chunk, for data larger than memory,
+and ``StoreAppender`` appends chunks to an existing store. A store being
+replaced is locked with the file ``<store>.lock`` next to its folder (see
+``store_lock``), which stays the same across the swap.
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+TIME_COLUMN = 'Datetime'
+META_FILE = 'meta.json'
+LOCK_SUFFIX = '.lock'
+
+
+def write_store(data, path):
+    """Write a dataframe as a columnar store.# {{{
+
+    Parameters
+    ----------
+    data : dataframe with a Datetime column (or a DatetimeIndex)
+    path : folder of the store, replaced if it already exists
+
+    Returns
+    -------
+    meta: dictionary written to meta.json
+
+    """# }}}
+    writer = StoreWriter(path)
+    writer.write(data)
+    return writer.close()
+
+
+class StoreWriter:
+    """Store written chunk by chunk, replacing path on close.# {{{
+
+    The columns are appended to the files of a temporary folder as the
+    chunks come (the columns of the first chunk, in the same order) and the
+    folder replaces the store on close, so readers never see a partial
+    store. abort removes the temporary folder.
+
+    Parameters
+    ----------
+    path : folder of the store
+
+    """# }}}
+
+    def __init__(self, path):
+        self.path = path
+        self.tmppath = path + '.tmp'
+        if os.path.exists(self.tmppath):
+            shutil.rmtree(self.tmppath)
+        os.makedirs(self.tmppath)
+        self.meta = None
+        self.files = []
+
+    def write(self, data):
+        """Append the rows of a dataframe (Datetime column or index)."""
+        if TIME_COLUMN not in data.columns:
+            data = data.rename_axis(TIME_COLUMN).reset_index()
+        if self.meta is None:
+            columns = [TIME_COLUMN] + [col for col in data.columns if col != TIME_COLUMN]
+            self.meta = {'version': STORE_VERSION, 'nrows': 0, 'columns': []}
+            for i, col in enumerate(columns):
+                dtype = '<i8' if col == TIME_COLUMN else '<f8'
+                filename = 'c%03d.bin' % i
+                self.meta['columns'].append({'name': col, 'file': filename, 'dtype': np.dtype(dtype).str})
+                self.files.append(open(os.path.join(self.tmppath, filename), 'wb'))
+        for col, file in zip(self.meta['columns'], self.files):
+            if col['name'] == TIME_COLUMN:
+                values = data[TIME_COLUMN].values.astype('datetime64[ns]').view('<i8')
+            else:
+                values = pd.to_numeric(data[col['name']], errors='coerce').values.astype('<f8')
+            np.ascontiguousarray(values).tofile(file)
+        self.meta['nrows'] += len(data)
+
+    def close(self):
+        """Replace the store with the rows written, return meta.json."""
+        for file in self.files:
+            file.close()
+        if self.meta is None:
+            self.write(pd.DataFrame({TIME_COLUMN: np.empty(0, dtype='datetime64[ns]')}))
+            self.files[0].close()
+        with open(os.path.join(self.tmppath, META_FILE), 'w') as file:
+            json.dump(self.meta, file, indent=1)
+        if os.path.exists(self.path):
+            # not while a dashboard worker builds the pyramid of the store
+            with store_lock(self.path):
+                replace_folder(self.tmppath, self.path)
+        else:
+            os.rename(self.tmppath, self.path)
+        logging.info('Data store written: %s (%i rows)', self.path, self.meta['nrows'])
+        return self.meta
+
+    def abort(self):
+        for file in self.files:
+            file.close()
+        shutil.rmtree(self.tmppath)
+
+
+@contextlib.contextmanager
+def store_lock(path):
+    """Exclusive lock of a store, True when taken (False: file not writable).# {{{
+
+    The lock file is next to the folder of the store (``<store>.lock``), so
+    the processes locking the store before and after it is replaced by a
+    StoreWriter use the same file.
+
+    """# }}}
+    try:
+        lock = open(os.path.normpath(path) + LOCK_SUFFIX, 'a')
+    except OSError:
+        yield False
+        return
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def replace_folder(tmppath, path):
+    # path replaced by tmppath, the .old folder of an interrupted swap removed first
+    oldpath = path + '.old'
+    if os.path.exists(oldpath):
+        shutil.rmtree(oldpath)
+    if os.path.exists(path):
+        os.rename(path, oldpath)
+        os.rename(tmppath, path)
+        shutil.rmtree(oldpath)
+    else:
+        os.rename(tmppath, path)
+
+
+def append_store(data, path):
+    """Append the rows of a dataframe after the last row of a store.# {{{
+
+    Parameters
+    ----------
+    data : dataframe with the columns of the store (Datetime column or index),
+        rows older than the last row of the store are dropped
+    path : folder of the store, written with write_store if it does not exist
+
+    Returns
+    -------
+    meta: dictionary written to meta.json
+
+    """# }}}
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return write_store(data, path)
+    if TIME_COLUMN not in data.columns:
+        data = data.rename_axis(TIME_COLUMN).reset_index()
+    meta = read_meta(path)
+    names = [col['name'] for col in meta['columns']]
+    if set(names) != set(data.columns):
+        raise ValueError('Columns of the new rows do not match the store %s' % path)
+    times = data[TIME_COLUMN].values.astype('datetime64[ns]')
+    if meta['nrows']:
+        last = open_store(path)[TIME_COLUMN][-1]
+        data = data[times.view('<i8') > last]
+    if len(data) == 0:
+        return meta
+    for col in meta['columns']:
+        if col['name'] == TIME_COLUMN:
+            values = data[TIME_COLUMN].values.astype('datetime64[ns]').view('<i8')
+        else:
+            values = pd.to_numeric(data[col['name']], errors='coerce').values
+        values = np.ascontiguousarray(values, dtype=col['dtype'])
+        with open(os.path.join(path, col['file']), 'r+b') as file:
+            # drop the rows of an append that did not reach meta.json
+            file.truncate(meta['nrows']*values.itemsize)
+            file.seek(0, os.SEEK_END)
+            values.tofile(file)
+    meta['nrows'] += len(data)
+    tmpfile = os.path.join(path, META_FILE + '.tmp')
+    with open(tmpfile, 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.replace(tmpfile, os.path.join(path, META_FILE))
+    logging.info('Data store appended: %s (%i new rows)', path, len(data))
+    return meta
+
+
+class StoreAppender:
+    """Chunks appended to an existing store with append_store.# {{{
+
+    Same interface as StoreWriter: the rows up to the last row of the store
+    are dropped and every chunk is visible to the readers once written.
+
+    Parameters
+    ----------
+    path : folder of the store
+    columns : columns of the chunks (without Datetime), ValueError if they
+        are not the ones of the store
+
+    """# }}}
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.meta = read_meta(path)
+        names = [col['name'] for col in self.meta['columns']]
+        if set(names) != {TIME_COLUMN, *columns}:
+            raise ValueError('Columns of the new rows do not match the store %s' % path)
+
+    def write(self, data):
+        """Append the rows of a dataframe after the last row of the store."""
+        self.meta = append_store(data, self.path)
+
+    def close(self):
+        return self.meta
+
+    def abort(self):
+        # the rows appended are whole rows, nothing to remove
+        pass
+
+
+def write_tail(data, path, start):
+    """Write the rows of a dataframe over the rows of a store from start.# {{{
+
+    The values are written in place from row start and the files are not
+    truncated: the store must not be mapped by a reader, which would see the
+    rows from start change (pyramid.extend_saved_pyramid writes in a copy).
+    meta.json is replaced last, with start + len(data) rows.
+
+    Parameters
+    ----------
+    data : dataframe with the columns of the store (Datetime column or index)
+    path : folder of the store
+    start : first row written, at most the number of rows of the store
+
+    Returns
+    -------
+    meta: dictionary written to meta.json
+
+    """# }}}
+    if TIME_COLUMN not in data.columns:
+        data = data.rename_axis(TIME_COLUMN).reset_index()
+    meta = read_meta(path)
+    if {col['name'] for col in meta['columns']} != set(data.columns):
+        raise ValueError('Columns of the new rows do not match the store %s' % path)
+    if not 0 <= start <= meta['nrows']:
+        raise ValueError('Row %i out of the %i rows of the store %s' % (start, meta['nrows'], path))
+    for col in meta['columns']:
+        if col['name'] == TIME_COLUMN:
+            values = data[TIME_COLUMN].values.astype('datetime64[ns]').view('<i8')
+        else:
+            values = pd.to_numeric(data[col['name']], errors='coerce').values
+        values = np.ascontiguousarray(values, dtype=col['dtype'])
+        with open(os.path.join(path, col['file']), 'r+b') as file:
+            file.seek(start*values.itemsize)
+            values.tofile(file)
+    meta['nrows'] = start + len(data)
+    tmpfile = os.path.join(path, META_FILE + '.tmp')
+    with open(tmpfile, 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.replace(tmpfile, os.path.join(path, META_FILE))
+    return meta
+
+
+def store_end(path):
+    """Datetime of the last row of a store (None: no store or no rows)."""
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    times = open_store(path)[TIME_COLUMN]
+    return pd.Timestamp(int(times[-1])) if len(times) else None
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), 'r') as file:
+        meta = json.load(file)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError('Unsupported data store version %s in %s' % (meta['version'], path))
+    return meta
+
+
+def open_store(path):
+    """Map every column of a store without reading it.# {{{
+
+    Parameters
+    ----------
+    path : folder of the store
+
+    Returns
+    -------
+    columns: dictionary column name -> read-only numpy array (memmap)
+
+    """# }}}
+    meta = read_meta(path)
+    nrows = meta['nrows']
+    columns = {}
+    for col in meta['columns']:
+        filename = os.path.join(path, col['file'])
+        if nrows == 0:
+            columns[col['name']] = np.empty(0, dtype=col['dtype'])
+        else:
+            columns[col['name']] = np.memmap(filename, dtype=col['dtype'], mode='r', shape=(nrows,))
+    return columns
+
+
+def read_store(path):
+    """Read a store as a dataframe with a datetime64 Datetime column.# {{{
+
+    Parameters
+    ----------
+    path : folder of the store
+
+    Returns
+    -------
+    data: dataframe
+
+    """# }}}
+    columns = open_store(path)
+    data = {}
+    for name, values in columns.items():
+        if name == TIME_COLUMN:
+            data[name] = values.view('datetime64[ns]')
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def csv_to_store(filename, path):
+    """Convert a csv written by read_data (or AllData.csv) to a store."""
+    data = pd.read_csv(filename, parse_dates=[TIME_COLUMN])
+    data = data.drop([col for col in data.columns if col.startswith('Unnamed')], axis=1)
+    return write_store(data, path)
+
+
+if __name__ == '__main__':
+    # python others/scr/datastore.py others/AllData.csv others/AllData.store
+    logging.basicConfig(level=logging.INFO)
+    csv_to_store(sys.argv[1], sys.argv[2])
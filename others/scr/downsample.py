@@ -0,0 +1,68 @@
+###########################################################
+# Downsampling of time series
+###########################################################
+"""Shape-preserving point selection for the time-series panel.
+
+Both methods return the positions of the points to keep, so any other column
+(dates, labels) can be taken with the same positions. NaN values are never
+selected.
+
+- minmax: the minimum and the maximum of each bucket, keeps every peak
+- lttb: largest triangle three buckets, one point per bucket chosen to keep
+  the visual shape of the line
+"""
+
+import numpy as np
+
+
+def minmax(y, n):
+    """Positions of the min and max of n/2 equal buckets of y (vectorised)."""
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n:
+        return valid
+    values = y[valid]
+    nbuckets = max(n//2, 1)
+    starts = np.linspace(0, len(values), nbuckets + 1).astype('int64')[:-1]
+    bucket = np.repeat(np.arange(nbuckets), np.diff(np.append(starts, len(values))))
+    keep = []
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(values, starts)
+        hits = np.flatnonzero(values == extreme[bucket])
+        # first position reaching the extreme of each bucket
+        first = np.unique(bucket[hits], return_index=True)[1]
+        keep.append(hits[first])
+    return valid[np.unique(np.concatenate(keep))]
+
+
+def lttb(x, y, n):
+    """Positions of n points chosen by largest triangle three buckets."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(~np.isnan(y) & ~np.isnan(x))
+    if len(valid) <= n or n < 3:
+        return valid
+    xv = x[valid]
+    yv = y[valid]
+    edges = np.linspace(1, len(valid) - 1, n - 1).astype('int64')
+    keep = np.empty(n, dtype='int64')
+    keep[0] = 0
+    keep[-1] = len(valid) - 1
+    a = 0
+    for i in range(n - 2):
+        b0, b1 = edges[i], edges[i + 1]
+        # average of the next bucket (the last point for the last bucket)
+        c0, c1 = b1, edges[i + 2] if i + 2 < len(edges) else len(valid)
+        cx = xv[c0:c1].mean()
+        cy = yv[c0:c1].mean()
+        area = np.abs((xv[a] - cx)*(yv[b0:b1] - yv[a]) - (xv[a] - xv[b0:b1])*(cy - yv[a]))
+        a = b0 + int(np.argmax(area))
+        keep[i + 1] = a
+    return valid[keep]
+
+
+def downsample(x, y, n, method='minmax'):
+    """Positions of at most n points of (x, y), x are datetime64 or numbers."""
+    if method == 'lttb':
+        return lttb(np.asarray(x).astype('int64'), y, n)
+    return minmax(y, n)
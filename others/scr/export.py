@@ -0,0 +1,76 @@
+###########################################################
+# Streaming data export
+###########################################################
+"""Rows of the data written chunk by chunk for a download.
+
+The columns are read in blocks of ``CHUNK`` rows from read-only arrays (a
+level of the pyramid or the memory-mapped data store) and every block is
+formatted and handed to the web server before the next one is read, so an
+export of the whole record uses the memory of one block.
+
+- csv: a header line, then the rows with Datetime as '%Y-%m-%d %H:%M:%S'
+- npz: a zip of one .npy file per column (numpy.load reads it), written
+  without seeking so it can be streamed; Datetime is datetime64[ns]
+"""
+
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+CHUNK = 65536
+FORMATS = {'csv': 'text/csv', 'npz': 'application/zip'}
+
+
+def csv_chunks(columns, names, i0, i1, chunk=CHUNK):
+    """CSV text (bytes) of the rows [i0, i1) of columns, block by block."""
+    yield (','.join(names) + '\n').encode('utf-8')
+    for j0 in range(i0, i1, chunk):
+        j1 = min(j0 + chunk, i1)
+        block = pd.DataFrame({name: columns[name][j0:j1] for name in names})
+        yield block.to_csv(header=False, index=False, date_format='%Y-%m-%d %H:%M:%S').encode('utf-8')
+
+
+class _Pipe:
+    # write-only file collecting what zipfile writes, emptied by take()
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def npz_chunks(columns, names, i0, i1, chunk=CHUNK):
+    """Zip of one .npy per column (bytes) of the rows [i0, i1), block by block."""
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in names:
+            dtype = columns[name].dtype
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(
+                    header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (i1 - i0,)})
+            # '/' would make a folder in the archive ('SpCond µS/cm')
+            with archive.open(name.replace('/', '_') + '.npy', 'w', force_zip64=True) as member:
+                member.write(header.getvalue())
+                for j0 in range(i0, i1, chunk):
+                    member.write(np.ascontiguousarray(columns[name][j0:min(j0 + chunk, i1)]).tobytes())
+                    yield pipe.take()
+            yield pipe.take()
+    yield pipe.take()
+
+
+def export_chunks(columns, names, i0, i1, fmt='csv', chunk=CHUNK):
+    """Bytes of the export of the rows [i0, i1) of columns in a format of FORMATS."""
+    if fmt == 'npz':
+        return npz_chunks(columns, names, i0, i1, chunk)
+    return csv_chunks(columns, names, i0, i1, chunk)
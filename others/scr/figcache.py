@@ -0,0 +1,128 @@
+###########################################################
+# Figure cache
+###########################################################
+"""LRU cache for the figures returned by the dashboard callbacks.
+
+Entries live in memory (one cache per process). When a sqlite file is given
+the entries are also written there, so every gunicorn worker on the machine
+finds the figures built by the others.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class FigureCache:
+    """Size capped LRU cache with an optional shared sqlite backend.# {{{
+
+    Parameters
+    ----------
+    maxsize : maximum number of entries (in memory and in sqlite)
+    path : sqlite file shared between processes, None to keep it in memory
+    dumps, loads : serialization of the values for the sqlite backend
+
+    """# }}}
+
+    def __init__(self, maxsize=128, path=None, dumps=json.dumps, loads=json.loads):
+        self.maxsize = maxsize
+        self.path = path
+        self.dumps = dumps
+        self.loads = loads
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            with self._connect() as con:
+                con.execute('CREATE TABLE IF NOT EXISTS figures '
+                            '(key TEXT PRIMARY KEY, value TEXT, atime REAL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        """Cached value of key or None."""
+        key = json.dumps(key)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = None
+        if self.path:
+            with self._connect() as con:
+                row = con.execute('SELECT value FROM figures WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    con.execute('UPDATE figures SET atime = ? WHERE key = ?', (time.time(), key))
+                    value = self.loads(row[0])
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.shared_hits += 1
+                self._add(key, value)
+        return value
+
+    def set(self, key, value):
+        key = json.dumps(key)
+        with self._lock:
+            self._add(key, value)
+        if self.path:
+            with self._connect() as con:
+                con.execute('INSERT OR REPLACE INTO figures VALUES (?, ?, ?)',
+                            (key, self.dumps(value), time.time()))
+                cur = con.execute('DELETE FROM figures WHERE key NOT IN '
+                                  '(SELECT key FROM figures ORDER BY atime DESC LIMIT ?)',
+                                  (self.maxsize,))
+                with self._lock:
+                    self.evictions += max(cur.rowcount, 0)
+
+    def _add(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, match):
+        """Remove the entries whose key verifies match(key), return how many."""
+        with self._lock:
+            keys = [key for key in self._entries if match(json.loads(key))]
+            for key in keys:
+                del self._entries[key]
+        count = len(keys)
+        if self.path:
+            with self._connect() as con:
+                rows = con.execute('SELECT key FROM figures').fetchall()
+                shared = [(key,) for key, in rows if match(json.loads(key))]
+                con.executemany('DELETE FROM figures WHERE key = ?', shared)
+            count = max(count, len(shared))
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with self._connect() as con:
+                con.execute('DELETE FROM figures')
+
+    def stats(self):
+        """Counters of the cache (hit rate over the life of the process)."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits/requests if requests else 0.,
+                'backend': 'sqlite' if self.path else 'memory',
+            }
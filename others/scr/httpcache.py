@@ -0,0 +1,87 @@
+###########################################################
+# Compression and HTTP caching
+###########################################################
+"""Compressed and cacheable responses of the dashboard server.
+
+- compression: responses above a size threshold are sent with brotli (when
+  the brotli module is installed) or gzip, as accepted by the browser
+  (Flask-Compress)
+- ETag: the JSON of the layout, the callback dependencies, the index page and
+  the callback responses get an ETag computed from their uncompressed body,
+  so it does not depend on the encoding chosen. A request with a matching
+  If-None-Match gets an empty 304; for callbacks (POST) this is only used by
+  clients that send it (scripts, proxies), browsers do not cache POST
+- assets: fingerprinted assets, favicon and component suites (``?m=<mtime>``,
+  ``?v=<version>`` or a fingerprint in the path) never change under their URL and are cached
+  for a year as immutable, the others are revalidated with their ETag
+"""
+
+import hashlib
+
+import flask
+from flask_compress import Compress
+
+YEAR = 31536000
+# GET routes whose JSON is revalidated with its ETag
+REVALIDATED = ('/', '/_dash-layout', '/_dash-dependencies')
+CALLBACKS = '/_dash-update-component'
+
+
+def compression_algorithms():
+    """Encodings offered, brotli first when its module is installed."""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return ['gzip']
+    return ['br', 'gzip']
+
+
+def etag_matches(etag, if_none_match):
+    # Flask-Compress sends "<etag>:<encoding>", both forms are the same body
+    return any(tag == etag or tag.startswith(etag + ':') for tag in if_none_match)
+
+
+def init_http(server, compress=True, min_size=500, assets_path='/assets/'):
+    """Compression, ETags and cache headers of a Flask server.# {{{
+
+    Parameters
+    ----------
+    server : Flask server of the Dash app (created with compress=False)
+    compress : compress the responses
+    min_size : bytes, smaller responses are sent as they are
+    assets_path : URL of the assets folder
+
+    """# }}}
+    # registered first, called last: the ETag below is set before compressing
+    if compress:
+        server.config.update(
+            COMPRESS_ALGORITHM=compression_algorithms(),
+            COMPRESS_MIN_SIZE=min_size,
+            COMPRESS_LEVEL=6,
+            COMPRESS_BR_LEVEL=4,
+            )
+        Compress(server)
+
+    def conditional(response):
+        # empty 304 when the browser already has this body
+        etag = response.get_etag()[0]
+        if etag and response.status_code == 200 and etag_matches(etag, flask.request.if_none_match.as_set()):
+            response.status_code = 304
+            response.set_data(b'')
+        return response
+
+    @server.after_request
+    def cache_headers(response):
+        path = flask.request.path
+        method = flask.request.method
+        if path.startswith((assets_path, '/_dash-component-suites/', '/_favicon.ico')):
+            # ?m=<mtime> of the assets, ?v=<dash version> of the favicon
+            if flask.request.args.get('m') or flask.request.args.get('v') or response.cache_control.max_age == YEAR:
+                response.headers['Cache-Control'] = 'public, max-age=%i, immutable' % YEAR
+            return conditional(response)
+        revalidated = (method == 'GET' and path in REVALIDATED) or (method == 'POST' and path.endswith(CALLBACKS))
+        if not revalidated or response.status_code != 200 or response.is_streamed:
+            return response
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        response.headers['Cache-Control'] = 'no-cache'
+        return conditional(response)
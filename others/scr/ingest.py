@@ -0,0 +1,385 @@
+###########################################################
+# Incremental ingest of the raw files
+###########################################################
+"""Manifest of the raw files already read and their 1-minute totals.
+
+A manifest is a folder (``files: manifest`` in config.yml) with a
+``manifest.json`` and, for every source (gps, lgr, exo), the sums and counts
+of the values of each minute of the files read so far, one file per block
+of ``BLOCK`` minutes (a week, from the epoch)::
+
+    ingest/
+        manifest.json            <- for every source: its files (size,
+                                    mtime, sha1, first and last time) and
+                                    blocks (totals file, first and last
+                                    minute, columns)
+        lgr-20200604-000004.npz  <- minutes, columns, sums and counts of
+        ...                         the week from 2020-06-04
+
+A run parses only the files that are new or changed (size or mtime changed
+and a different sha1). The totals of a new file are added to the minutes it
+covers. For a changed or removed file, the minutes of its previous time
+span are dropped and read again from the files that cover them. The
+1-minute means (sums/counts) are then the same as resampling all the files.
+Only the blocks with new or dropped minutes are read and written again
+(``BlockTotals``, a few blocks in memory as the files come by date) and the
+means are read back block by block (``MinuteMeans``, as
+``stream.BinnedStream``, from the first minute that changed when the
+outputs are appended) to be joined and written as the streamed files, so
+the memory used does not grow with the history.
+
+The totals files are written under a new name before manifest.json is
+replaced, so an interrupted run leaves the previous manifest and totals.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .rawzip import open_raw, raw_stat
+from .stream import BLOCK
+
+MANIFEST_VERSION = 2
+MANIFEST_FILE = 'manifest.json'
+# generations of the totals files taken one at a time (sources updated in threads)
+GENERATION_LOCK = threading.Lock()
+
+
+def read_manifest(folder):
+    """Manifest of a folder, empty if there is none (or of another version)."""
+    filename = os.path.join(folder, MANIFEST_FILE)
+    if os.path.exists(filename):
+        with open(filename, 'r') as file:
+            manifest = json.load(file)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        logging.warning('Manifest %s of version %s ignored', filename, manifest.get('version'))
+    return {'version': MANIFEST_VERSION, 'generation': 0, 'sources': {}}
+
+
+def write_manifest(manifest, folder):
+    """Replace manifest.json and remove the totals it does not use anymore."""
+    tmpfile = os.path.join(folder, MANIFEST_FILE + '.tmp')
+    with open(tmpfile, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmpfile, os.path.join(folder, MANIFEST_FILE))
+    used = {entry['file'] for source in manifest['sources'].values() for entry in source['blocks'].values()}
+    for filename in os.listdir(folder):
+        if filename.endswith('.npz') and filename not in used:
+            os.remove(os.path.join(folder, filename))
+
+
+def file_hash(path, bufsize=1 << 20):
+    # sha1 of the content of a raw file (or member of an archive)
+    digest = hashlib.sha1()
+    with open_raw(path) as file:
+        for block in iter(lambda: file.read(bufsize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_files(files, known):
+    """Files that are new, changed or unchanged since the manifest.# {{{
+
+    Parameters
+    ----------
+    files : paths of the raw files of a source
+    known : entries of the manifest for the source (path -> entry)
+
+    Returns
+    -------
+    entries: path -> entry (size, mtime, sha1, start, end) of the files, the
+        time span of new and changed files is filled once they are parsed
+    new, changed: paths to parse
+    removed: entries of the known files that are not in files
+
+    """# }}}
+    entries, new, changed = {}, [], []
+    for path in files:
+        size, mtime = raw_stat(path)
+        entry = {'size': size, 'mtime': mtime}
+        old = known.get(path)
+        if old is not None and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+            entries[path] = old
+            continue
+        entry['sha1'] = file_hash(path)
+        if old is not None and old['sha1'] == entry['sha1']:
+            # touched, same content
+            entries[path] = dict(old, mtime=entry['mtime'])
+            continue
+        entry['start'] = entry['end'] = None
+        entries[path] = entry
+        (new if old is None else changed).append(path)
+    removed = [entry for path, entry in known.items() if path not in entries]
+    return entries, new, changed, removed
+
+
+def minute_totals(data):
+    # sums and counts (values that are not NaN) of every column per minute
+    if data.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    groups = data.groupby(data.index.floor('T'))
+    return groups.sum(), groups.count().astype(float)
+
+
+def combine_totals(parts):
+    # (sums, counts) of a list of (sums, counts), joined once and summed per
+    # minute (sorted), the columns in the order they come
+    parts = [(sums, counts) for sums, counts in parts if not sums.empty]
+    if not parts:
+        return pd.DataFrame(), pd.DataFrame()
+    if len(parts) == 1:
+        return parts[0]
+    sums = pd.concat([sums for sums, _ in parts]).groupby(level=0).sum()
+    counts = pd.concat([counts for _, counts in parts]).groupby(level=0).sum()
+    return sums, counts
+
+
+def load_totals(folder, filename):
+    # (sums, counts) saved by save_totals, None when the file is missing
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as npz:
+        index = pd.DatetimeIndex(npz['minutes'].view('datetime64[ns]'), name='Datetime')
+        columns = list(npz['columns'])
+        return (pd.DataFrame(npz['sums'], index=index, columns=columns),
+                pd.DataFrame(npz['counts'], index=index, columns=columns))
+
+
+def save_totals(totals, folder, filename):
+    sums, counts = totals
+    with open(os.path.join(folder, filename), 'wb') as file:
+        np.savez(file, minutes=sums.index.values.astype('datetime64[ns]').view('<i8'),
+                 columns=np.array(sums.columns, dtype=str), sums=sums.values.astype('<f8'),
+                 counts=counts.values.astype('<f8'))
+
+
+def block_start(minute):
+    # first minute of the block of BLOCK minutes (from the epoch) of a minute
+    span = BLOCK*60*10**9
+    return pd.Timestamp(pd.Timestamp(minute).value//span*span)
+
+
+def block_key(minute):
+    # name of the block of a minute in the manifest and in its totals files
+    return block_start(minute).strftime('%Y%m%d')
+
+
+def split_blocks(index):
+    # (block key, rows) of a sorted index of minutes, block by block
+    span = BLOCK*60*10**9
+    starts = index.values.view('i8')//span*span
+    blocks, firsts = np.unique(starts, return_index=True)
+    for i, start in enumerate(blocks):
+        end = firsts[i + 1] if i + 1 < len(firsts) else len(index)
+        yield pd.Timestamp(start).strftime('%Y%m%d'), slice(firsts[i], end)
+
+
+class BlockTotals:
+    """Totals of a source added file by file, written one block at a time.# {{{
+
+    The totals of a block are kept until a file starting after the block is
+    added (the files come by date), then added to the saved totals of the
+    block without the dropped minutes and written to a new file. A block
+    written and added to again in the same run is read back from its new
+    file, so the files may come in any order.
+
+    Parameters
+    ----------
+    folder : folder of the manifest
+    name : source ('gps', 'lgr', 'exo')
+    generation : generation of the totals files written
+    blocks : block key -> entry (file, start, end, columns) of the manifest
+    dirty : spans (first, last minute) whose saved totals are dropped, their
+        blocks are written again even without new rows
+
+    """# }}}
+
+    def __init__(self, folder, name, generation, blocks, dirty):
+        self.folder = folder
+        self.name = name
+        self.generation = generation
+        self.saved = blocks
+        self.blocks = dict(blocks)
+        self.dirty = dirty
+        self.pending = {key: [] for key, entry in blocks.items() if overlaps(entry_span(entry), dirty)}
+
+    def add(self, totals, before=None):
+        """Add the totals of a file, write the blocks ending before the minute before."""
+        sums, counts = totals
+        if not sums.empty:
+            for key, rows in split_blocks(sums.index):
+                self.pending.setdefault(key, []).append((sums.iloc[rows], counts.iloc[rows]))
+        if before is not None:
+            for key in sorted(self.pending):
+                if pd.Timestamp(key) + BLOCK*pd.Timedelta('1T') <= before:
+                    self.write(key)
+
+    def write(self, key):
+        # saved totals of a block (without the dropped minutes) and the ones
+        # added, in a new file
+        parts = self.pending.pop(key)
+        entry = self.blocks.get(key)
+        if entry is not None:
+            sums, counts = load_totals(self.folder, entry['file'])
+            if entry is self.saved.get(key):
+                keep = ~span_mask(sums.index, self.dirty)
+                sums, counts = sums[keep], counts[keep]
+            parts = [(sums, counts)] + parts
+        sums, counts = combine_totals(parts)
+        if sums.empty:
+            self.blocks.pop(key, None)
+            return
+        if not sums.index.is_monotonic_increasing:
+            sums, counts = sums.sort_index(), counts.sort_index()
+        filename = '%s-%s-%06d.npz' % (self.name, key, self.generation)
+        save_totals((sums, counts), self.folder, filename)
+        self.blocks[key] = {'file': filename, 'start': str(sums.index[0]), 'end': str(sums.index[-1]),
+                            'columns': list(sums.columns)}
+
+    def close(self):
+        """Write the blocks left, return the entries of all the blocks."""
+        for key in sorted(self.pending):
+            self.write(key)
+        return self.blocks
+
+
+class MinuteMeans:
+    """1-minute means of the totals of a source, every minute from the first to the last.# {{{
+
+    The totals files are read one block at a time and the means given out
+    block by block, as by stream.BinnedStream, so they can be joined and
+    written without the totals or the means of the whole history in memory.
+
+    Parameters
+    ----------
+    folder : folder of the manifest
+    blocks : block key -> entry (file, start, end, columns) of a source
+    since : first minute given (None: the first one of the totals), the
+        blocks before it are not read
+
+    """# }}}
+
+    def __init__(self, folder, blocks, since=None):
+        self.folder = folder
+        self.blocks = blocks
+        self.since = since
+        columns = []
+        for key in sorted(blocks):
+            columns.extend(col for col in blocks[key]['columns'] if col not in columns)
+        self.columns = columns or None
+
+    @property
+    def end(self):
+        # last minute of the totals, None without totals
+        return max((pd.Timestamp(entry['end']) for entry in self.blocks.values()), default=None)
+
+    def starting(self, since):
+        """Means of the same totals from the minute since on."""
+        return MinuteMeans(self.folder, self.blocks, since)
+
+    def __iter__(self):
+        if not self.blocks:
+            return
+        start = min(pd.Timestamp(entry['start']) for entry in self.blocks.values())
+        if self.since is not None:
+            start = max(start, self.since)
+        end = self.end
+        while start <= end:
+            last = min(end, block_start(start) + (BLOCK - 1)*pd.Timedelta('1T'))
+            minutes = pd.date_range(start, last, freq='T', name='Datetime')
+            entry = self.blocks.get(block_key(start))
+            if entry is None:
+                yield pd.DataFrame(index=minutes, columns=self.columns, dtype=float)
+            else:
+                sums, counts = load_totals(self.folder, entry['file'])
+                yield (sums.where(counts > 0)/counts.where(counts > 0)).reindex(index=minutes, columns=self.columns)
+            start = last + pd.Timedelta('1T')
+
+
+def span_mask(index, spans):
+    # minutes of index in any of the spans (first, last minute)
+    mask = np.zeros(len(index), dtype=bool)
+    for start, end in spans:
+        mask |= (index >= start) & (index <= end)
+    return mask
+
+
+def overlaps(span, spans):
+    # span (first, last minute) shares a minute with any of the spans
+    return span is not None and any(span[0] <= end and span[1] >= start for start, end in spans)
+
+
+def entry_span(entry):
+    # minutes of the first and last rows of a file, None for a file without rows
+    if entry.get('start') is None:
+        return None
+    return pd.Timestamp(entry['start']).floor('T'), pd.Timestamp(entry['end']).floor('T')
+
+
+def update_source(name, files, parse, folder, manifest, parse_files):
+    """1-minute means of a source, parsing only its new and changed files.# {{{
+
+    Parameters
+    ----------
+    name : source in the manifest ('gps', 'lgr', 'exo')
+    files : paths of the raw files of the source
+    parse : function path -> rows of the file (Datetime index, float columns)
+    folder : folder of the manifest
+    manifest : output of read_manifest, updated for the source
+    parse_files : function (parse, paths) -> rows of every path, one after
+        the other (stream.parse_stream)
+
+    Returns
+    -------
+    data: 1-minute means of all the files (MinuteMeans)
+    first: first minute that changed since the manifest (None: no change)
+
+    """# }}}
+    source = manifest['sources'].get(name, {})
+    blocks = source.get('blocks', {})
+    if all(os.path.exists(os.path.join(folder, entry['file'])) for entry in blocks.values()):
+        known = source.get('files', {})
+    else:
+        logging.warning('Totals of %s missing, all its files are read again', name)
+        known, blocks = {}, {}
+    entries, new, changed, removed = scan_files(files, known)
+    # minutes whose totals are read again from all the files covering them
+    dirty = [span for span in map(entry_span, [known[path] for path in changed] + removed) if span is not None]
+    if not new and not changed and not removed:
+        logging.info('No new %s files (%i files)', name, len(files))
+        return MinuteMeans(folder, blocks), None
+    logging.info('%s files: %i new, %i changed, %i removed, %i unchanged', name, len(new), len(changed),
+                 len(removed), len(files) - len(new) - len(changed))
+    # files parsed in the order of files (by date), so the blocks are written
+    # as the files go past them
+    paths = [path for path in files if path in new or path in changed or overlaps(entry_span(entries[path]), dirty)]
+    with GENERATION_LOCK:
+        manifest['generation'] += 1
+        generation = manifest['generation']
+    end = MinuteMeans(folder, blocks).end
+    totals = BlockTotals(folder, name, generation, blocks, dirty)
+    first = [start for start, _ in dirty]
+    for path, data in zip(paths, parse_files(parse, paths)):
+        if path not in new and path not in changed:
+            # rows of the dropped minutes only, the others are in the totals
+            data = data[span_mask(data.index.floor('T'), dirty)]
+        else:
+            entries[path]['start'] = str(data.index.min()) if len(data) else None
+            entries[path]['end'] = str(data.index.max()) if len(data) else None
+            if len(data):
+                first.append(data.index.min().floor('T'))
+        # the minute totals of every file (not its rows) are added to its blocks
+        totals.add(minute_totals(data), data.index.min().floor('T') if len(data) else None)
+    blocks = totals.close()
+    if end is not None and (MinuteMeans(folder, blocks).end or end) > end:
+        # the minutes between the last one before and the new rows are new too
+        first.append(end + pd.Timedelta('1T'))
+    manifest['sources'][name] = {'blocks': blocks, 'files': entries}
+    return MinuteMeans(folder, blocks), min(first) if first else None
@@ -0,0 +1,156 @@
+###########################################################
+# Callback metrics
+###########################################################
+"""Prometheus metrics of the dashboard callbacks.
+
+``instrument`` wraps a Dash callback (calls by outcome, time in the
+function), ``timed`` wraps the functions called by the callbacks (time per
+stage, stages can be nested, ``in_callback`` for the functions run in a
+thread pool) and ``init_app`` adds, for every callback
+request, the total time, the time spent serialising the response to JSON
+(total minus callback) and the size of the response. The metrics are served
+in the Prometheus text format on ``/metrics``.
+
+With gunicorn, set ``PROMETHEUS_MULTIPROC_DIR`` (``prometheus_multiproc_dir``
+for older clients) to an empty folder so ``/metrics`` adds up all the
+workers.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+
+import flask
+from dash.exceptions import PreventUpdate
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+SECONDS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+BYTES = (1e3, 3e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+
+CALLS = Counter('articplots_callback_calls_total', 'Callback calls by outcome',
+                ['callback', 'outcome'])
+CALLBACK_SECONDS = Histogram('articplots_callback_seconds', 'Time in the callback function',
+                             ['callback'], buckets=SECONDS)
+STAGE_SECONDS = Histogram('articplots_stage_seconds', 'Time per stage of the callbacks',
+                          ['callback', 'stage'], buckets=SECONDS)
+REQUEST_SECONDS = Histogram('articplots_request_seconds', 'Time of the callback requests',
+                            ['callback'], buckets=SECONDS)
+RESPONSE_BYTES = Histogram('articplots_response_bytes', 'Size of the callback responses',
+                           ['callback'], buckets=BYTES)
+
+_local = threading.local()
+
+
+def multiproc_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def set_outcome(outcome):
+    """Outcome counted for the running callback instead of 'ok' (e.g. 'cache_hit')."""
+    _local.outcome = outcome
+
+
+def instrument(name):
+    """Decorator counting and timing a Dash callback."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _local.callback = name
+            _local.outcome = 'ok'
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except PreventUpdate:
+                _local.outcome = 'prevented'
+                raise
+            except Exception:
+                _local.outcome = 'error'
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                CALLBACK_SECONDS.labels(name).observe(seconds)
+                CALLS.labels(name, _local.outcome).inc()
+                _local.callback = None
+                if flask.has_request_context():
+                    flask.g.callback = name
+                    flask.g.callback_seconds = seconds
+        return wrapper
+    return decorator
+
+
+def timed(stage):
+    """Decorator timing a function as a stage of the running callback."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            callback = getattr(_local, 'callback', None)
+            if callback is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.labels(callback, stage).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def in_callback(func):
+    """func timing its stages for the running callback from another thread (pools)."""
+    callback = getattr(_local, 'callback', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.callback = callback
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.callback = None
+    return wrapper
+
+
+def init_app(server, slow=None):
+    """Time the callback requests of a Flask server and add /metrics.# {{{
+
+    Parameters
+    ----------
+    server : Flask server of the Dash app
+    slow : seconds, longer callback requests are logged with their inputs
+        (None: no log)
+
+    """# }}}
+    @server.before_request
+    def start_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @server.after_request
+    def observe_request(response):
+        if not flask.request.path.endswith('/_dash-update-component'):
+            return response
+        seconds = time.perf_counter() - flask.g.get('request_start', time.perf_counter())
+        callback = flask.g.get('callback', 'unknown')
+        REQUEST_SECONDS.labels(callback).observe(seconds)
+        if 'callback_seconds' in flask.g:
+            STAGE_SECONDS.labels(callback, 'serialize').observe(max(seconds - flask.g.callback_seconds, 0))
+        size = response.calculate_content_length()
+        if size is not None:
+            RESPONSE_BYTES.labels(callback).observe(size)
+        if slow is not None and seconds >= slow:
+            body = flask.request.get_json(silent=True) or {}
+            changed = body.get('changedPropIds', [])
+            inputs = {'%s.%s' % (i.get('id'), i.get('property')): i.get('value') for i in body.get('inputs', [])
+                      if isinstance(i, dict)}
+            logging.warning('Slow callback %s: %.3f s (callback %.3f s, %s bytes), triggered by %s, inputs %.500s',
+                            callback, seconds, flask.g.get('callback_seconds', float('nan')), size, changed, inputs)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        registry = REGISTRY
+        if multiproc_dir():
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return flask.Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
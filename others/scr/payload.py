@@ -0,0 +1,62 @@
+###########################################################
+# Compact figure payloads
+###########################################################
+"""Base64 typed arrays for the figures sent to the browser.
+
+Arrays are written as ``{'dtype': 'f8', 'bdata': '...'}`` (the same layout
+plotly uses for typed arrays, with ``shape: 'rows, columns'`` for 2-d
+arrays) and decoded in the browser by ``assets/articplots.js`` before the
+figure is drawn. Timestamps are sent as int64 milliseconds since epoch; with
+``format: 'date'`` the browser turns them into date labels.
+"""
+
+import base64
+
+import numpy as np
+
+
+def b64array(values, dtype):
+    """Typed array of values as a base64 dictionary (rows of a 2-d array)."""
+    values = np.ascontiguousarray(values, dtype='<' + dtype)
+    encoded = {'dtype': values.dtype.str[1:], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+    if values.ndim == 2:
+        encoded['shape'] = '%i, %i' % values.shape
+    return encoded
+
+
+def date_array(values, labels=False):
+    """Datetimes as int64 milliseconds since epoch (date labels if labels)."""
+    millis = np.asarray(values).astype('datetime64[ms]').astype('int64')
+    encoded = b64array(millis, 'i8')
+    if labels:
+        encoded['format'] = 'date'
+    return encoded
+
+
+def set_path(obj, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        obj = obj.setdefault(key, {})
+    obj[keys[-1]] = value
+
+
+def compact_figure(fig, arrays):
+    """Figure as a dictionary with some properties replaced.# {{{
+
+    Parameters
+    ----------
+    fig : plotly figure
+    arrays : {trace index: {'marker.color': b64array(...), ...}}, a value
+        {'ref': 'marker.color'} makes the browser reuse another array of the
+        same trace
+
+    Returns
+    -------
+    fig: dictionary ready to be sent by a callback
+
+    """# }}}
+    fig = fig.to_plotly_json()
+    for i, props in arrays.items():
+        for path, value in props.items():
+            set_path(fig['data'][i], path, value)
+    return fig
@@ -0,0 +1,232 @@
+###########################################################
+# Multi-resolution time pyramid
+###########################################################
+"""Precomputed resamplings of the merged data, from 1 minute to 1 day.
+
+Every level is a dictionary column name -> read-only numpy array, sorted by
+Datetime (datetime64[ns]). The dashboard picks, for every requested date
+range, the finest level that keeps the number of plotted points under a
+budget, and works on views of that level between two row positions, so a
+callback never copies the dataset.
+
+A pyramid can be saved as one data store per level (see datastore.py) and
+mapped back read-only, so the processes using it share the same pages.
+
+Rows appended to the data change only the last bin of every level and add
+bins after it: extend_pyramid and extend_saved_pyramid resample only these
+bins instead of the whole data. The other bins are copied to new arrays (or
+to a new folder for a saved pyramid, swapped in once written), so the levels
+of a pyramid are never written after they are made and a callback still
+working on an older pyramid sees it as it was.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .datastore import open_store, replace_folder, write_store, write_tail
+
+LEVELS = ['1T', '10T', '60T', '360T', '1D']
+PYRAMID_FILE = 'pyramid.json'
+
+
+def freeze(frame):
+    """Read-only column arrays of a dataframe with a Datetime column."""
+    level = {}
+    for col in frame.columns:
+        values = np.asarray(frame[col].values)
+        if col == 'Datetime':
+            values = values.astype('datetime64[ns]')
+        values.setflags(write=False)
+        level[col] = values
+    return level
+
+
+def build_pyramid(data, levels=LEVELS):
+    """Resample the data once per level.# {{{
+
+    Parameters
+    ----------
+    data : dataframe with a Datetime column (1-minute data)
+    levels : resample rules from finest to coarsest
+
+    Returns
+    -------
+    pyramid: list of (rule, level) finest first, level is a dictionary of
+        read-only arrays (see freeze)
+
+    """# }}}
+    data = data.set_index('Datetime').sort_index()
+    pyramid = []
+    for rule in levels:
+        level = data.resample(rule).mean()
+        pyramid.append((rule, freeze(level.reset_index())))
+    return pyramid
+
+
+def extend_pyramid(pyramid, columns):
+    """Pyramid of the data extended with rows appended after it was built.# {{{
+
+    Only the last bin of every level and the new rows are resampled, the
+    other bins are copied from the old levels, which are left untouched.
+
+    Parameters
+    ----------
+    pyramid : output of build_pyramid
+    columns : dictionary column name -> array of all the rows of the data
+        (old and new, sorted by Datetime), e.g. datastore.open_store
+
+    Returns
+    -------
+    pyramid: new list of (rule, level)
+
+    """# }}}
+    times = np.asarray(columns['Datetime']).view('datetime64[ns]')
+    extended = []
+    for rule, level in pyramid:
+        keep, tail = tail_bins(level, times, columns, rule)
+        extended.append((rule, {col: extend_column(values, keep, tail[col].values) for col, values in level.items()}))
+    return extended
+
+
+def extend_saved_pyramid(path, columns, source=None):
+    """Extend a pyramid saved by save_pyramid with rows appended to its data.# {{{
+
+    As in extend_pyramid, only the last bin of every level and the new rows
+    are resampled. The saved pyramid is copied to a new folder, the bins are
+    written there over the last row of the level stores and after it
+    (datastore.write_tail) and the folder replaces path once every level and
+    the source are written: the processes mapping the levels keep the files
+    they mapped, unchanged.
+
+    Parameters
+    ----------
+    path : folder of the saved pyramid
+    columns : dictionary column name -> array of all the rows of the data
+        (old and new, sorted by Datetime), e.g. datastore.open_store
+    source : new source of the pyramid (see save_pyramid)
+
+    """# }}}
+    with open(os.path.join(path, PYRAMID_FILE), 'r') as file:
+        saved = json.load(file)
+    tmppath = path + '.tmp'
+    if os.path.exists(tmppath):
+        shutil.rmtree(tmppath)
+    shutil.copytree(path, tmppath)
+    times = np.asarray(columns['Datetime']).view('datetime64[ns]')
+    for rule in saved['levels']:
+        keep, tail = tail_bins(open_store(os.path.join(tmppath, rule)), times, columns, rule)
+        write_tail(tail, os.path.join(tmppath, rule), keep)
+    saved['source'] = source
+    with open(os.path.join(tmppath, PYRAMID_FILE), 'w') as file:
+        json.dump(saved, file, indent=1)
+    replace_folder(tmppath, path)
+
+
+def tail_bins(level, times, columns, rule):
+    # first row of a level that can change (its last bin) and the bins of the
+    # rows of the data from there
+    keep = max(nrows(level) - 1, 0)
+    start = np.asarray(level['Datetime'])[keep:keep + 1].view('datetime64[ns]')
+    i = np.searchsorted(times, start[0], side='left') if len(start) else 0
+    tail = pd.DataFrame({col: times[i:] if col == 'Datetime' else np.asarray(values[i:])
+                         for col, values in columns.items()})
+    return keep, tail.set_index('Datetime').resample(rule).mean().reset_index()
+
+
+def extend_column(values, keep, tail):
+    # read-only new array of values[:keep] followed by tail, values (the last
+    # bin from keep) is not written
+    extended = np.empty(keep + len(tail), dtype=values.dtype)
+    extended[:keep] = values[:keep]
+    extended[keep:] = tail
+    extended.setflags(write=False)
+    return extended
+
+
+def save_pyramid(pyramid, path, source=None):
+    """Write every level as a data store in path (replaced if it exists).# {{{
+
+    Parameters
+    ----------
+    pyramid : output of build_pyramid
+    path : folder of the saved pyramid
+    source : JSON description of the data it was built from (e.g. number of
+        rows of the store), returned by pyramid_source
+
+    """# }}}
+    tmppath = path + '.tmp'
+    if os.path.exists(tmppath):
+        shutil.rmtree(tmppath)
+    os.makedirs(tmppath)
+    for rule, level in pyramid:
+        write_store(pd.DataFrame(level), os.path.join(tmppath, rule))
+    with open(os.path.join(tmppath, PYRAMID_FILE), 'w') as file:
+        json.dump({'levels': [rule for rule, _ in pyramid], 'source': source}, file, indent=1)
+    replace_folder(tmppath, path)
+
+
+def pyramid_source(path):
+    """Source saved with the pyramid in path, None when there is none."""
+    try:
+        with open(os.path.join(path, PYRAMID_FILE), 'r') as file:
+            return json.load(file)['source']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_pyramid(path):
+    """Pyramid saved by save_pyramid, levels are read-only memory maps."""
+    with open(os.path.join(path, PYRAMID_FILE), 'r') as file:
+        rules = json.load(file)['levels']
+    pyramid = []
+    for rule in rules:
+        level = open_store(os.path.join(path, rule))
+        level['Datetime'] = level['Datetime'].view('datetime64[ns]')
+        for values in level.values():
+            values.setflags(write=False)
+        pyramid.append((rule, level))
+    return pyramid
+
+
+def nrows(level):
+    return len(level['Datetime'])
+
+
+def window_bounds(level, mindate=None, maxdate=None):
+    """Positions [i0, i1) of the rows with mindate <= Datetime <= maxdate."""
+    times = level['Datetime']
+    i0 = 0 if mindate is None else np.searchsorted(times, np.datetime64(mindate), side='left')
+    i1 = len(times) if maxdate is None else np.searchsorted(times, np.datetime64(maxdate), side='right')
+    return int(i0), int(max(i0, i1))
+
+
+def window(level, i0, i1):
+    """Views of every column of a level between rows i0 and i1."""
+    return {col: values[i0:i1] for col, values in level.items()}
+
+
+def select_level(pyramid, mindate=None, maxdate=None, budget=5000):
+    """Finest level with at most budget rows between mindate and maxdate.# {{{
+
+    Parameters
+    ----------
+    pyramid : output of build_pyramid
+    mindate, maxdate : datetimes limiting the range (None for no limit)
+    budget : maximum number of points per figure
+
+    Returns
+    -------
+    rule: resample rule of the selected level
+    level: the selected level (the coarsest one if none fits)
+    i0, i1: rows of the level inside the range
+
+    """# }}}
+    for rule, level in pyramid:
+        i0, i1 = window_bounds(level, mindate, maxdate)
+        if i1 - i0 <= budget:
+            break
+    return rule, level, i0, i1
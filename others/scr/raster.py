@@ -0,0 +1,170 @@
+###########################################################
+# Raster aggregation of the map
+###########################################################
+"""Points of the map binned into an image for wide zoom levels.
+
+The visible extent is cut into a grid of screen cells, evenly spaced in
+longitude and in web mercator y (so the image is not distorted once mapbox
+stretches it between its corners). Every cell holds the mean, minimum,
+maximum and count of the values of its points; the means are coloured with a
+plotly colorscale and written as a PNG (zlib only, no imaging library). The
+size of the result depends on the size of the screen, not on the number of
+points.
+"""
+
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+from .spatial import mercator
+
+# size in pixels of the map assumed when the browser does not send its extent
+VIEWPORT = (1600, 900)
+# points binned at once by bin_points
+BIN_CHUNK = 65536
+
+
+def inverse_mercator(y):
+    """Latitudes of web mercator y."""
+    return np.degrees(2*np.arctan(np.exp(y)) - np.pi/2)
+
+
+def view_extent(center, zoom, viewport=VIEWPORT):
+    """Extent (lon0, lon1, y0, y1) shown by mapbox around center at zoom."""
+    world = 512*2**zoom
+    halfx = viewport[0]*180/world
+    halfy = viewport[1]*np.pi/world
+    y = float(mercator(center['lat']))
+    return center['lon'] - halfx, center['lon'] + halfx, y - halfy, y + halfy
+
+
+def corners_extent(coordinates):
+    """Extent (lon0, lon1, y0, y1) of the corners [[lon, lat], ...] of a map."""
+    coordinates = np.asarray(coordinates, dtype=float)
+    y = mercator(coordinates[:, 1])
+    return coordinates[:, 0].min(), coordinates[:, 0].max(), y.min(), y.max()
+
+
+def bin_points(lat, lon, values, extent, shape, chunk=BIN_CHUNK):
+    """Statistics of the values in each cell of a grid over extent.# {{{
+
+    Parameters
+    ----------
+    lat, lon, values : arrays of the points (NaN values are skipped)
+    extent : (lon0, lon1, y0, y1), y in web mercator
+    shape : (rows, columns) of the grid, row 0 is the north
+    chunk : points binned at once, the memory used does not grow with the
+        number of points
+
+    Returns
+    -------
+    grid: dictionary mean, min, max (NaN in empty cells) and count arrays of
+        the given shape
+
+    """# }}}
+    size = shape[0]*shape[1]
+    count = np.zeros(size, dtype='int64')
+    total = np.zeros(size)
+    mins = np.full(size, np.nan)
+    maxs = np.full(size, np.nan)
+    for start in range(0, len(lat), chunk):
+        cell, cvalues = cell_values(lat[start:start + chunk], lon[start:start + chunk],
+                                    values[start:start + chunk], extent, shape)
+        count += np.bincount(cell, minlength=size)
+        total += np.bincount(cell, weights=cvalues, minlength=size)
+        if not len(cell):
+            continue
+        # min and max over the runs of equal cells of the sorted points
+        order = np.argsort(cell)
+        cell = cell[order]
+        cvalues = cvalues[order]
+        starts = np.flatnonzero(np.diff(cell, prepend=-1))
+        cells = cell[starts]
+        mins[cells] = np.fmin(mins[cells], np.minimum.reduceat(cvalues, starts))
+        maxs[cells] = np.fmax(maxs[cells], np.maximum.reduceat(cvalues, starts))
+    grid = {'count': count.reshape(shape), 'min': mins.reshape(shape), 'max': maxs.reshape(shape)}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid['mean'] = (total/count).reshape(shape)
+    return grid
+
+
+def cell_values(lat, lon, values, extent, shape):
+    # cells (row*columns + column) and values of the points inside extent
+    lon0, lon1, y0, y1 = extent
+    nrows, ncols = shape
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(lat) & ~np.isnan(lon) & ~np.isnan(values)
+    y = mercator(lat[valid])
+    col = np.floor((lon[valid] - lon0)/(lon1 - lon0)*ncols).astype('int64')
+    row = np.floor((y1 - y)/(y1 - y0)*nrows).astype('int64')
+    inside = (col >= 0) & (col < ncols) & (row >= 0) & (row < nrows)
+    return row[inside]*ncols + col[inside], values[valid][inside]
+
+
+def parse_color(color):
+    """(r, g, b) of 'rgb(r, g, b)' or '#rrggbb'."""
+    color = color.strip()
+    if color.startswith('#'):
+        return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return tuple(int(float(v)) for v in color[color.index('(') + 1:color.index(')')].split(',')[:3])
+
+
+def colorize(values, colorscale, vmin, vmax, reverse=False):
+    """RGBA image of a 2d array with a list of colours, NaN transparent."""
+    colors = np.array([parse_color(c) for c in colorscale], dtype=float)
+    if reverse:
+        colors = colors[::-1]
+    span = vmax - vmin if vmax > vmin else 1.
+    with np.errstate(invalid='ignore'):
+        scaled = np.clip((values - vmin)/span, 0, 1)*(len(colors) - 1)
+    empty = np.isnan(values)
+    scaled[empty] = 0
+    i = np.minimum(np.floor(scaled).astype('int64'), len(colors) - 2)
+    frac = (scaled - i)[..., None]
+    rgba = np.empty(values.shape + (4,), dtype='uint8')
+    rgba[..., :3] = np.round(colors[i]*(1 - frac) + colors[i + 1]*frac)
+    rgba[..., 3] = np.where(empty, 0, 255)
+    return rgba
+
+
+def encode_png(rgba):
+    """PNG file (bytes) of an RGBA uint8 image."""
+    height, width = rgba.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # filter type 0 (none) at the start of every row
+    raw = np.zeros((height, width*4 + 1), dtype='uint8')
+    raw[:, 1:] = rgba.reshape(height, width*4)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def image_layer(rgba, extent):
+    """Mapbox layer showing an image over extent (lon0, lon1, y0, y1)."""
+    lon0, lon1, y0, y1 = extent
+    lat0, lat1 = float(inverse_mercator(y0)), float(inverse_mercator(y1))
+    source = 'data:image/png;base64,' + base64.b64encode(encode_png(rgba)).decode('ascii')
+    return {
+        'sourcetype': 'image',
+        'source': source,
+        'coordinates': [[lon0, lat1], [lon1, lat1], [lon1, lat0], [lon0, lat0]],
+        'below': 'traces',
+    }
+
+
+def cell_centers(extent, shape):
+    """Latitude and longitude of the centre of every cell (2d arrays)."""
+    lon0, lon1, y0, y1 = extent
+    nrows, ncols = shape
+    lon = lon0 + (np.arange(ncols) + 0.5)*(lon1 - lon0)/ncols
+    y = y1 - (np.arange(nrows) + 0.5)*(y1 - y0)/nrows
+    lon, y = np.meshgrid(lon, y)
+    return inverse_mercator(y), lon
@@ -0,0 +1,121 @@
+###########################################################
+# Raw files inside zip archives
+###########################################################
+"""Raw files read from the unzipped folder or straight from the zip archives.
+
+The readers of read_data walk a tree of folders (date folder, GPS and YB
+folders, LGR date folders) and open its files by path. The tree is either:
+
+- ``FolderTree``: a folder on disk (paths: unzip, after uncompress_data)
+- ``ArchiveTree``: the zip archives of a folder (paths: zip) seen as the
+  folder they would be unzipped to, the files being members of the archives
+
+A member is named by the path of its archive, '!' and its name in the
+archive ('ZIPDATA/20200609.zip!20200609/GPS/track.gpx'), a string that can
+be sent to a process pool. ``open_raw`` reads a member into memory (the LGR
+files are zips inside the archives and are opened from there) and
+``raw_stat`` gives its size and the mtime of its archive, so nothing is
+extracted to disk.
+"""
+
+import functools
+import io
+import os
+import zipfile as zf
+
+MEMBER_SEP = '!'
+
+
+def member_path(archive, name):
+    return archive + MEMBER_SEP + name
+
+
+def split_member(path):
+    # (archive, member name), member name None for a file on disk
+    archive, sep, name = path.partition(MEMBER_SEP)
+    if sep and zf.is_zipfile(archive):
+        return archive, name
+    return path, None
+
+
+@functools.lru_cache(maxsize=16)
+def archive_infos(archive, mtime, size):
+    # members of an archive by name (cached while the archive is the same)
+    with zf.ZipFile(archive) as zipf:
+        return {info.filename: info for info in zipf.infolist()}
+
+
+def raw_stat(path):
+    """Size and mtime (ns) of a raw file, the mtime of its archive for a member."""
+    archive, name = split_member(path)
+    stat = os.stat(archive)
+    if name is None:
+        return stat.st_size, stat.st_mtime_ns
+    return archive_infos(archive, stat.st_mtime_ns, stat.st_size)[name].file_size, stat.st_mtime_ns
+
+
+def open_raw(path):
+    """Binary file of a raw file, a member read into memory."""
+    archive, name = split_member(path)
+    if name is None:
+        return open(path, 'rb')
+    with zf.ZipFile(archive) as zipf:
+        return io.BytesIO(zipf.read(name))
+
+
+class FolderTree:
+    """Folders and files of a folder on disk ('/' separated relative paths)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def listdir(self, folder=''):
+        return os.listdir(self.path(folder))
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/')) if name else self.root
+
+
+class ArchiveTree:
+    """Folders and files of the zip archives of a folder, as if unzipped.# {{{
+
+    Parameters
+    ----------
+    path_zipdata : folder of the archives, read in the order of their names
+        (a file in two archives is taken from the last one, as extractall
+        would leave it)
+
+    """# }}}
+
+    def __init__(self, path_zipdata):
+        self.root = path_zipdata
+        self.folders = {'': set()}
+        self.files = {}
+        for archive in sorted(os.listdir(path_zipdata)):
+            archive = os.path.join(path_zipdata, archive)
+            if not zf.is_zipfile(archive):
+                continue
+            with zf.ZipFile(archive) as zipf:
+                names = zipf.namelist()
+            for name in names:
+                parts = name.rstrip('/').split('/')
+                for i in range(len(parts)):
+                    self.folders.setdefault('/'.join(parts[:i]), set()).add(parts[i])
+                if not name.endswith('/'):
+                    self.files[name] = member_path(archive, name)
+
+    def listdir(self, folder=''):
+        return list(self.folders.get(folder, ()))
+
+    def path(self, name):
+        return self.files.get(name, member_path(self.root, name))
+
+
+def raw_tree(source):
+    """Tree of source, a folder on disk or a tree already."""
+    return source if hasattr(source, 'listdir') else FolderTree(source)
+
+
+def join(*parts):
+    # relative path in a tree
+    return '/'.join(part for part in parts if part)
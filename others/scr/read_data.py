@@ -3,25 +3,51 @@
 ###########################################################
 
 
+import contextlib
+import io
 import logging
 import os
 import zipfile as zf
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
-import matplotlib.pyplot as plt
-
+import numpy as np
 import pandas as pd
 
+from .datastore import StoreAppender, StoreWriter, store_end, write_store
+from .ingest import read_manifest, update_source, write_manifest
+from .rawzip import ArchiveTree, join, open_raw, raw_tree
+from .stream import Bins, BinnedStream, CsvAppender, CsvWriter, StreamError, join_blocks, parse_stream
+
+# positions of the LGR columns read (Time, [H2O]_ppm, [CH4]d_ppm, [CO2]d_ppm,
+# GasP_torr, GasT_C, RD0_us, RD1_us) and their names
+LGR_USECOLS = [0, 3, 7, 9, 11, 13, 17, 19]
+LGR_NAMES = ['Datetime', 'H20_ppm', 'CH4d_ppm', 'CO2d_ppm', 'GasP_torr', 'GasT_C', 'RD0_us', 'RD1_us']
 
-def read_data(conffile):
+
+def read_data(conffile, jobs=1, full=False):
     """Main routine to read Mauritius data.# {{{
 
+    With a manifest folder in the configuration (files: manifest), only the
+    raw files that are new or changed since the last run are parsed (see
+    ingest.py) and the outputs are written block by block, only when the
+    data changed. With readzip the GPS and LGR files are read from the
+    archives of paths: zip (see rawzip.py) and nothing is unzipped. Without
+    a manifest the files are read, binned and written block by block
+    (stream.py, unless stream is False), in memory if they are not in time
+    order.
+
     Parameters
     ----------
     conffile: configuration file
+    jobs: processes parsing the raw files (1: one after the other in this
+        process, 0: one per CPU)
+    full: parse all the raw files again and rebuild the manifest
     Returns
     -------
-    Dictionary with data
+    10-minute data read from datafile with readprofile, otherwise the
+    summary of the csv written (stream.CsvWriter.close), None when no raw
+    file changed since the manifest
 
     """# }}}
 
@@ -33,48 +59,276 @@ def read_data(conffile):
         filename = os.path.join(conffile['paths']['filepath'], conffile['files']['datafile'])
         data = pd.read_csv(filename, parse_dates=[1])
     else:
-        zipfiles = os.listdir(path_zipdata)
-        unzipfiles = os.listdir(path_unzipdata)
-        unzipfiles = list(map(lambda x: x.capitalize(), unzipfiles))
-        # Check new files in zipfolder (not processed before)
-        newfiles = [newf for newf in zipfiles if newf[:-4].capitalize() not in unzipfiles]
-        if len(newfiles) > 0:
-            logging.info('Unzipping data in: %s', path_unzipdata)
-            uncompress_data(path_zipdata, path_unzipdata)
+        if conffile.get('readzip'):
+            logging.info('Reading data in the archives of: %s', path_zipdata)
+            path_unzipdata = ArchiveTree(path_zipdata)
         else:
-            now = datetime.now()
-            logging.info('There are not new data on: %s',
-                    now.strftime('%d-%m-%Y %H:%M'))
+            zipfiles = os.listdir(path_zipdata)
+            unzipfiles = os.listdir(path_unzipdata)
+            unzipfiles = list(map(lambda x: x.capitalize(), unzipfiles))
+            # Check new files in zipfolder (not processed before)
+            newfiles = [newf for newf in zipfiles if newf[:-4].capitalize() not in unzipfiles]
+            if len(newfiles) > 0:
+                logging.info('Unzipping data in: %s', path_unzipdata)
+                uncompress_data(path_zipdata, path_unzipdata)
+            else:
+                now = datetime.now()
+                logging.info('There are not new data on: %s',
+                        now.strftime('%d-%m-%Y %H:%M'))
+
+        # TODO: CHECK IF FILES EXIST!!
+        folder = conffile['files'].get('manifest')
+        data = None
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            manifest = read_manifest(folder)
+            if full:
+                manifest['sources'] = {}
+            data = ingest_data(path_unzipdata, path_exo2, folder, manifest, conffile['files'], jobs)
+            # after the outputs, so an interrupted run parses the files again
+            write_manifest(manifest, folder)
+        elif conffile.get('stream', True):
+            try:
+                data = stream_data(path_unzipdata, path_exo2, conffile['files'], jobs)
+            except StreamError as error:
+                logging.warning('Raw files read in memory: %s', error)
+        if data is None and not folder:
+            GPSdata, LGRdata, exodata = read_sources(path_unzipdata, path_exo2, jobs)
+            if GPSdata.empty and exodata.empty:
+                data = LGRdata
+            elif GPSdata.empty:
+                data = LGRdata.join([exodata])
+            elif exodata.empty:
+                data = LGRdata.join([GPSdata])
+            else:
+                data = LGRdata.join([GPSdata, exodata])
+            #import matplotlib.pyplot as plt
+            #for col in LGRdata.columns:
+            #    fig, ax = plt.subplots(1, 1, figsize=(5,3))
+            #    LGRdata[col].plot()
+            #    ax.set_ylabel(col)
+            #    ax.set_xlabel('')
+            #    plt.tight_layout()
+            #    fig.savefig(col + '.png', format='png', dpi=300)
+            #__import__('pdb').set_trace()
+            #data = GPSdata.join([LGRdata])
+            datastore = conffile['files'].get('datastore')
+            if datastore:
+                # 1-minute data for the dashboard (ArticChangeApp.py)
+                write_store(data, datastore)
+            csv = CsvWriter(conffile['files']['datafile'])
+            csv.write(data.resample('10T').mean())
+            data = csv.close()
+    return data
+
+
+def store_writer(path, columns, first=None):
+    # writer of the 1-minute blocks: appending the rows from first when the
+    # store ends before first, otherwise (or with new columns) writing it again
+    end = store_end(path)
+    if first is not None and end is not None and first > end:
+        try:
+            return StoreAppender(path, columns)
+        except ValueError:
+            logging.info('New columns in the data, store written again: %s', path)
+    return StoreWriter(path)
+
+
+def write_outputs(blocks, csv, store=None):# {{{
+    """Write 1-minute blocks to the store and their 10-minute means to the csv.
+
+    Parameters
+    ----------
+    blocks: 1-minute data, block by block in time order (from the start of a
+        10-minute bin)
+    csv: writer of the 10-minute csv (CsvWriter, CsvAppender)
+    store: writer of the 1-minute store (StoreWriter, StoreAppender) or None
+
+    Returns
+    -------
+    summary of the csv written (stream.CsvWriter.close)
+
+    """
+    tens = Bins('10T')
+    try:
+        for block in blocks:
+            if store is not None:
+                # 1-minute data for the dashboard (ArticChangeApp.py)
+                store.write(block)
+            for part in tens.add(block):
+                csv.write(part)
+        for part in tens.close():
+            csv.write(part)
+    except BaseException:
+        for writer in (store, csv):
+            if writer is not None:
+                writer.abort()
+        raise
+    if store is not None:
+        store.close()
+    return csv.close()# }}}
+
+
+def stream_data(path_unzipdata, path_exo2, files, jobs=1):# {{{
+    """1-minute data of the raw files, written block by block (see stream.py).
+
+    Parameters
+    ----------
+    path_unzipdata: folder of the unzipped data (GPS and LGR) or
+        rawzip.ArchiveTree of the archives
+    path_exo2: folder of the EXO workbooks
+    files: files of the configuration (datastore: 1-minute store, datafile:
+        10-minute csv), replaced once all the rows are written
+    jobs: processes parsing the files (1: one after the other in this
+        process, 0: one per CPU)
+
+    Returns
+    -------
+    summary of the csv written (stream.CsvWriter.close)
+
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count()
+    with ProcessPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        lgr, gps, exo = (BinnedStream(parse_stream(parse, listing, pool, 2*jobs)) for parse, listing in
+                         ((parse_lgr, lgr_files(path_unzipdata)), (parse_gpx, gps_files(path_unzipdata)),
+                          (parse_exo, exo_files(path_exo2))))
+        store = StoreWriter(files['datastore']) if files.get('datastore') else None
+        return write_outputs(join_blocks(lgr, [gps, exo]), CsvWriter(files['datafile']), store)# }}}
 
+
+def ingest_data(path_unzipdata, path_exo2, folder, manifest, files, jobs=1):# {{{
+    """1-minute data of the manifest, written block by block when it changed.
+
+    The 1-minute means of the sources (ingest.MinuteMeans) are joined and
+    written as in stream_data, reading the totals of the manifest one block
+    at a time. When the changes are after the last row of the store, the
+    store is appended and the csv cut and written again from the 10-minute
+    bin of the first change, so only the blocks from there are read.
+
+    Parameters
+    ----------
+    path_unzipdata: folder of the unzipped data (GPS and LGR) or
+        rawzip.ArchiveTree of the archives
+    path_exo2: folder of the EXO workbooks
+    folder: folder of the manifest and of the 1-minute totals
+    manifest: output of ingest.read_manifest, updated with the files read
+    files: files of the configuration (datastore: 1-minute store, datafile:
+        10-minute csv)
+    jobs: processes parsing the files (1: one after the other in this
+        process, 0: one per CPU)
+
+    Returns
+    -------
+    summary of the csv written (stream.CsvWriter.close), None when no raw
+    file changed and the outputs were kept
+
+    """
+    GPSdata, LGRdata, exodata, first = ingest_sources(path_unzipdata, path_exo2, folder, manifest, jobs)
+    datastore = files.get('datastore')
+    if first is None and os.path.exists(files['datafile']) and (not datastore or store_end(datastore) is not None):
+        logging.info('No change in the raw files, outputs kept: %s', files['datafile'])
+        return None
+    columns = [col for means in (LGRdata, GPSdata, exodata) for col in means.columns or []]
+    store = store_writer(datastore, columns, first) if datastore else None
+    csv = None
+    if first is not None and not isinstance(store, StoreWriter):
+        since = first.floor('10T')
+        try:
+            csv = CsvAppender(files['datafile'], since, columns)
+            LGRdata, GPSdata, exodata = (means.starting(since) for means in (LGRdata, GPSdata, exodata))
+        except ValueError as error:
+            logging.info('Csv written again: %s', error)
+    if csv is None:
+        csv = CsvWriter(files['datafile'])
+    return write_outputs(join_blocks(LGRdata, [GPSdata, exodata]), csv, store)# }}}
+
+
+def read_sources(path_unzipdata, path_exo2, jobs=1):# {{{
+    """GPS, LGR and EXO data of the raw files.
+
+    With jobs > 1 the three readers run at the same time and send their files
+    to one pool of jobs processes. Every reader joins the data of its files in
+    the order of its list of files, so the data is the same for any jobs.
+
+    Parameters
+    ----------
+    path_unzipdata: folder of the unzipped data (GPS and LGR) or
+        rawzip.ArchiveTree of the archives
+    path_exo2: folder of the EXO workbooks
+    jobs: processes parsing the files (1: one after the other in this
+        process, 0: one per CPU)
+
+    Returns
+    -------
+    GPSdata, LGRdata, exodata: dataframes resampled to 1 minute
+
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count()
+    if jobs == 1:
         logging.info('Reading GPS data')
         GPSdata = read_gps(path_unzipdata)
-
-        # TODO: CHECK IF FILES EXIST!!
         logging.info('Reading LGR data')
         LGRdata = read_lgr(path_unzipdata)
         logging.info('Reading EXO data')
         exodata = read_oldexo(path_unzipdata, path_exo2)
-        if GPSdata.empty and exodata.empty:
-            data = LGRdata
-        elif GPSdata.empty:
-            data = LGRdata.join([exodata])
-        elif exodata.empty:
-            data = LGRdata.join([GPSdata])
-        else:
-            data = LGRdata.join([GPSdata, exodata])
-        #for col in LGRdata.columns:
-        #    fig, ax = plt.subplots(1, 1, figsize=(5,3))
-        #    LGRdata[col].plot()
-        #    ax.set_ylabel(col)
-        #    ax.set_xlabel('')
-        #    plt.tight_layout()
-        #    fig.savefig(col + '.png', format='png', dpi=300)
-        #__import__('pdb').set_trace()
-        #data = GPSdata.join([LGRdata])
-        data = data.resample('10T').mean()
-        data = data.reset_index()
-        data.to_csv(conffile['files']['datafile'])
-    return data
+        return GPSdata, LGRdata, exodata
+    logging.info('Reading GPS, LGR and EXO data with %i processes', jobs)
+    with ProcessPoolExecutor(jobs) as pool, ThreadPoolExecutor(3) as readers:
+        GPSdata = readers.submit(read_gps, path_unzipdata, pool)
+        LGRdata = readers.submit(read_lgr, path_unzipdata, pool)
+        exodata = readers.submit(read_oldexo, path_unzipdata, path_exo2, pool)
+        return GPSdata.result(), LGRdata.result(), exodata.result()# }}}
+
+
+def ingest_sources(path_unzipdata, path_exo2, folder, manifest, jobs=1):# {{{
+    """GPS, LGR and EXO data, parsing only the files not in the manifest.
+
+    With jobs > 1 the three sources are updated at the same time and send
+    their files to one pool of jobs processes, as in read_sources.
+
+    Parameters
+    ----------
+    path_unzipdata: folder of the unzipped data (GPS and LGR) or
+        rawzip.ArchiveTree of the archives
+    path_exo2: folder of the EXO workbooks
+    folder: folder of the manifest and of the 1-minute totals
+    manifest: output of ingest.read_manifest, updated with the files read
+    jobs: processes parsing the files (1: one after the other in this
+        process, 0: one per CPU)
+
+    Returns
+    -------
+    GPSdata, LGRdata, exodata: 1-minute means (ingest.MinuteMeans, block by
+        block)
+    first: first minute that changed since the manifest (None: no change)
+
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count()
+    sources = (('gps', gps_files(path_unzipdata), parse_gpx),
+               ('lgr', lgr_files(path_unzipdata), parse_lgr),
+               ('exo', exo_files(path_exo2), parse_exo))
+    if jobs == 1:
+        results = [update_source(name, files, parse, folder, manifest, parse_stream)
+                   for name, files, parse in sources]
+    else:
+        logging.info('Reading GPS, LGR and EXO data with %i processes', jobs)
+        with ProcessPoolExecutor(jobs) as pool, ThreadPoolExecutor(3) as readers:
+            results = [readers.submit(update_source, name, files, parse, folder, manifest,
+                                      lambda parse, files: parse_stream(parse, files, pool, 2*jobs))
+                       for name, files, parse in sources]
+            results = [result.result() for result in results]
+    changes = [first for _, first in results if first is not None]
+    return tuple(data for data, _ in results) + (min(changes) if changes else None,)# }}}
+
+
+def parse_files(parse, files, pool=None):
+    # results of parse for every file, in the order of files
+    if pool is None:
+        return [parse(filename) for filename in files]
+    return list(pool.map(parse, files))
 
 
 def read_exo(path_unzipdata):# {{{
@@ -91,8 +345,7 @@ def read_exo(path_unzipdata):# {{{
     """
 
     allfiles = os.listdir(path_unzipdata)
-    i = 0
-    data = []
+    frames = []
     for datefile in allfiles:
         datefile_path = path_unzipdata #os.path.join(path_unzipdata, datefile)
         exofiles = [x for x in os.listdir(datefile_path) if ".csv" in x]
@@ -109,8 +362,9 @@ def read_exo(path_unzipdata):# {{{
                 exodata = exodata.drop('Date (MM/DD/YYYY)', axis=0)
             exodata = exodata.reset_index()
             exodata['Datetime'] = pd.to_datetime(exodata['Date (MM/DD/YYYY)'] + ' ' + exodata['Time (HH:mm:ss)'], format='%m/%d/%Y %H:%M:%S')
-            data = append_pddata(i, data, exodata)
-            i += 1
+            frames.append(exodata)
+    # joined once, not file by file
+    data = pd.concat(frames, axis=0)
     data = data.drop(['Site Name', 'Date (MM/DD/YYYY)', 'Time (HH:mm:ss)'], axis=1)
     data = data.set_index('Datetime')
     data = data.sort_index()
@@ -119,13 +373,14 @@ def read_exo(path_unzipdata):# {{{
     return data #}}}
 
 
-def read_oldexo(path_unzipdata, path_exo2):# {{{
+def read_oldexo(path_unzipdata, path_exo2, pool=None):# {{{
     """TODO: Docstring for read_exo.
 
     Parameters
     ----------
     path_unzipdata : TODO
     path_exo2: TODO
+    pool: process pool parsing the files (None: in this process)
 
     Returns
     -------
@@ -133,34 +388,11 @@ def read_oldexo(path_unzipdata, path_exo2):# {{{
 
     """
 
-    i = 0
-    data = []
-    datefile_path = os.path.join(path_exo2)
-    exofiles = [x for x in os.listdir(datefile_path) if ".xls" in x]
-    for exofile in exofiles:
-        exofile_path = os.path.join(datefile_path, exofile)
-        logging.info('Reading file: %s' % exofile_path)
-        idx = find_firstcol(exofile_path)
-        exodata = pd.read_excel(exofile_path, skiprows=idx, parse_dates=[['Date (MM/DD/YYYY)', 'Time (HH:MM:SS)']])
-
-        #exodata = exodata.dropna()
-        #exodata = exodata.set_index('Date (MM/DD/YYYY)')
-        #if 'Date (MM/DD/YYYY)' in exodata.index.values:
-        #    exodata = exodata.drop('Date (MM/DD/YYYY)', axis=0)
-        #exodata = exodata.reset_index()
-        #exodata['Datetime'] = 
-        #pd.to_datetime(exodata['Date (MM/DD/YYYY)'].dt.strftime('%m/%d/%Y') + ' ' + exodata['Time (HH:MM:SS)'], format='%m/%d/%Y %H:%M:%S')
-        data = append_pddata(i, data, exodata)
-        i += 1
-    if not pd.DataFrame(data).empty:
-        data = data.drop(['Site Name'], axis=1)# 'Date (MM/DD/YYYY)', 'Time (HH:mm:ss)'], axis=1)
-        data.rename(columns={'Date (MM/DD/YYYY)_Time (HH:MM:SS)':'Datetime'}, inplace=True)
-        data = data.set_index('Datetime')
+    frames = parse_files(parse_exo, exo_files(path_exo2), pool)
+    data = pd.concat(frames, axis=0) if frames else pd.DataFrame()
+    if not data.empty:
         data = data.sort_index()
-        data = data.astype(float)
         data = data.resample("1T").mean()
-    else:
-        data = pd.DataFrame(data)
     return data #}}}
     """# {{{
     dt = np.dtype([('Date', 'str'), ('Time', 'str'), ('Time_fract', 'int'),
@@ -178,121 +410,165 @@ def read_oldexo(path_unzipdata, path_exo2):# {{{
             __import__('pdb').set_trace()
     """# }}}
 
-def read_gps(path_unzipdata):# {{{
+
+def exo_files(path_exo2):
+    # EXO workbooks (.xls, .xlsx) of the folder
+    return [os.path.join(path_exo2, x) for x in sorted(os.listdir(path_exo2)) if ".xls" in x]
+
+
+def parse_exo(exofile_path):# {{{
+    """Rows of an EXO workbook (Datetime index, float columns)."""
+    logging.info('Reading file: %s' % exofile_path)
+    idx = find_firstcol(exofile_path)
+    exodata = pd.read_excel(exofile_path, skiprows=idx, parse_dates=[['Date (MM/DD/YYYY)', 'Time (HH:MM:SS)']])
+    exodata = exodata.drop(['Site Name'], axis=1)# 'Date (MM/DD/YYYY)', 'Time (HH:mm:ss)'], axis=1)
+    exodata.rename(columns={'Date (MM/DD/YYYY)_Time (HH:MM:SS)':'Datetime'}, inplace=True)
+    exodata = exodata.set_index('Datetime')
+    exodata = exodata.astype(float)
+
+    #exodata = exodata.dropna()
+    #exodata = exodata.set_index('Date (MM/DD/YYYY)')
+    #if 'Date (MM/DD/YYYY)' in exodata.index.values:
+    #    exodata = exodata.drop('Date (MM/DD/YYYY)', axis=0)
+    #exodata = exodata.reset_index()
+    #exodata['Datetime'] = 
+    #pd.to_datetime(exodata['Date (MM/DD/YYYY)'].dt.strftime('%m/%d/%Y') + ' ' + exodata['Time (HH:MM:SS)'], format='%m/%d/%Y %H:%M:%S')
+    return exodata# }}}
+
+def read_gps(path_unzipdata, pool=None):# {{{
     """TODO: Docstring for read_gps.{{{
 
     Parameters
     ----------
-    path_unzipdata: folder directory were the data processed is store
+    path_unzipdata: folder directory were the data processed is store (or
+        rawzip.ArchiveTree of the archives)
+    pool: process pool parsing the files (None: in this process)
 
     Returns
     -------
     data: dataframe with gps data
 
     """# }}}
-    import gpxpy
-    import gpxpy.gpx
+    frames = [f for f in parse_files(parse_gpx, gps_files(path_unzipdata), pool) if not f.empty]
+    if frames:
+        data = pd.concat(frames, axis=0)
+        data = data.resample("1T").mean()
+    else:
+        data = pd.DataFrame({'Datetime': [], 'Latitude': [], 'Longitude': []}).set_index('Datetime')
+    return data# }}}
 
-    allfiles = os.listdir(path_unzipdata)
-    time = []
-    lat = []
-    lon = []
-    for datefolder in allfiles:
+def gps_files(path_unzipdata):# {{{
+    # gpx files of the GPS folder of every date folder (folder or rawzip tree)
+    tree = raw_tree(path_unzipdata)
+    files = []
+    for datefolder in sorted(tree.listdir()):
         logging.info('Reading data: %s', datefolder)
-        datefolder_path = os.path.join(path_unzipdata, datefolder)
-        gpsfolder = [x for x in os.listdir(datefolder_path) if 'GPS' in x]
+        gpsfolder = [x for x in sorted(tree.listdir(datefolder)) if 'GPS' in x]
         try:
             gpsfolder = gpsfolder[0]
         except IndexError:
-            logging.warning('GPS folder does not found in: %s', datefolder_path)
+            logging.warning('GPS folder does not found in: %s', tree.path(datefolder))
             continue
-        gpsfolder_path = os.path.join(datefolder_path, gpsfolder)
-        for gpsfile in os.listdir(gpsfolder_path):
-            logging.info('Reading file: %s' % gpsfile)
-            try:
-                gpxfile = open(os.path.join(gpsfolder_path, gpsfile), 'r')
-                gpx = gpxpy.parse(gpxfile)
-                for track in gpx.tracks:
-                    for segment in track.segments:
-                        for point in segment.points:
-                            try:
-                                time.append(point.time.replace(tzinfo=None))
-                                lat.append(point.latitude)
-                                lon.append(point.longitude)
-                            except Exception:
-                                logging.warning('GPS point without time value: lat %.1f lon %.1f' % (point.latitude, point.longitude))
-            except Exception:
-                logging.error('No GPS file for: %s', datefolder)
-    d = {'Datetime': time, 'Latitude': lat, 'Longitude': lon}
-    data = pd.DataFrame(data=d)
-    data = data.set_index('Datetime')
-    if not data.empty:
-        data = data.resample("1T").mean()
-    else:
-        data = pd.DataFrame(data)
-    return data# }}}
+        gpsfolder_path = join(datefolder, gpsfolder)
+        files.extend(tree.path(join(gpsfolder_path, gpsfile)) for gpsfile in sorted(tree.listdir(gpsfolder_path)))
+    return files# }}}
 
-def append_pddata(i, data, newdata):# {{{
-    if i == 0:
-        data = newdata
-    else:
-        data = pd.concat([data, newdata], axis=0)
-    return data# }}}
+def parse_gpx(gpsfile):# {{{
+    """Points of a gpx file (Datetime index, Latitude, Longitude)."""
+    import gpxpy
+    import gpxpy.gpx
+
+    logging.info('Reading file: %s' % os.path.basename(gpsfile))
+    time = []
+    lat = []
+    lon = []
+    try:
+        with open_raw(gpsfile) as gpxfile:
+            gpx = gpxpy.parse(io.TextIOWrapper(gpxfile))
+        for track in gpx.tracks:
+            for segment in track.segments:
+                for point in segment.points:
+                    try:
+                        time.append(point.time.replace(tzinfo=None))
+                        lat.append(point.latitude)
+                        lon.append(point.longitude)
+                    except Exception:
+                        logging.warning('GPS point without time value: lat %.1f lon %.1f' % (point.latitude, point.longitude))
+    except Exception:
+        logging.error('No GPS file for: %s', gpsfile)
+    d = {'Datetime': time, 'Latitude': lat, 'Longitude': lon}
+    return pd.DataFrame(data=d).set_index('Datetime')# }}}
 
-def read_lgr(newpath):# {{{
+def read_lgr(newpath, pool=None):# {{{
     """Reading LGR file
     """
-    def footer_pos(LGRfile):# {{{
-        import zipfile
-        import io
-        """find footer position
-        """
-
-        zipf = zipfile.ZipFile(LGRfile)
-        f = zipf.namelist()[0]
-        content = io.BytesIO(zipf.read(f))
-        i = 0
-        foot = False
-        for line in content.readlines(): #zipf.read(f): #zipf.read(f):
-            if line.startswith(b'-----B'):
-                ib = i
-                foot = True
-            i += 1
-        if foot:
-            ifooter = i - ib
-        else:
-            ifooter = 0
-        return ifooter# }}}
-    data = []
-    i = 0
-    custom_parser = lambda x: datetime.strptime(x, "%m/%d/%Y %H:%M:%S.%f")
-    for alldata in os.listdir(newpath):
-        allfiles = os.path.join(newpath, alldata)
-        LGRfolderdata = [x for x in os.listdir(allfiles) if any(s in x for s in ('YB', 'AtmGHG', 'atmGHG'))]
+    frames = parse_files(parse_lgr, lgr_files(newpath), pool)
+    data = pd.concat(frames, axis=0)
+    data = data.sort_index()
+    data = data.resample("1T").mean()
+    return data# }}}
+
+def lgr_files(newpath):# {{{
+    # zipped LGR files of the YB or GHG folder of every date folder, by date
+    # (folder or rawzip tree)
+    tree = raw_tree(newpath)
+    files = []
+    for alldata in sorted(tree.listdir()):
+        LGRfolderdata = [x for x in sorted(tree.listdir(alldata)) if any(s in x for s in ('YB', 'AtmGHG', 'atmGHG'))]
         try:
             LGRfolderdata = LGRfolderdata[0]
         except IndexError:
-            logging.warning('YB or GHG folder does not found in: %s', allfiles)
+            logging.warning('YB or GHG folder does not found in: %s', tree.path(alldata))
             continue
-        LGRdatadate = os.path.join(allfiles, LGRfolderdata)
-        folderdates = os.listdir(LGRdatadate)
+        LGRdatadate = join(alldata, LGRfolderdata)
+        folderdates = tree.listdir(LGRdatadate)
         for date in sorted(folderdates): #NOT READING LAST DATE IN ZIPFILE
-            datadate = os.path.join(LGRdatadate, date)
-            filedate = os.listdir(datadate)
-            for lgrfile in filedate:
-                logging.info('Reading file: %s', lgrfile)
-                readfile = os.path.join(datadate, lgrfile)
-                ifoot = footer_pos(readfile)
-                ## Reading column 0 is time, column 7 [CH4]d_ppm and column 9 [CO2]d_ppm
-                rfile = pd.read_csv(readfile, sep=',', header=1, skipfooter=ifoot,
-                        squeeze=True,skipinitialspace=True, parse_dates=[0], index_col=[0], date_parser=custom_parser,
-                        usecols=[0, 3, 7, 9, 11, 13, 17, 19], engine='python', names=['Datetime', 'H20_ppm', 'CH4d_ppm', 'CO2d_ppm', 'GasP_torr', 'GasT_C', 'RD0_us', 'RD1_us'])
-                #rfile['Time'] = pd.to_datetime(rfile['Time'], format='%m/%d/%Y %H:%M:%S.%f')
-                data = append_pddata(i, data, rfile)
-                i += 1
-    data = data.sort_index()
-    data = data.resample("1T").mean()
-    return data# }}}
+            datadate = join(LGRdatadate, date)
+            files.extend(tree.path(join(datadate, lgrfile)) for lgrfile in sorted(tree.listdir(datadate)))
+    return files# }}}
+
+def parse_lgr(readfile):# {{{
+    """Rows of a zipped LGR file (Datetime index).
+
+    The file is decompressed once: the footer (signature from the last line
+    starting with '-----B') is found in the bytes, the rows above it are read
+    by the C parser of pandas and the timestamps are converted at once.
+    """
+    logging.info('Reading file: %s', os.path.basename(readfile))
+    with open_raw(readfile) as file, zf.ZipFile(file) as zipf:
+        content = zipf.read(zipf.namelist()[0])
+    ## Reading column 0 is time, column 7 [CH4]d_ppm and column 9 [CO2]d_ppm
+    rfile = pd.read_csv(io.BytesIO(content), sep=',', header=None, skiprows=2, nrows=lgr_rows(content),
+            skipinitialspace=True, usecols=LGR_USECOLS, dtype={0: str}, engine='c')
+    rfile.columns = LGR_NAMES
+    rfile.index = pd.DatetimeIndex(lgr_times(rfile.pop('Datetime').values), name='Datetime')
+    return rfile# }}}
+
+def lgr_rows(content):
+    # rows between the two header lines and the footer, None without footer
+    footer = content.rfind(b'\n-----B')
+    if footer < 0:
+        return None
+    return content.count(b'\n', 0, footer + 1) - 2
+
+def lgr_times(times):
+    # datetime64[ns] of the '%m/%d/%Y %H:%M:%S.%f' timestamps: rearranged to
+    # ISO and parsed by numpy when they all have the same width
+    raw = np.asarray(times, dtype='S')
+    width = raw.dtype.itemsize
+    chars = raw.view('u1').reshape(len(raw), width)
+    if len(raw) == 0 or width < 20 or (np.char.str_len(raw) != width).any() or \
+            (chars[:, [2, 5, 10, 13, 16, 19]] != np.frombuffer(b'// ::.', 'u1')).any():
+        return pd.to_datetime(times, format='%m/%d/%Y %H:%M:%S.%f').values
+    iso = np.empty_like(chars)
+    iso[:, 0:4] = chars[:, 6:10]
+    iso[:, 4] = ord('-')
+    iso[:, 5:7] = chars[:, 0:2]
+    iso[:, 7] = ord('-')
+    iso[:, 8:10] = chars[:, 3:5]
+    iso[:, 10] = ord('T')
+    iso[:, 11:] = chars[:, 11:]
+    return iso.view('S%i' % width).ravel().astype('datetime64[ns]')
 
 def copy_filelike_to_filelike(src, dst, bufsize=16384):# {{{
     while True:
@@ -0,0 +1,227 @@
+###########################################################
+# Live dataset refresh
+###########################################################
+"""Dataset served by the dashboard and its background refresh.
+
+A ``Dataset`` holds the pyramid of the merged data with its indexes and is
+not modified (see pyramid.py). The ``Refresher`` polls the data store; when
+rows were appended it resamples only the tail (see pyramid.extend_pyramid)
+and adds it to the spatial indexes, when the store was rewritten it reads it
+again, and then replaces its ``dataset`` attribute in one assignment.
+Callbacks take ``refresher.dataset`` once and keep working on that snapshot,
+unchanged, while a newer one is swapped in.
+
+With ``shared=True`` the pyramid is saved in the store folder (``pyramid/``)
+by the first process that needs it and memory-mapped by all the others, so
+gunicorn workers share one copy of the data in the page cache. The lock is
+the one of the store (datastore.store_lock), outside its folder: a store
+written again by read_data is swapped in only while no worker is building
+its pyramid, and the new folder gets its pyramid from the first worker.
+"""
+
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .aggregates import LevelStats
+from .datastore import META_FILE, TIME_COLUMN, open_store, read_store, store_lock
+from .pyramid import (build_pyramid, extend_pyramid, extend_saved_pyramid, load_pyramid, pyramid_source,
+                      save_pyramid, select_level, window)
+from .spatial import GridIndex
+
+PYRAMID_DIR = 'pyramid'
+# rows searched at once for the last position
+POSITION_BLOCK = 4096
+
+
+class Dataset:
+    """Pyramid of the data with its statistics and spatial indexes.# {{{
+
+    Parameters
+    ----------
+    pyramid : output of build_pyramid
+    nrows : number of rows of the store the pyramid was built from
+    end : Datetime of the last row of the store
+    budget : number of points of the coarse track drawn on dated maps
+    previous : Dataset of the store before rows were appended, whose spatial
+        indexes are extended with the rows from the last bin of each level
+
+    """# }}}
+
+    def __init__(self, pyramid, nrows=None, end=None, budget=5000, previous=None):
+        self.pyramid = pyramid
+        self.data = pyramid[0][1]
+        self.nrows = nrows
+        self.end = end
+        # range statistics (mean, min, max) of each level in constant time
+        self.levelstats = {rule: LevelStats(level) for rule, level in pyramid}
+        # spatial index of each level for map selections (box and lasso)
+        self.gridindex = {}
+        levels = dict(previous.pyramid) if previous is not None else {}
+        for rule, level in pyramid:
+            if rule in levels:
+                start = max(len(levels[rule]['Datetime']) - 1, 0)
+                self.gridindex[rule] = previous.gridindex[rule].extend(level['Latitude'], level['Longitude'], start)
+            else:
+                self.gridindex[rule] = GridIndex(level['Latitude'], level['Longitude'])
+        # coarse view of the whole track
+        self.track = window(*select_level(pyramid, budget=budget)[1:])
+
+    @classmethod
+    def from_store(cls, path, budget=5000, shared=False):
+        times = open_store(path)[TIME_COLUMN]
+        end = times[-1].view('datetime64[ns]') if len(times) else None
+        build = lambda: build_pyramid(read_store(path))
+        if shared:
+            pyramid = shared_pyramid(path, len(times), end, build)
+        else:
+            pyramid = build()
+        return cls(pyramid, len(times), end, budget)
+
+    def last_position(self):
+        """Latitude, longitude and Datetime of the last row with a position."""
+        # blocks from the end, the last position is usually in the last rows
+        lat, lon = self.data['Latitude'], self.data['Longitude']
+        end = len(lat)
+        while end > 0:
+            start = max(0, end - POSITION_BLOCK)
+            valid = np.flatnonzero(~np.isnan(lat[start:end]) & ~np.isnan(lon[start:end]))
+            if len(valid):
+                i = start + valid[-1]
+                return lat[i], lon[i], self.data['Datetime'][i]
+            end = start
+        return np.nan, np.nan, None
+
+
+def shared_pyramid(path, nrows, end, build, previous=None):
+    """Pyramid of the store saved in its folder, build() called if missing.# {{{
+
+    The first process taking the lock builds and saves the pyramid for the
+    current rows of the store (or extends the saved one when rows were
+    appended); the others, and the next starts, map the saved levels.
+
+    Parameters
+    ----------
+    path : folder of the data store
+    nrows, end : number of rows and last Datetime of the store
+    build : function returning the pyramid of the store
+    previous : number of rows and last Datetime of the store before rows
+        were appended, a pyramid saved for them is extended
+        (pyramid.extend_saved_pyramid) instead of built again
+
+    """# }}}
+    source = store_source(nrows, end)
+    cache = os.path.join(path, PYRAMID_DIR)
+    with store_lock(path) as locked:
+        if not locked:
+            logging.warning('Pyramid not shared, cannot write next to %s', path)
+            return build()
+        saved = pyramid_source(cache)
+        if saved != source and previous is not None and saved == store_source(*previous):
+            extend_saved_pyramid(cache, open_store(path), source)
+            logging.info('Pyramid extended: %s', cache)
+        elif saved != source:
+            save_pyramid(build(), cache, source)
+            logging.info('Pyramid saved: %s', cache)
+        return load_pyramid(cache)
+
+
+def store_source(nrows, end):
+    # source of the pyramid of a store of nrows rows ending at end
+    return {'nrows': int(nrows), 'end': str(end)}
+
+
+def store_signature(path):
+    """Changes when meta.json is written again (append or new store)."""
+    stat = os.stat(os.path.join(path, META_FILE))
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class Refresher:
+    """Background thread swapping in the new rows of a data store.# {{{
+
+    Parameters
+    ----------
+    path : folder of the data store
+    dataset : Dataset currently served (built from the store)
+    interval : seconds between two checks of the store
+    budget : passed to the new Dataset
+    shared : share the pyramid of the new rows between processes
+        (see shared_pyramid)
+    on_swap : function(old, new, since) called after a swap, since is the
+        first Datetime whose resampled values changed (None: all of them)
+
+    """# }}}
+
+    def __init__(self, path, dataset, interval=60, budget=5000, shared=False, on_swap=None):
+        self.path = path
+        self.dataset = dataset
+        self.interval = interval
+        self.budget = budget
+        self.shared = shared
+        self.on_swap = on_swap
+        self._signature = store_signature(path)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def check(self):
+        """Swap in the changes of the store, True when the dataset changed."""
+        signature = store_signature(self.path)
+        if signature == self._signature:
+            return False
+        old = self.dataset
+        columns = open_store(self.path)
+        times = columns[TIME_COLUMN]
+        end = times[-1].view('datetime64[ns]') if len(times) else None
+        if self._appended(old, columns):
+            build = lambda: extend_pyramid(old.pyramid, columns)
+            previous = old
+            # the last (daily) bin of the coarsest level is the first to change
+            since = old.pyramid[-1][1]['Datetime'][-1]
+            logging.info('Data store: %i new rows', len(times) - old.nrows)
+        else:
+            build = lambda: build_pyramid(read_store(self.path))
+            previous = since = None
+            logging.info('Data store: new store of %i rows', len(times))
+        if self.shared:
+            pyramid = shared_pyramid(self.path, len(times), end, build,
+                                     (previous.nrows, previous.end) if previous is not None else None)
+        else:
+            pyramid = build()
+        new = Dataset(pyramid, len(times), end, self.budget, previous)
+        self.dataset = new
+        self._signature = signature
+        if self.on_swap is not None:
+            self.on_swap(old, new, since)
+        return True
+
+    def _appended(self, old, columns):
+        # same columns and the old rows are still the first ones
+        times = columns[TIME_COLUMN]
+        n = old.nrows
+        if not n or set(columns) != set(old.data) or len(times) <= n:
+            return False
+        return times[n - 1].view('datetime64[ns]') == old.end
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception('Data store refresh failed: %s', self.path)
+
+    def start(self):
+        """Start the thread (again in a forked worker), once per process."""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name='data-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
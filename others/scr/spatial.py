@@ -0,0 +1,163 @@
+###########################################################
+# Spatial index
+###########################################################
+"""Grid index over Latitude/Longitude for "points in region" queries.
+
+Points are kept per grid cell (positions sorted in every cell), so the
+candidates of a bounding box are the cells found with searchsorted in the
+sorted cells; they are then tested exactly (box limits or a vectorised
+point-in-polygon test). Rows appended to the coordinates are added to the
+cells they fall in (GridIndex.extend), the other cells being shared with the
+index before. Longitudes are not wrapped around the antimeridian.
+"""
+
+import copy
+
+import numpy as np
+
+
+def mercator(lat):
+    """Web mercator y of latitudes (map selections are drawn in this space)."""
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    return np.log(np.tan(np.pi/4 + lat/2))
+
+
+def points_in_polygon(x, y, polygon):
+    """Mask of the points (x, y) inside polygon [[x, y], ...] (even-odd rule)."""
+    polygon = np.asarray(polygon, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    px = polygon[:, 0]
+    py = polygon[:, 1]
+    for j in range(len(polygon)):
+        x0, y0 = px[j - 1], py[j - 1]
+        x1, y1 = px[j], py[j]
+        if y0 == y1:
+            continue
+        crosses = (y0 > y) != (y1 > y)
+        xcross = x0 + (y - y0)*(x1 - x0)/(y1 - y0)
+        inside ^= crosses & (x < xcross)
+    return inside
+
+
+class GridIndex:
+    """Positions of the points inside a box or polygon.# {{{
+
+    Parameters
+    ----------
+    lat, lon : arrays of coordinates (NaN for missing positions)
+    cell : size of the grid cells in degrees
+
+    """# }}}
+
+    def __init__(self, lat, lon, cell=0.25):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cell = cell
+        self.ncols = int(np.ceil(360/cell)) + 1
+        # cell id -> sorted positions of the points in the cell
+        self.buckets = dict(self._buckets(0))
+        # sorted cell ids and the last position in each of them
+        self.cells = np.array(sorted(self.buckets), dtype='int64')
+        self.lasts = np.array([self.buckets[cellid][-1] for cellid in self.cells.tolist()], dtype='int64')
+
+    def extend(self, lat, lon, start):
+        """Index of new coordinates whose rows before start are the ones indexed.# {{{
+
+        The rows of this index from start on are removed from their cells and
+        the rows of lat, lon from start on are added to theirs, so the work
+        is the one of the rows from start and of the list of cells. This
+        index is left as it is.
+
+        Parameters
+        ----------
+        lat, lon : arrays of coordinates, the same as the ones of this index
+            before row start
+        start : first row that changed
+
+        """# }}}
+        new = copy.copy(self)
+        new.lat = np.asarray(lat, dtype=float)
+        new.lon = np.asarray(lon, dtype=float)
+        new.buckets = dict(self.buckets)
+        # cells holding rows from start (at the end of their positions)
+        touched = set(self.cells[self.lasts >= start].tolist())
+        for cellid in touched:
+            kept = self.buckets[cellid][:np.searchsorted(self.buckets[cellid], start)]
+            if len(kept):
+                new.buckets[cellid] = kept
+            else:
+                del new.buckets[cellid]
+        for cellid, positions in new._buckets(start):
+            bucket = new.buckets.get(cellid)
+            new.buckets[cellid] = positions if bucket is None else np.concatenate([bucket, positions])
+            touched.add(cellid)
+        # the touched cells taken out of the sorted cells and put back
+        keep = ~np.isin(self.cells, list(touched))
+        cells = np.array(sorted(cellid for cellid in touched if cellid in new.buckets), dtype='int64')
+        lasts = np.array([new.buckets[cellid][-1] for cellid in cells.tolist()], dtype='int64')
+        at = np.searchsorted(self.cells[keep], cells)
+        new.cells = np.insert(self.cells[keep], at, cells)
+        new.lasts = np.insert(self.lasts[keep], at, lasts)
+        return new
+
+    def _buckets(self, start):
+        # (cell id, sorted positions) of the points from row start
+        valid = start + np.flatnonzero(~np.isnan(self.lat[start:]) & ~np.isnan(self.lon[start:]))
+        cellids = self._cellid(self.lat[valid], self.lon[valid])
+        order = np.argsort(cellids, kind='stable')
+        cellids, valid = cellids[order], valid[order]
+        cells, firsts = np.unique(cellids, return_index=True)
+        return zip(cells.tolist(), np.split(valid, firsts[1:]))
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) + 90)/self.cell).astype('int64')
+
+    def _col(self, lon):
+        return np.floor((np.asarray(lon) + 180)/self.cell).astype('int64')
+
+    def _cellid(self, lat, lon):
+        return self._row(lat)*self.ncols + self._col(lon)
+
+    def _candidates(self, lat0, lat1, lon0, lon1, rows=None):
+        # positions in the cells covering the box (of rows first to end)
+        c0 = self._col(lon0)
+        c1 = self._col(lon1)
+        buckets = []
+        for row in range(self._row(lat0), self._row(lat1) + 1):
+            j0 = np.searchsorted(self.cells, row*self.ncols + c0, side='left')
+            j1 = np.searchsorted(self.cells, row*self.ncols + c1, side='right')
+            buckets.extend(self.buckets[cellid] for cellid in self.cells[j0:j1].tolist())
+        if rows is not None:
+            first, end = rows
+            buckets = [bucket[np.searchsorted(bucket, first):np.searchsorted(bucket, end)] for bucket in buckets]
+        if not buckets:
+            return np.empty(0, dtype='int64')
+        return np.concatenate(buckets)
+
+    def query_box(self, lat0, lat1, lon0, lon1, rows=None):
+        """Sorted positions of the points with lat0 <= lat <= lat1, lon0 <= lon <= lon1.
+
+        rows (first, end) keeps the positions first <= position < end only,
+        the work is then the one of the points of these rows in the box.
+        """
+        lat0, lat1 = sorted((lat0, lat1))
+        lon0, lon1 = sorted((lon0, lon1))
+        cand = self._candidates(lat0, lat1, lon0, lon1, rows)
+        lat = self.lat[cand]
+        lon = self.lon[cand]
+        inside = (lat >= lat0) & (lat <= lat1) & (lon >= lon0) & (lon <= lon1)
+        return np.sort(cand[inside])
+
+    def query_polygon(self, polygon, rows=None):
+        """Sorted positions of the points inside polygon [[lon, lat], ...].
+
+        The test is done in web mercator coordinates, as drawn by a lasso on
+        the map. rows (first, end) as for query_box.
+        """
+        polygon = np.asarray(polygon, dtype=float)
+        lon = polygon[:, 0]
+        lat = polygon[:, 1]
+        cand = self._candidates(lat.min(), lat.max(), lon.min(), lon.max(), rows)
+        projected = np.column_stack([lon, mercator(lat)])
+        inside = points_in_polygon(self.lon[cand], mercator(self.lat[cand]), projected)
+        return np.sort(cand[inside])
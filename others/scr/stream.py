@@ -0,0 +1,298 @@
+###########################################################
+# Streaming ingest
+###########################################################
+"""Raw files binned to 1 minute and written block by block.
+
+The readers of read_data give the rows of one file at a time (a chunk:
+Datetime index, float columns). Instead of joining every file before
+resampling, the chunks go through:
+
+- ``parse_stream``: the chunks of a list of files in order, at most
+  ``ahead`` files parsed in advance by the process pool
+- ``Bins``: sums and counts per bin (1 minute, 10 minutes) of the chunks.
+  Every chunk must start at or after the first row of the chunk before (the
+  files are listed by date), so the bins before its first row are finished
+  and given out as means, every bin from the first to the last as with
+  resample; a bin spanning two files stays open until both are read
+- ``join_blocks``: the 1-minute blocks of the LGR data with the GPS and EXO
+  columns of the same minutes (left join)
+
+The memory used is the one of a few files and of the open bins, whatever
+the number of days read. Chunks out of order or with new columns raise
+``StreamError`` and read_data reads the files in memory instead.
+"""
+
+import collections
+import csv
+import os
+
+import pandas as pd
+
+BLOCK = 10080  # bins per block given out (a week of minutes)
+
+
+class StreamError(ValueError):
+    """Chunks the stream cannot bin (out of order or with new columns)."""
+
+
+def parse_stream(parse, files, pool=None, ahead=2):
+    """Rows of every file in the order of files, at most ahead files parsed in advance."""
+    if pool is None:
+        for filename in files:
+            yield parse(filename)
+        return
+    pending = collections.deque()
+    for filename in files:
+        pending.append(pool.submit(parse, filename))
+        if len(pending) > ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class Bins:
+    """Means per bin of chunks of rows arriving in time order.# {{{
+
+    Parameters
+    ----------
+    freq : size of the bins ('T': 1 minute)
+    block : maximum number of bins of the frames given out
+
+    """# }}}
+
+    def __init__(self, freq='T', block=BLOCK):
+        self.freq = freq
+        self.step = pd.Timedelta(pd.tseries.frequencies.to_offset(freq))
+        self.block = block
+        self.columns = None
+        self.sums = self.counts = None
+        self.next = None  # first bin not given out
+        self.last = None  # last bin with rows
+
+    def add(self, chunk):
+        """Add the rows of chunk, yield the finished bins (before its first row)."""
+        if chunk.empty:
+            return
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        elif not set(chunk.columns) <= set(self.columns):
+            raise StreamError('new columns %s' % sorted(set(chunk.columns) - set(self.columns)))
+        bins = chunk.index.floor(self.freq)
+        start, end = bins.min(), bins.max()
+        if self.next is not None and start < self.next:
+            raise StreamError('rows at %s after the bins up to %s were written' % (chunk.index.min(), self.next))
+        groups = chunk.reindex(columns=self.columns).groupby(bins)
+        sums, counts = groups.sum(), groups.count().astype(float)
+        if self.sums is None or self.sums.empty:
+            self.sums, self.counts = sums, counts
+        else:
+            self.sums = self.sums.add(sums, fill_value=0)
+            self.counts = self.counts.add(counts, fill_value=0)
+        if self.next is None:
+            self.next = start
+        self.last = end if self.last is None else max(self.last, end)
+        yield from self.pop(start)
+
+    def close(self):
+        """Yield the bins left."""
+        if self.next is not None:
+            yield from self.pop(self.last + self.step)
+
+    def pop(self, before):
+        # means of every bin from next to before (excluded), block by block
+        while self.next < before:
+            periods = min(self.block, (before - self.next)//self.step)
+            index = pd.date_range(self.next, periods=periods, freq=self.freq, name=self.sums.index.name)
+            done = self.sums.index <= index[-1]
+            sums, counts = self.sums[done], self.counts[done]
+            self.sums, self.counts = self.sums[~done], self.counts[~done]
+            self.next = index[-1] + self.step
+            yield (sums.where(counts > 0)/counts.where(counts > 0)).reindex(index)
+
+
+class BinnedStream:
+    """Finished 1-minute bins of the chunks of a source, block by block."""
+
+    def __init__(self, chunks, freq='T'):
+        self.chunks = iter(chunks)
+        self.bins = Bins(freq)
+        self.pending = None
+
+    @property
+    def columns(self):
+        # columns of the first chunk with rows (read ahead), None without rows
+        while self.bins.columns is None and self.pending is None:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return None
+            if not chunk.empty:
+                self.pending = chunk
+        return self.bins.columns if self.bins.columns is not None else list(self.pending.columns)
+
+    def __iter__(self):
+        if self.pending is not None:
+            chunk, self.pending = self.pending, None
+            yield from self.bins.add(chunk)
+        for chunk in self.chunks:
+            yield from self.bins.add(chunk)
+        yield from self.bins.close()
+
+
+class Cursor:
+    # rows of a stream of blocks on minutes asked in time order
+    def __init__(self, blocks, columns):
+        self.blocks = iter(blocks)
+        self.columns = columns
+        self.buffer = []
+        self.done = False
+
+    def take(self, index):
+        while not self.done and (not self.buffer or self.buffer[-1].index[-1] < index[-1]):
+            block = next(self.blocks, None)
+            if block is None:
+                self.done = True
+            else:
+                self.buffer.append(block)
+        self.buffer = [block for block in self.buffer if block.index[-1] >= index[0]]
+        if not self.buffer:
+            return pd.DataFrame(index=index, columns=self.columns, dtype=float)
+        return pd.concat(self.buffer).reindex(index=index, columns=self.columns)
+
+
+def join_blocks(base, others):
+    """Blocks of base with the columns of the other streams on the same minutes.
+
+    Streams without rows add no columns, as the join of empty frames in
+    read_data.
+    """
+    cursors = [Cursor(stream, stream.columns) for stream in others if stream.columns is not None]
+    for block in base:
+        yield pd.concat([block] + [cursor.take(block.index) for cursor in cursors], axis=1)
+
+
+class CsvWriter:
+    """Frames written one after the other as one csv with a running row number.
+
+    The rows go to a temporary file that replaces filename on close, so an
+    interrupted write leaves the previous file. close gives a summary of the
+    rows written (file, rows, first and last time, columns) instead of the
+    rows themselves.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmpfile = filename + '.tmp'
+        self.file = open(self.tmpfile, 'w')
+        self.nrows = 0
+        self.start = self.end = self.columns = None
+        self.header = True
+
+    def write(self, data):
+        if data.empty:
+            return
+        if self.start is None:
+            self.start, self.columns = data.index[0], list(data.columns)
+        self.end = data.index[-1]
+        data = data.reset_index()
+        data.index = pd.RangeIndex(self.nrows, self.nrows + len(data))
+        # the format of a whole frame (a block of midnights alone would be dates)
+        data.to_csv(self.file, header=self.header, date_format='%Y-%m-%d %H:%M:%S')
+        self.header = False
+        self.nrows += len(data)
+
+    def close(self):
+        """Replace filename with the rows written, return their summary."""
+        self.file.close()
+        os.replace(self.tmpfile, self.filename)
+        return {'file': self.filename, 'rows': self.nrows, 'start': self.start, 'end': self.end,
+                'columns': self.columns}
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmpfile)
+
+
+class CsvAppender(CsvWriter):
+    """Frames written after the rows of an existing csv before a time.# {{{
+
+    The rows of filename from since on are cut and the frames written after
+    the ones before, in place (the file is found from its end, so only the
+    rows cut are read). An interrupted write leaves the file cut or partly
+    written: read_data writes the manifest after the outputs, so the next
+    run writes the same rows again.
+
+    Parameters
+    ----------
+    filename : csv written by CsvWriter
+    since : time of the first row written again
+    columns : columns of the frames, ValueError if they are not the ones of
+        the file or if no row of the file is before since (the file is then
+        written again with CsvWriter)
+
+    """# }}}
+
+    def __init__(self, filename, since, columns):
+        if not os.path.exists(filename):
+            raise ValueError('No csv to append to: %s' % filename)
+        with open(filename, 'rb') as file:
+            header = file.readline()
+            names = next(csv.reader([header.decode()]), [])
+            if names[1:] != ['Datetime'] + list(columns):
+                raise ValueError('Columns of the new rows do not match the csv %s' % filename)
+            first = row_time(file.readline())
+            size = file.seek(0, os.SEEK_END)
+            cut, last = size, None
+            for offset, line in last_lines(file, len(header)):
+                # a last line without its end of line is cut
+                last = row_time(line) if offset + len(line) < size else None
+                if last is not None and last[1] < since:
+                    break
+                cut, last = offset, None
+        if first is None or last is None:
+            raise ValueError('No row of the csv before %s: %s' % (since, filename))
+        os.truncate(filename, cut)
+        self.filename = filename
+        self.file = open(filename, 'a')
+        self.nrows = last[0] + 1
+        self.start, self.end, self.columns = first[1], last[1], list(columns)
+        self.header = False
+
+    def close(self):
+        """Close filename, return the summary of all its rows."""
+        self.file.close()
+        return {'file': self.filename, 'rows': self.nrows, 'start': self.start, 'end': self.end,
+                'columns': self.columns}
+
+    def abort(self):
+        # the rows cut are written again by the next run
+        self.file.close()
+
+
+def row_time(line):
+    # row number and time of a line of a csv of CsvWriter, None if it is not one
+    fields = line.split(b',', 2)
+    try:
+        return int(fields[0]), pd.Timestamp(fields[1].decode())
+    except (IndexError, ValueError):
+        return None
+
+
+def last_lines(file, start, size=1 << 16):
+    # (offset, line) of the lines of a binary file after the offset start, the
+    # last one first, reading the file from its end
+    pos, rest = file.seek(0, os.SEEK_END), b''
+    while pos > start:
+        step = min(size, pos - start)
+        pos -= step
+        file.seek(pos)
+        lines = (file.read(step) + rest).split(b'\n')
+        # the first line read may start before pos
+        rest = lines.pop(0) if pos > start else b''
+        offset = pos + len(rest) + 1 if pos > start else pos
+        offsets = []
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line) + 1
+        for offset, line in reversed(list(zip(offsets, lines))):
+            if line:
+                yield offset, line